@@ -0,0 +1,56 @@
+"""
+compares parse_response with the BeautifulSoup based parse_response_soup on the saved fixture pages.
+
+usage: python benchmarks/extract.py [--repeat 20]
+"""
+import argparse
+import pathlib
+import timeit
+
+from proxy_random.extract import parse_response, parse_response_soup
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+FIELDS = (
+    "ip",
+    "port",
+    "country_code",
+    "country",
+    "anonymity",
+    "google",
+    "https",
+    "last_checked",
+    "type",
+)
+
+
+def same_output(page: str) -> bool:
+    fast, soup = parse_response(page), parse_response_soup(page)
+    return len(fast) == len(soup) and all(
+        getattr(a, field) == getattr(b, field)
+        for a, b in zip(fast, soup)
+        for field in FIELDS
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'page':<24} {'proxies':>8} {'soup':>10} {'fast':>10} {'speedup':>8}")
+    for path in sorted(FIXTURES.glob("*.html")):
+        page = path.read_text(encoding="utf-8")
+        if not same_output(page):
+            raise SystemExit(f"{path.name}: parse_response output differs from parse_response_soup")
+
+        soup = timeit.timeit(lambda: parse_response_soup(page), number=args.repeat) / args.repeat
+        fast = timeit.timeit(lambda: parse_response(page), number=args.repeat) / args.repeat
+        print(
+            f"{path.name:<24} {len(parse_response(page)):>8} {soup * 1000:>8.2f}ms"
+            f" {fast * 1000:>8.2f}ms {soup / fast:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
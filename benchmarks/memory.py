@@ -0,0 +1,64 @@
+"""
+compares the memory used by a list of Proxy objects and ProxyColumns.
+
+usage: python benchmarks/memory.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import Iterator
+
+from proxy_random.columns import ProxyColumns
+from proxy_random.proxy import Proxy
+
+COUNTRIES = [("US", "United States"), ("DE", "Germany"), ("FR", "France"), ("BR", "Brazil")]
+ANONYMITIES = ["elite proxy", "anonymous", "transparent"]
+NOW = time.time()
+
+
+def generate_proxies(size: int) -> Iterator[Proxy]:
+    """generates proxies like the extractor does (every field is a new string)."""
+    for i in range(size):
+        country_code, country = random.choice(COUNTRIES)
+        yield Proxy(
+            ip=f"{10 + i % 200}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            port=random.choice([80, 443, 3128, 8080]),
+            country_code="".join(country_code),
+            country="".join(country),
+            anonymity="".join(random.choice(ANONYMITIES)),
+            google=random.random() < 0.1,
+            https=random.random() < 0.5,
+            last_checked=NOW - random.randint(1, 59),
+        )
+
+
+def measure(build, size: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    pool = build(generate_proxies(size))
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del pool
+    return used
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'proxies':>10} {'list[Proxy]':>14} {'ProxyColumns':>14} {'ratio':>7}")
+    for size in args.sizes:
+        objects = measure(list, size)
+        columns = measure(ProxyColumns, size)
+        print(
+            f"{size:>10} {objects / 2 ** 20:>12.1f}MB {columns / 2 ** 20:>12.1f}MB"
+            f" {objects / columns:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+synthetic proxy list pages in the markup of the built-in providers.
+"""
+import random
+
+COUNTRIES = [
+    ("US", "United States"),
+    ("DE", "Germany"),
+    ("FR", "France"),
+    ("BR", "Brazil"),
+    ("IN", "India"),
+    ("ID", "Indonesia"),
+]
+ANONYMITIES = ["elite proxy", "anonymous", "transparent"]
+PORTS = [80, 443, 3128, 8080, 8888, 999]
+
+HEADER = (
+    "<html><head><title>Free Proxy List</title></head><body>"
+    '<section id="list"><div class="table-responsive fpl-list">'
+    '<table class="table table-striped table-bordered"><thead><tr>'
+    "<th>IP Address</th><th>Port</th><th>Code</th><th class='hm'>Country</th>"
+    "<th>Anonymity</th><th class='hm'>Google</th><th class='hx'>Https</th>"
+    "<th class='hm'>Last Checked</th></tr></thead><tbody>"
+)
+ROW = (
+    "<tr><td>{ip}</td><td>{port}</td><td>{code}</td><td class='hm'>{country}</td>"
+    "<td>{anonymity}</td><td class='hm'>{google}</td><td class='hx'>{https}</td>"
+    "<td class='hm'>{last_checked}</td></tr>"
+)
+FOOTER = "</tbody></table></div></section></body></html>"
+
+
+def proxy_list_page(size: int, https_only: bool = False, seed: int = 0) -> str:
+    """returns a proxy list page with `size` rows.
+
+    :param size: number of proxies in the page
+    :type size: int
+    :param https_only: whether all proxies support https (like sslproxies.org), defaults to False
+    :type https_only: bool, optional
+    :param seed: seed of the random fields, defaults to 0
+    :type seed: int, optional
+    :return: the page
+    :rtype: str
+    """
+    rand = random.Random(seed)
+    rows = []
+    for i in range(size):
+        code, country = rand.choice(COUNTRIES)
+        rows.append(
+            ROW.format(
+                ip=f"{rand.randint(1, 223)}.{rand.randint(0, 255)}.{i >> 8 & 255}.{i & 255}",
+                port=rand.choice(PORTS),
+                code=code,
+                country=country,
+                anonymity=rand.choice(ANONYMITIES),
+                google="yes" if rand.random() < 0.1 else "no",
+                https="yes" if https_only or rand.random() < 0.5 else "no",
+                last_checked=f"{rand.randint(1, 59)} {rand.choice(['secs', 'mins'])} ago",
+            )
+        )
+
+    return HEADER + "".join(rows) + FOOTER
@@ -0,0 +1,245 @@
+"""
+local stand-in providers and proxies for offline benchmarks.
+a working proxy answers plain http requests itself (like httpbin.org/headers, so any test url works)
+and tunnels CONNECT requests to the requested address.
+"""
+import asyncio
+import json
+import random
+import socket
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from pages import proxy_list_page
+from proxy_random.proxy import Proxy
+
+HOST = "127.0.0.1"
+
+
+class ProviderServer:
+    """serves synthetic proxy list pages, /list/<size>/<seed> returns a page with <size> proxies.
+    pages with the same seed list the same proxies, the pages are built once.
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.port = 0
+
+        self._pages: Dict[Tuple[int, int], str] = {}
+        self._runner: web.AppRunner = None
+
+    def url(self, size: int, seed: int = 0) -> str:
+        return f"http://{HOST}:{self.port}/list/{size}/{seed}"
+
+    async def _page(self, request: web.Request) -> web.Response:
+        key = (int(request.match_info["size"]), int(request.match_info["seed"]))
+        if key not in self._pages:
+            self._pages[key] = proxy_list_page(key[0], seed=key[1])
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        return web.Response(text=self._pages[key], content_type="text/html")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/list/{size}/{seed}", self._page)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, HOST, 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "ProviderServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+
+            writer.write(data)
+            await writer.drain()
+
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+
+    finally:
+        writer.close()
+
+
+class ProxyFarm:
+    """starts local proxies with the behaviours of free proxies:
+
+    - working: answers requests after `latency` seconds, the response echoes the received headers as json.
+      `failure_rate` of the responses are 502 errors.
+    - transparent: working, but adds X-Forwarded-For (fails the anonymity stage).
+    - hanging: accepts connections but never answers (passes the TCP stage, times out in the HTTP stage).
+    - refused: nothing listens on the port.
+    - blackhole: connecting never completes, like most dead free proxies. made with a listening
+      socket whose backlog is full, so the SYNs are dropped.
+    """
+
+    def __init__(
+        self,
+        working: int = 0,
+        transparent: int = 0,
+        hanging: int = 0,
+        refused: int = 0,
+        blackhole: int = 0,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.counts = {
+            "working": working,
+            "transparent": transparent,
+            "hanging": hanging,
+            "refused": refused,
+            "blackhole": blackhole,
+        }
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.proxies: List[Proxy] = []
+
+        self._random = random.Random(seed)
+
+        self._servers: List[asyncio.AbstractServer] = []
+        self._sockets: List[socket.socket] = []
+
+    async def start(self) -> List[Proxy]:
+        """starts the proxies.
+
+        :return: a Proxy for each started proxy, `kind` is set to its behaviour
+        :rtype: list[Proxy]
+        """
+        for kind, count in self.counts.items():
+            for _ in range(count):
+                port = await getattr(self, f"_start_{kind}")()
+                self.proxies.append(Proxy(ip=HOST, port=port, https=False, kind=kind))
+
+        return self.proxies
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+
+        for sock in self._sockets:
+            sock.close()
+
+        self._servers = []
+        self._sockets = []
+
+    async def _serve(self, transparent: bool) -> int:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await self._handle(reader, writer, transparent)
+
+        server = await asyncio.start_server(handle, HOST, 0)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def _start_working(self) -> int:
+        return await self._serve(transparent=False)
+
+    async def _start_transparent(self) -> int:
+        return await self._serve(transparent=True)
+
+    async def _start_hanging(self) -> int:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_server(handle, HOST, 0)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def _start_refused(self) -> int:
+        sock = socket.socket()
+        sock.bind((HOST, 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    async def _start_blackhole(self) -> int:
+        sock = socket.socket()
+        sock.bind((HOST, 0))
+        sock.listen(0)
+        port = sock.getsockname()[1]
+        self._sockets.append(sock)
+        # fill the backlog, the connections are never accepted.
+        for _ in range(2):
+            filler = socket.socket()
+            filler.setblocking(False)
+            try:
+                filler.connect((HOST, port))
+
+            except BlockingIOError:
+                pass
+
+            self._sockets.append(filler)
+
+        return port
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, transparent: bool
+    ) -> None:
+        try:
+            # keep-alive, the checkers reuse the connections.
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+                if method == "CONNECT":
+                    host, port = target.rsplit(":", 1)
+                    upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port))
+                    writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                    await asyncio.gather(
+                        _pipe(reader, upstream_writer), _pipe(upstream_reader, writer)
+                    )
+                    return
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if self.failure_rate and self._random.random() < self.failure_rate:
+                    writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+                    continue
+
+                headers = dict(line.split(": ", 1) for line in lines if ": " in line)
+                if transparent:
+                    headers["X-Forwarded-For"] = HOST
+
+                body = json.dumps({"origin": HOST, "headers": headers}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                )
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def __aenter__(self) -> "ProxyFarm":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
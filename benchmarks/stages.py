@@ -0,0 +1,66 @@
+"""
+compares the single request health check with the staged one (TCP connect, then HTTP) on local stand-in proxies.
+
+usage: python benchmarks/stages.py [--working 100] [--blackhole 400] [--refused 100] [--hanging 20] [--anonymity]
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from proxy_random.health import HealthChecker, Stage, anonymity_stage, http_stage, tcp_stage
+from servers import ProxyFarm
+
+# the proxies answer this themselves, nothing is resolved.
+TEST_URL = "http://test.invalid/headers"
+
+
+async def run(proxies: list, stages: List[Stage], timeout: float) -> HealthChecker:
+    for proxy in proxies:
+        proxy.verified = False
+        proxy.working = False
+
+    checker = HealthChecker(TEST_URL, timeout, stages=stages)
+    async with checker:
+        await checker.check_all(proxies)
+
+    return checker
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--working", type=int, default=100)
+    parser.add_argument("--transparent", type=int, default=20)
+    parser.add_argument("--blackhole", type=int, default=400)
+    parser.add_argument("--refused", type=int, default=100)
+    parser.add_argument("--hanging", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--anonymity", action="store_true", help="add the anonymity stage")
+    args = parser.parse_args()
+
+    farm = ProxyFarm(args.working, args.transparent, args.hanging, args.refused, args.blackhole)
+    async with farm:
+        proxies = farm.proxies
+        staged = [tcp_stage(), http_stage(TEST_URL, timeout=args.timeout)]
+        if args.anonymity:
+            staged.append(anonymity_stage(TEST_URL, timeout=args.timeout))
+
+        pipelines = {
+            "http": [http_stage(TEST_URL, timeout=args.timeout)],
+            " -> ".join(stage.name for stage in staged): staged,
+        }
+        print(f"{len(proxies)} proxies: {farm.counts}")
+        print(f"{'stages':<28} {'time':>8} {'checks/s':>9} {'working':>8}  per stage (checked/passed)")
+        for name, stages in pipelines.items():
+            started = time.perf_counter()
+            checker = await run(proxies, stages, args.timeout)
+            elapsed = time.perf_counter() - started
+            stats = ", ".join(f"{stage} {c}/{p}" for stage, (c, p) in checker.stage_stats.items())
+            print(
+                f"{name:<28} {elapsed:>7.2f}s {len(proxies) / elapsed:>9.1f}"
+                f" {checker.working:>8}  {stats}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,218 @@
+"""
+runs the whole benchmark suite offline against local stand-in providers and proxies:
+extraction throughput, query latency at several pool sizes, health check throughput and peak memory.
+the results are written as json so two runs can be compared.
+
+usage: python benchmarks/suite.py [--quick] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from memory import generate_proxies
+from proxy_random.extract import parse_response
+from proxy_random.health import HealthChecker, http_stage
+from proxy_random.provider import Provider
+from proxy_random.query import ProxyQuery
+from proxy_random.random_proxy import RandomProxy
+from servers import ProviderServer, ProxyFarm
+
+# the proxies answer this themselves, nothing is resolved.
+TEST_URL = "http://test.invalid/headers"
+
+# the compared metrics, by the end of their names.
+HIGHER_IS_BETTER = ("per_second",)
+LOWER_IS_BETTER = ("_ms", "seconds", "bytes", "bytes_per_proxy")
+
+
+def timed(function: Callable, repeat: int) -> Dict[str, float]:
+    """times the first call (cold, the indexes are built) and the median of the next `repeat` calls (warm)."""
+    started = time.perf_counter()
+    function()
+    cold = time.perf_counter() - started
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+
+    return {"cold_ms": cold * 1000, "warm_ms": statistics.median(times) * 1000}
+
+
+def peak_memory(function: Callable):
+    """runs function and returns its result and the peak of the memory allocated meanwhile."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+
+    finally:
+        tracemalloc.stop()
+
+    return result, peak
+
+
+async def bench_extraction(providers: int, size: int, delay: float) -> Dict[str, float]:
+    async with ProviderServer(delay) as server:
+        random_proxy = RandomProxy(use_defaults=False, dedup=True)
+        for i in range(providers):
+            # two providers list the same proxies, so the duplicates are merged too.
+            random_proxy.add_provider(Provider(server.url(size, i // 2), parse_response))
+
+        started = time.perf_counter()
+        query = await random_proxy.aextract_proxies()
+        elapsed = time.perf_counter() - started
+
+    return {
+        "proxies": len(query),
+        "seconds": elapsed,
+        "proxies_per_second": len(query) / elapsed,
+    }
+
+
+def bench_queries(size: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    query, peak = peak_memory(lambda: ProxyQuery(list(generate_proxies(size))))
+    cutoff = time.time() - 30
+
+    cases = {
+        "filter": lambda: len(query.filter(country_code="US")),
+        "filter_two": lambda: len(query.filter(country_code="US", https=True)),
+        "filter_order": lambda: len(
+            query.filter(anonymity="elite proxy").order_by("last_checked").limit(10)
+        ),
+        "newest": lambda: len(query.order_by("last_checked").desc().limit(10)),
+        "fresher_than": lambda: len(query.filter(fresher_than=cutoff)),
+        "random": query.random,
+        "random_weighted": lambda: query.random("weighted"),
+    }
+    results = {name: timed(case, repeat) for name, case in cases.items()}
+    results["memory"] = {"peak_bytes": peak, "bytes_per_proxy": peak / size}
+
+    return results
+
+
+async def bench_health(
+    working: int, blackhole: int, latency: float, failure_rate: float, timeout: float
+) -> Dict[str, float]:
+    farm = ProxyFarm(working, blackhole=blackhole, latency=latency, failure_rate=failure_rate)
+    async with farm:
+        proxies = farm.proxies
+        checker = HealthChecker(TEST_URL, timeout, stages=[http_stage(TEST_URL, timeout=timeout)])
+        started = time.perf_counter()
+        async with checker:
+            await checker.check_all(proxies)
+
+        elapsed = time.perf_counter() - started
+
+    return {
+        "proxies": len(proxies),
+        "working": sum(1 for proxy in proxies if proxy.working),
+        "seconds": elapsed,
+        "checks_per_second": len(proxies) / elapsed,
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+
+    return flat
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """prints the metrics of both runs and the change, `+` is an improvement."""
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    print(f"\n{'metric':<44} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, value in current.items():
+        old = previous.get(name)
+        if not old or not name.endswith(HIGHER_IS_BETTER + LOWER_IS_BETTER):
+            continue
+
+        ratio = value / old
+        better = ratio if name.endswith(HIGHER_IS_BETTER) else 1 / ratio if ratio else 0
+        print(f"{name:<44} {old:>12.4g} {value:>12.4g} {(better - 1) * 100:>+8.1f}%")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None, help="pool sizes of the query benchmark")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--providers", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=2000, help="proxies per provider page")
+    parser.add_argument("--provider-delay", type=float, default=0.05)
+    parser.add_argument("--working", type=int, default=500)
+    parser.add_argument("--blackhole", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="latency of the stand-in proxies")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=1)
+    parser.add_argument("--output", help="file the json results are written to")
+    parser.add_argument("--compare", help="json results of a previous run")
+    args = parser.parse_args()
+
+    sizes = args.sizes or ([1000, 10000] if args.quick else [1000, 10000, 100000])
+    if args.quick:
+        args.providers, args.page_size, args.working, args.blackhole = 2, 500, 100, 20
+
+    results = {}
+
+    print(f"extraction: {args.providers} providers x {args.page_size} proxies")
+    results["extraction"] = await bench_extraction(args.providers, args.page_size, args.provider_delay)
+    print(json.dumps(results["extraction"], indent=1))
+
+    results["query"] = {}
+    for size in sizes:
+        print(f"query: {size} proxies")
+        results["query"][str(size)] = bench_queries(size, args.repeat)
+        for name, value in results["query"][str(size)].items():
+            print(f"  {name:<16} {value}")
+
+    print(f"health: {args.working} working ({args.failure_rate:.0%} failing), {args.blackhole} blackhole")
+    results["health"] = await bench_health(
+        args.working, args.blackhole, args.latency, args.failure_rate, args.timeout
+    )
+    print(json.dumps(results["health"], indent=1))
+
+    if resource is not None:
+        # kilobytes on linux, bytes on macos.
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results["process"] = {"max_rss_bytes": max_rss if sys.platform == "darwin" else max_rss * 1024}
+
+    output = {
+        "created": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,3 +5,6 @@ proxy_random - A simple package to get random proxy from online proxylist sites.
 from proxy_random.proxy import Proxy
 from proxy_random.query import ProxyQuery
 from proxy_random.random_proxy import RandomProxy
+from proxy_random.pool import ProxyPool
+from proxy_random.gateway import ProxyGateway
+from proxy_random.shared import SharedProxyTable
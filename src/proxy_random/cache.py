@@ -0,0 +1,220 @@
+"""
+contains the ProxyCache class which keeps extracted proxies and their health on disk between runs.
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+from aiohttp_proxy import ProxyType
+
+from proxy_random.config import DEFAULT_CACHE_TTL, DEFAULT_HEALTH_TTL
+from proxy_random.proxy import BaseProxy, Proxy
+from proxy_random.query import ProxyQuery
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS providers (
+    url TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS proxies (
+    provider TEXT NOT NULL,
+    ip TEXT,
+    port INTEGER,
+    country_code TEXT,
+    country TEXT,
+    anonymity TEXT,
+    google INTEGER,
+    https INTEGER,
+    last_checked REAL,
+    type TEXT,
+    extra TEXT,
+    verified INTEGER NOT NULL,
+    working INTEGER NOT NULL,
+    checked_at REAL,
+    latency REAL,
+    latency_ewma REAL,
+    successes INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, ip, port)
+);
+CREATE INDEX IF NOT EXISTS proxies_address ON proxies (ip, port);
+"""
+
+COLUMNS = (
+    "ip",
+    "port",
+    "country_code",
+    "country",
+    "anonymity",
+    "google",
+    "https",
+    "last_checked",
+)
+HEALTH_COLUMNS = (
+    "checked_at",
+    "latency",
+    "latency_ewma",
+    "successes",
+    "failures",
+)
+
+
+class ProxyCache:
+    """sqlite cache of the extracted proxies, keyed by provider url and ip:port.
+    used by RandomProxy to skip fetching providers which are fetched recently and
+    to keep the health check results between restarts.
+    it can be used from several threads (e.g. a ProxyPool started with start_thread()), the queries are serialized.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = DEFAULT_CACHE_TTL,
+        health_ttl: float = DEFAULT_HEALTH_TTL,
+    ) -> None:
+        """ProxyCache Constructor
+
+        :param path: path of the sqlite database, it's created if it doesn't exist
+        :type path: str
+        :param ttl: seconds a provider's proxies are used before the provider is fetched again, defaults to DEFAULT_CACHE_TTL
+        :type ttl: float, optional
+        :param health_ttl: seconds a health check result is trusted, older results are loaded as not verified, defaults to DEFAULT_HEALTH_TTL
+        :type health_ttl: float, optional
+        """
+        self.path: str = path
+        self.ttl: float = ttl
+        self.health_ttl: float = health_ttl
+
+        # the connection is shared by the threads which use the cache, guarded by the lock.
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def is_fresh(self, url: str) -> bool:
+        """whether the provider is fetched in the last `ttl` seconds.
+
+        :param url: the provider url
+        :type url: str
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fetched_at FROM providers WHERE url = ?", (url,)
+            ).fetchone()
+
+        return row is not None and row[0] + self.ttl > time.time()
+
+    def load(self, url: str) -> Optional[ProxyQuery]:
+        """loads the proxies of a provider.
+
+        :param url: the provider url
+        :type url: str
+        :return: the cached proxies, None if the provider is not cached or is stale
+        :rtype: Optional[ProxyQuery]
+        """
+        with self._lock:
+            if not self.is_fresh(url):
+                return None
+
+            rows = self._connection.execute(
+                f"SELECT {', '.join(COLUMNS + HEALTH_COLUMNS)}, type, extra, verified, working"
+                " FROM proxies WHERE provider = ? ORDER BY rowid",
+                (url,),
+            ).fetchall()
+
+        healthy_since = time.time() - self.health_ttl
+        proxies = []
+        for row in rows:
+            fields = dict(zip(COLUMNS, row))
+            for name in ("google", "https"):
+                if fields[name] is not None:
+                    fields[name] = bool(fields[name])
+
+            health = row[len(COLUMNS) : len(COLUMNS) + len(HEALTH_COLUMNS)]
+            proxy_type, extra, verified, working = row[len(COLUMNS) + len(HEALTH_COLUMNS) :]
+            proxy = Proxy(**fields, **(json.loads(extra) if extra else {}))
+            proxy.type = ProxyType(proxy_type)
+            for name, value in zip(HEALTH_COLUMNS, health):
+                setattr(proxy, name, value)
+
+            checked_at = proxy.checked_at
+            if checked_at is not None and checked_at > healthy_since:
+                proxy._verified = bool(verified)
+                proxy._working = bool(working)
+
+            proxies.append(proxy)
+
+        return ProxyQuery(proxies)
+
+    def store(self, url: str, proxies: Iterable[BaseProxy]) -> None:
+        """replaces the cached proxies of a provider.
+
+        :param url: the provider url
+        :type url: str
+        :param proxies: the proxies of the provider
+        :type proxies: Iterable[BaseProxy]
+        """
+        columns = ("provider",) + COLUMNS + HEALTH_COLUMNS + (
+            "type",
+            "extra",
+            "verified",
+            "working",
+        )
+        rows = (
+            (url,)
+            + tuple(getattr(proxy, name) for name in COLUMNS + HEALTH_COLUMNS)
+            + (
+                proxy.type.value,
+                json.dumps(proxy.extra, default=str) if proxy.extra else None,
+                proxy.verified,
+                proxy.working,
+            )
+            for proxy in proxies
+        )
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM proxies WHERE provider = ?", (url,))
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO proxies ({', '.join(columns)})"
+                f" VALUES ({', '.join('?' * len(columns))})",
+                rows,
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO providers VALUES (?, ?)", (url, time.time())
+            )
+
+    def update_health(self, proxies: Iterable[BaseProxy]) -> None:
+        """saves the health check results of the proxies (all the providers which have the same ip:port).
+
+        :param proxies: the proxies, only the verified ones are saved
+        :type proxies: Iterable[BaseProxy]
+        """
+        rows = (
+            (proxy.verified, proxy.working)
+            + tuple(getattr(proxy, name) for name in HEALTH_COLUMNS)
+            + (proxy.ip, proxy.port)
+            for proxy in proxies
+            if proxy.verified
+        )
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE proxies SET verified = ?, working = ?, "
+                + ", ".join(f"{name} = ?" for name in HEALTH_COLUMNS)
+                + " WHERE ip = ? AND port = ?",
+                rows,
+            )
+
+    def clear(self) -> None:
+        """removes everything from the cache."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM proxies")
+            self._connection.execute("DELETE FROM providers")
+
+    def close(self) -> None:
+        """closes the database."""
+        with self._lock:
+            self._connection.close()
+
+    def __repr__(self) -> str:
+        return f"<ProxyCache {self.path}>"
@@ -0,0 +1,436 @@
+"""
+contains the ProxyColumns class, a compact column oriented storage for large proxy pools.
+"""
+import math
+import socket
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from aiohttp_proxy import ProxyType
+
+from proxy_random.proxy import BaseProxy, Proxy
+
+# bits of the flags column, google and https can be None so they have a "set" bit too.
+GOOGLE_SET = 1
+GOOGLE = 2
+HTTPS_SET = 4
+HTTPS = 8
+VERIFIED = 16
+WORKING = 32
+IPV4 = 64
+
+# the type column stores the position of the ProxyType in this list.
+PROXY_TYPES = list(ProxyType)
+
+NO_PORT = -1
+NO_VALUE = float("nan")
+# proxy fields stored in a float array, "_" + name is the column.
+FLOAT_COLUMNS = ("last_checked", "checked_at", "latency", "latency_ewma")
+
+
+class ProxyColumns:
+    """column oriented storage for proxies.
+    ipv4 addresses are packed to 4 byte ints, ports are stored in an int array, string fields are
+    dictionary encoded and the boolean fields are bits of a single byte, so a proxy takes ~50 bytes.
+    indexing returns ColumnProxy objects which read and write the columns,
+    so they're only created when the caller reads them.
+
+    usage: `ProxyQuery(ProxyColumns(proxies))` or `RandomProxy(columnar=True)`
+    """
+
+    def __init__(self, proxies: Iterable[BaseProxy] = ()) -> None:
+        """
+        :param proxies: proxies to store, defaults to ()
+        :type proxies: Iterable[BaseProxy], optional
+        """
+        self._ipv4: array = array("I")
+        # row -> packed (16 bytes) ipv6 address, or the raw value for anything else (hostnames, None, ...)
+        self._other_ips: Dict[int, Any] = {}
+        self._ports: array = array("i")
+        # row -> port that doesn't fit in the array
+        self._other_ports: Dict[int, Any] = {}
+        self._country_codes: array = array("I")
+        self._countries: array = array("I")
+        self._anonymities: array = array("I")
+        self._flags: array = array("B")
+        self._types: array = array("B")
+        # nan when the value is unknown
+        self._last_checked: array = array("d")
+        self._checked_at: array = array("d")
+        self._latency: array = array("d")
+        self._latency_ewma: array = array("d")
+        self._successes: array = array("I")
+        self._failures: array = array("I")
+        # (column, row) -> value of a float column which is not a number (e.g. an unparsed last checked text)
+        self._other_floats: Dict[Tuple[str, int], Any] = {}
+        # row -> custom fields of the proxy
+        self._extra: Dict[int, Dict[str, Any]] = {}
+
+        # dictionary encoding shared by the string columns, code 0 is None.
+        self._values: List[Any] = [None]
+        self._codes: Dict[Any, int] = {None: 0}
+
+        self.extend(proxies)
+
+    def _encode(self, value: Any) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._values)
+            self._values.append(value)
+            self._codes[value] = code
+
+        return code
+
+    def append(self, proxy: BaseProxy) -> None:
+        """adds a proxy to the columns.
+
+        :param proxy: the proxy
+        :type proxy: BaseProxy
+        """
+        row = len(self._flags)
+        self._ipv4.append(0)
+        self._ports.append(NO_PORT)
+        self._flags.append(0)
+        self._types.append(PROXY_TYPES.index(proxy.type))
+        self._checked_at.append(NO_VALUE)
+        self._latency.append(NO_VALUE)
+        self._latency_ewma.append(NO_VALUE)
+        self._last_checked.append(NO_VALUE)
+        self._successes.append(proxy.successes)
+        self._failures.append(proxy.failures)
+        self._country_codes.append(self._encode(proxy.country_code))
+        self._countries.append(self._encode(proxy.country))
+        self._anonymities.append(self._encode(proxy.anonymity))
+
+        self._set_ip(row, proxy.ip)
+        for name in FLOAT_COLUMNS:
+            self._set_float(name, row, getattr(proxy, name))
+
+        self._set_port(row, proxy.port)
+        self._set_bool(row, GOOGLE_SET, GOOGLE, proxy.google)
+        self._set_bool(row, HTTPS_SET, HTTPS, proxy.https)
+        self._set_flag(row, VERIFIED, proxy.verified)
+        self._set_flag(row, WORKING, proxy.working)
+        if proxy.extra:
+            self._extra[row] = dict(proxy.extra)
+
+    def extend(self, proxies: Iterable[BaseProxy]) -> None:
+        """adds the proxies to the columns.
+
+        :param proxies: the proxies
+        :type proxies: Iterable[BaseProxy]
+        """
+        for proxy in proxies:
+            self.append(proxy)
+
+    def _get_ip(self, row: int) -> Any:
+        if self._flags[row] & IPV4:
+            return socket.inet_ntoa(self._ipv4[row].to_bytes(4, "big"))
+
+        ip = self._other_ips[row]
+        if isinstance(ip, bytes):
+            return socket.inet_ntop(socket.AF_INET6, ip)
+
+        return ip
+
+    def _set_ip(self, row: int, ip: Any) -> None:
+        self._other_ips.pop(row, None)
+        if isinstance(ip, str):
+            try:
+                packed = socket.inet_pton(socket.AF_INET, ip)
+                # only store it packed if it comes back the same (e.g. no leading zeros).
+                if socket.inet_ntoa(packed) == ip:
+                    self._ipv4[row] = int.from_bytes(packed, "big")
+                    self._flags[row] |= IPV4
+                    return
+
+            except OSError:
+                pass
+
+            try:
+                packed = socket.inet_pton(socket.AF_INET6, ip)
+                if socket.inet_ntop(socket.AF_INET6, packed) == ip:
+                    self._other_ips[row] = packed
+                    self._flags[row] &= ~IPV4
+                    return
+
+            except OSError:
+                pass
+
+        self._other_ips[row] = ip
+        self._flags[row] &= ~IPV4
+
+    def _get_float(self, name: str, row: int) -> Optional[float]:
+        value = getattr(self, "_" + name)[row]
+        if math.isnan(value):
+            return self._other_floats.get((name, row)) if self._other_floats else None
+
+        return value
+
+    def _set_float(self, name: str, row: int, value: Optional[float]) -> None:
+        if self._other_floats:
+            self._other_floats.pop((name, row), None)
+
+        if value is None:
+            value = NO_VALUE
+
+        elif not isinstance(value, (int, float)):
+            self._other_floats[(name, row)] = value
+            value = NO_VALUE
+
+        getattr(self, "_" + name)[row] = value
+
+    def _get_port(self, row: int) -> Any:
+        port = self._ports[row]
+        if port >= 0:
+            return port
+
+        if port == NO_PORT:
+            return None
+
+        return self._other_ports[row]
+
+    def _set_port(self, row: int, port: Any) -> None:
+        self._other_ports.pop(row, None)
+        if port is None:
+            self._ports[row] = NO_PORT
+
+        elif type(port) is int and 0 <= port <= 0x7FFFFFFF:
+            self._ports[row] = port
+
+        else:
+            self._ports[row] = NO_PORT - 1
+            self._other_ports[row] = port
+
+    def _set_flag(self, row: int, flag: int, value: Any) -> None:
+        if value:
+            self._flags[row] |= flag
+
+        else:
+            self._flags[row] &= ~flag
+
+    def _get_bool(self, row: int, is_set: int, flag: int) -> Optional[bool]:
+        flags = self._flags[row]
+        if not flags & is_set:
+            return None
+
+        return bool(flags & flag)
+
+    def _set_bool(self, row: int, is_set: int, flag: int, value: Optional[bool]) -> None:
+        if value is None:
+            self._flags[row] &= ~(is_set | flag)
+
+        else:
+            self._flags[row] |= is_set
+            self._set_flag(row, flag, value)
+
+    def __len__(self) -> int:
+        return len(self._flags)
+
+    def __getitem__(self, i: Union[slice, int]) -> Union["ColumnProxy", List["ColumnProxy"]]:
+        if isinstance(i, slice):
+            return [ColumnProxy(self, row) for row in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError("ProxyColumns index out of range")
+
+        return ColumnProxy(self, i)
+
+    def __iter__(self) -> Iterator["ColumnProxy"]:
+        for row in range(len(self)):
+            yield ColumnProxy(self, row)
+
+    def __add__(self, other: Iterable[BaseProxy]) -> "ProxyColumns":
+        columns = ProxyColumns(self)
+        columns.extend(other)
+        return columns
+
+    def __radd__(self, other: List[BaseProxy]) -> List[BaseProxy]:
+        return other + self[:]
+
+    def __iadd__(self, other: Iterable[BaseProxy]) -> "ProxyColumns":
+        self.extend(self[:] if other is self else other)
+        return self
+
+    def __repr__(self) -> str:
+        return f"<ProxyColumns {len(self)} proxies>"
+
+
+def _float_column(name: str, doc: str) -> property:
+    """creates a property which reads and writes a float column (nan is None) of ColumnProxy."""
+
+    def get(self: "ColumnProxy") -> Optional[float]:
+        return self._columns._get_float(name, self._row)
+
+    def set(self: "ColumnProxy", value: Optional[float]) -> None:
+        self._columns._set_float(name, self._row, value)
+
+    return property(get, set, doc=doc)
+
+
+def _int_column(name: str, doc: str) -> property:
+    """creates a property which reads and writes an int column of ColumnProxy."""
+
+    def get(self: "ColumnProxy") -> int:
+        return getattr(self._columns, name)[self._row]
+
+    def set(self: "ColumnProxy", value: int) -> None:
+        getattr(self._columns, name)[self._row] = value
+
+    return property(get, set, doc=doc)
+
+
+def _column(name: str, doc: str) -> property:
+    """creates a property which reads and writes a dictionary encoded column of ColumnProxy."""
+
+    def get(self: "ColumnProxy") -> Any:
+        columns = self._columns
+        return columns._values[getattr(columns, name)[self._row]]
+
+    def set(self: "ColumnProxy", value: Any) -> None:
+        columns = self._columns
+        getattr(columns, name)[self._row] = columns._encode(value)
+
+    return property(get, set, doc=doc)
+
+
+class ColumnProxy(Proxy):
+    """a proxy stored in ProxyColumns, the attributes are read from (and written to) the columns."""
+
+    __slots__ = ("_columns", "_row")
+
+    def __init__(self, columns: ProxyColumns, row: int) -> None:
+        """
+        :param columns: the columns the proxy is stored in
+        :type columns: ProxyColumns
+        :param row: the row of the proxy
+        :type row: int
+        """
+        object.__setattr__(self, "_columns", columns)
+        object.__setattr__(self, "_row", row)
+
+    country_code = _column("_country_codes", "country code")
+    country = _column("_countries", "proxy country")
+    anonymity = _column("_anonymities", "proxy anonymity")
+    last_checked = _float_column("last_checked", "unix timestamp of when the provider last checked the proxy")
+    checked_at = _float_column("checked_at", "unix timestamp of the last health check")
+    latency = _float_column("latency", "response time of the last successful request")
+    latency_ewma = _float_column("latency_ewma", "moving average of the latency")
+    successes = _int_column("_successes", "number of successful requests")
+    failures = _int_column("_failures", "number of failed requests")
+
+    def to_proxy(self) -> Proxy:
+        """copies the proxy out of the columns.
+
+        :return: a regular Proxy with the same fields
+        :rtype: Proxy
+        """
+        proxy = Proxy(
+            ip=self.ip,
+            port=self.port,
+            country_code=self.country_code,
+            country=self.country,
+            anonymity=self.anonymity,
+            google=self.google,
+            https=self.https,
+            last_checked=self.last_checked,
+        )
+        proxy.type = self.type
+        proxy.checked_at = self.checked_at
+        proxy.latency = self.latency
+        proxy.latency_ewma = self.latency_ewma
+        proxy.successes = self.successes
+        proxy.failures = self.failures
+        proxy._verified = self.verified
+        proxy._working = self.working
+        if self.extra:
+            proxy.extra = dict(self.extra)
+
+        return proxy
+
+    def __reduce__(self) -> tuple:
+        # pickled (e.g. sent to another process) as a regular Proxy instead of the whole columns.
+        return (_unpickle, (self.to_proxy(),))
+
+    @property
+    def ip(self) -> Any:
+        """proxy ip address"""
+        return self._columns._get_ip(self._row)
+
+    @ip.setter
+    def ip(self, value: Any) -> None:
+        self._columns._set_ip(self._row, value)
+
+    @property
+    def port(self) -> Any:
+        """proxy port"""
+        return self._columns._get_port(self._row)
+
+    @port.setter
+    def port(self, value: Any) -> None:
+        self._columns._set_port(self._row, value)
+
+    @property
+    def google(self) -> Optional[bool]:
+        """whether it's a google proxy"""
+        return self._columns._get_bool(self._row, GOOGLE_SET, GOOGLE)
+
+    @google.setter
+    def google(self, value: Optional[bool]) -> None:
+        self._columns._set_bool(self._row, GOOGLE_SET, GOOGLE, value)
+
+    @property
+    def https(self) -> Optional[bool]:
+        """whether it's a https proxy"""
+        return self._columns._get_bool(self._row, HTTPS_SET, HTTPS)
+
+    @https.setter
+    def https(self, value: Optional[bool]) -> None:
+        self._columns._set_bool(self._row, HTTPS_SET, HTTPS, value)
+
+    @property
+    def type(self) -> ProxyType:
+        """the proxy type"""
+        return PROXY_TYPES[self._columns._types[self._row]]
+
+    @type.setter
+    def type(self, value: ProxyType) -> None:
+        self._columns._types[self._row] = PROXY_TYPES.index(value)
+
+    @property
+    def verified(self) -> bool:
+        """whether the proxy is checked or not."""
+        return bool(self._columns._flags[self._row] & VERIFIED)
+
+    @verified.setter
+    def verified(self, value: bool) -> None:
+        self._columns._set_flag(self._row, VERIFIED, value)
+
+    @property
+    def working(self) -> bool:
+        """whether the proxy was working in the last check or not."""
+        return bool(self._columns._flags[self._row] & WORKING)
+
+    @working.setter
+    def working(self, value: bool) -> None:
+        self._columns._set_flag(self._row, WORKING, value)
+
+    @property
+    def extra(self) -> Optional[Dict[str, Any]]:
+        """custom fields of the proxy"""
+        return self._columns._extra.get(self._row)
+
+    @extra.setter
+    def extra(self, value: Optional[Dict[str, Any]]) -> None:
+        if value is None:
+            self._columns._extra.pop(self._row, None)
+
+        else:
+            self._columns._extra[self._row] = value
+
+
+def _unpickle(proxy: Proxy) -> Proxy:
+    return proxy
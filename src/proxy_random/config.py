@@ -3,3 +3,56 @@ HTTP_PROXY_URL = "https://free-proxy-list.net/"
 HTTPS_PROXY_URL = "https://www.sslproxies.org/"
 
 TEST_URL = "https://httpbin.org/ip"
+# echoes the request headers, used to find the headers a proxy adds.
+ANONYMITY_TEST_URL = "http://httpbin.org/headers"
+# an https url, requested through a CONNECT tunnel.
+CONNECT_TEST_URL = "https://httpbin.org/ip"
+
+# Health checks
+DEFAULT_TIMEOUT = 5
+DEFAULT_CONCURRENCY = 100
+DNS_CACHE_TTL = 300
+# TCP connect pre-check of the staged health checks
+DEFAULT_TCP_TIMEOUT = 1
+DEFAULT_TCP_CONCURRENCY = 500
+# weight of the newest latency in Proxy.latency_ewma
+LATENCY_EWMA_ALPHA = 0.3
+# relative change of a proxy's score which makes ProxyQuery rebuild the weights of random("weighted")
+SCORE_TOLERANCE = 0.1
+
+# Proxy pool (seconds)
+DEFAULT_REFRESH_INTERVAL = 600
+DEFAULT_RECHECK_INTERVAL = 300
+DEFAULT_MAX_FAILURES = 3
+
+# Cache (seconds)
+DEFAULT_CACHE_TTL = 600
+DEFAULT_HEALTH_TTL = 300
+
+# Health result cache and circuit breaker (seconds)
+DEFAULT_NEGATIVE_TTL = 60
+DEFAULT_MAX_BACKOFF = 3600
+DEFAULT_BREAKER_FAILURES = 5
+
+# Metrics, upper bounds of the histogram buckets (seconds)
+DEFAULT_METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Forward proxy gateway
+DEFAULT_GATEWAY_HOST = "127.0.0.1"
+DEFAULT_GATEWAY_PORT = 8899
+DEFAULT_GATEWAY_RETRIES = 3
+
+# Requests through the proxies (fetch)
+DEFAULT_FETCH_RETRIES = 3
+# seconds before a hedged request when the latencies of the proxies are unknown
+DEFAULT_HEDGE_DELAY = 1.0
+HEDGE_PERCENTILE = 0.9
+
+# Sessions bound to a proxy, kept for the next requests through the same proxy
+DEFAULT_SESSION_CACHE_SIZE = 256
+
+# Health checks split across processes, proxies sent to a worker process at once
+DEFAULT_SHARD_SIZE = 1000
+
+# Proxy table shared by processes (see SharedProxyTable), 48 bytes per proxy
+DEFAULT_SHARED_CAPACITY = 65536
@@ -1,13 +1,321 @@
+import re
+from html import unescape
+from typing import Callable, List, Optional, Tuple
+
 from bs4 import BeautifulSoup
 
 from proxy_random.proxy import Proxy
 from proxy_random.query import ProxyQuery
 
+TOKENS = re.compile(
+    r"""
+    <!--.*?-->                                             # comment
+    |<[!?][^>]*>                                           # doctype, processing instruction
+    |<(/?)([a-zA-Z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>  # start or end tag
+    |[^<]+|<                                               # text
+    """,
+    re.S | re.X,
+)
+# the content of these elements is raw text (may contain "<").
+RAW_TEXT_ELEMENTS = ("script", "style")
+RAW_TEXT_END = {
+    tag: re.compile(rf"</{tag}\s*>", re.I) for tag in RAW_TEXT_ELEMENTS
+}
+
+# elements without an end tag, they don't change the nesting depth.
+VOID_ELEMENTS = frozenset(
+    (
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "source",
+        "track",
+        "wbr",
+    )
+)
+
+
+def _yes(value: str) -> bool:
+    return True if value == "yes" else False
+
+
+def _columns(headings: List[str]) -> List[Tuple[int, str, Optional[Callable]]]:
+    """maps the table headings to the proxy fields, done once per table.
+
+    :param headings: lower case headings of the table
+    :type headings: list[str]
+    :return: (column index, proxy attribute, converter) for each known column
+    :rtype: list[tuple[int, str, Optional[Callable]]]
+    """
+    columns = []
+    for i, name in enumerate(headings):
+        if name == "ip address":
+            columns.append((i, "ip", None))
+
+        elif name == "port":
+            columns.append((i, "port", int))
+
+        elif name == "code":
+            columns.append((i, "country_code", None))
+
+        elif name == "last checked":
+            columns.append((i, "last_checked", None))
+
+        elif name in ("google", "https"):
+            columns.append((i, name, _yes))
+
+        elif name in ("country", "anonymity"):
+            columns.append((i, name, None))
+
+    return columns
+
+
+class ProxyTableParser:
+    """parser for the proxy table of the built-in providers.
+    reads the headings of the first thead and the rows of the first tbody, like parse_response_soup does.
+    the page is tokenized with a single precompiled regex instead of building a tree,
+    the complete tokens of each part are parsed when it's fed, so a streamed page is parsed while it's downloaded.
+    """
+
+    def __init__(self) -> None:
+        # the fed text which isn't parsed yet (an incomplete token at the end).
+        self._buffer: str = ""
+        self.headings: List[str] = []
+        self.rows: List[List[str]] = []
+
+        self._found_thead = False
+        self._found_tbody = False
+        self._in_thead = False
+        self._in_tbody = False
+
+        # text of the heading that is being read
+        self._heading: Optional[List[str]] = None
+        self._heading_depth = 0
+        # the row that is being read, and the text of its current cell
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._cell_depth = 0
+
+    def feed(self, data: str) -> None:
+        """adds a part of the page and parses its complete tokens.
+
+        :param data: part of the page
+        :type data: str
+        """
+        self._buffer += data
+        self._parse(False)
+
+    def close(self) -> None:
+        """parses the rest of the page."""
+        self._parse(True)
+        if self._row is not None:
+            # the page ended inside the table.
+            self._end_row()
+
+    def _parse(self, final: bool) -> None:
+        """the internal method which parses the buffered text,
+        a token which may continue in the next part is kept in the buffer unless it's the end of the page.
+        """
+        page = self._buffer
+        pos = 0
+        end = len(page)
+        while pos < end:
+            if not final and page.startswith("<", pos) and (
+                page.find(">", pos) == -1
+                or (page.startswith("<!--", pos) and page.find("-->", pos) == -1)
+            ):
+                # an incomplete tag or comment.
+                break
+
+            token = TOKENS.match(page, pos)
+            tag = token.group(2)
+            if not final and tag is None and token.end() == end:
+                # the text may continue (and an entity may be split).
+                break
+
+            pos = token.end()
+            if tag is not None:
+                tag = tag.lower()
+                if token.group(1):
+                    self.handle_endtag(tag)
+
+                elif tag in RAW_TEXT_ELEMENTS and not token.group(3).endswith("/"):
+                    closing = RAW_TEXT_END[tag].search(page, pos)
+                    if closing is None and not final:
+                        # the raw text isn't complete, the start tag is parsed again with it.
+                        pos = token.start()
+                        break
+
+                    raw_end = closing.start() if closing else end
+                    self.handle_starttag(tag, token.group(3))
+                    self.handle_data(page[pos:raw_end])
+                    pos = raw_end
+
+                else:
+                    self.handle_starttag(tag, token.group(3))
+                    if token.group(3).endswith("/"):
+                        self.handle_endtag(tag)
+
+            else:
+                text = token.group()
+                if text.startswith("<!--"):
+                    self.handle_comment(text[4:-3])
+
+                elif text.startswith(("<!", "<?")):
+                    pass  # doctype, processing instruction
+
+                else:
+                    self.handle_data(unescape(text) if "&" in text else text)
+
+        self._buffer = page[pos:]
+
+    def _end_row(self) -> None:
+        """the internal method which ends the current row (and its open cell)."""
+        if self._cell is not None:
+            self._row.append("".join(self._cell))
+            self._cell = None
+
+        self.rows.append(self._row)
+        self._row = None
+
+    def handle_starttag(self, tag: str, attrs: str) -> None:
+        void = tag in VOID_ELEMENTS
+        if self._row is not None and tag == "tr":
+            # the end tag of the row was omitted.
+            self._end_row()
+            self._row = []
+
+        elif self._heading is not None:
+            if not void:
+                self._heading_depth += 1
+
+        elif self._cell is not None:
+            if tag in ("td", "th") and self._cell_depth == 1:
+                # the end tag of the cell was omitted.
+                self._row.append("".join(self._cell))
+                self._cell = []
+
+            elif not void:
+                self._cell_depth += 1
+
+        elif self._row is not None:
+            # every child of a row is a cell.
+            if void:
+                self._row.append("")
+
+            else:
+                self._cell = []
+                self._cell_depth = 1
+
+        elif self._in_thead:
+            if tag == "th":
+                self._heading = []
+                self._heading_depth = 1
+
+        elif self._in_tbody:
+            if tag == "tr":
+                self._row = []
+
+        elif tag == "thead" and not self._found_thead:
+            self._found_thead = True
+            self._in_thead = True
+
+        elif tag == "tbody" and not self._found_tbody:
+            self._found_tbody = True
+            self._in_tbody = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in VOID_ELEMENTS:
+            return
+
+        if self._row is not None and tag in ("tbody", "table"):
+            # the end tags of the row (and the cell) were omitted.
+            self._end_row()
+            self._in_tbody = False
+
+        elif self._heading is not None:
+            self._heading_depth -= 1
+            if self._heading_depth == 0:
+                self.headings.append("".join(self._heading).lower())
+                self._heading = None
+
+        elif self._cell is not None:
+            self._cell_depth -= 1
+            if self._cell_depth == 0:
+                self._row.append("".join(self._cell))
+                self._cell = None
+
+        elif self._row is not None:
+            if tag == "tr":
+                self._end_row()
+
+        elif self._in_thead and tag in ("thead", "table"):
+            self._in_thead = False
+
+        elif self._in_tbody and tag in ("tbody", "table"):
+            self._in_tbody = False
+
+    def handle_data(self, data: str) -> None:
+        if self._heading is not None:
+            self._heading.append(data)
+
+        elif self._cell is not None:
+            self._cell.append(data)
+
+        elif self._row is not None:
+            # text between the cells is a child of the row too.
+            self._row.append(data)
+
+    def handle_comment(self, data: str) -> None:
+        if self._cell is None and self._row is not None:
+            self._row.append("")
+
+    def proxies(self) -> List[Proxy]:
+        """builds the proxies from the parsed rows.
+
+        :raises ValueError: raises ValueError if the page doesn't have a proxy table
+        :return: the proxies
+        :rtype: list[Proxy]
+        """
+        if not self._found_thead or not self._found_tbody:
+            raise ValueError(f"no proxy table found")
+
+        columns = _columns(self.headings)
+        proxies = []
+        for row in self.rows:
+            # passed to the constructor, setting the fields of a built proxy would make the indexes of every query stale.
+            fields = {}
+            for i, name, convert in columns:
+                value = row[i]
+                fields[name] = value if convert is None else convert(value)
+
+            proxies.append(Proxy(**fields))
+
+        return proxies
+
 
 def parse_response(response: str) -> ProxyQuery:
     """
     built-in parser for default proxy providers.
     """
+    parser = ProxyTableParser()
+    parser.feed(response)
+    parser.close()
+
+    return ProxyQuery(parser.proxies())
+
+
+def parse_response_soup(response: str) -> ProxyQuery:
+    """
+    the BeautifulSoup version of parse_response, slower but accepts the same pages as BeautifulSoup.
+    """
     soup = BeautifulSoup(response, "html.parser")
 
     headings = [i.text.lower() for i in soup.find("thead").find_all("th")]
@@ -16,26 +324,26 @@ def parse_response(response: str) -> ProxyQuery:
 
     proxies = []
     for row in rows:
-        proxy = Proxy()
+        fields = {}
         for i, name in enumerate(headings):
             if name == "ip address":
-                proxy.ip = row[i]
+                fields["ip"] = row[i]
 
             elif name == "port":
-                proxy.port = int(row[i])
+                fields["port"] = int(row[i])
 
             elif name == "code":
-                proxy.country_code = row[i]
+                fields["country_code"] = row[i]
 
             elif name == "last checked":
-                proxy.last_checked = row[i]
+                fields["last_checked"] = row[i]
 
             elif name in ("google", "https"):
-                setattr(proxy, name, True if row[i] == "yes" else False)
+                fields[name] = True if row[i] == "yes" else False
 
             elif name in ("country", "anonymity"):
-                setattr(proxy, name, row[i])
+                fields[name] = row[i]
 
-        proxies.append(proxy)
+        proxies.append(Proxy(**fields))
 
     return ProxyQuery(proxies)
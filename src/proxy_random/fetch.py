@@ -0,0 +1,297 @@
+"""
+contains the Fetcher class which makes requests through the proxies with failover and hedged requests.
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+
+from aiohttp import ClientSession, TCPConnector
+from multidict import CIMultiDictProxy
+
+from proxy_random.config import (
+    DEFAULT_FETCH_RETRIES,
+    DEFAULT_HEDGE_DELAY,
+    DEFAULT_TIMEOUT,
+    HEDGE_PERCENTILE,
+)
+from proxy_random.proxy import Proxy
+from proxy_random.query import SELECTION_ATTEMPTS, UNIFORM, ProxyQuery
+from proxy_random.sessions import session_cache
+
+# statuses which mean the proxy failed (not the site), the request is retried on another proxy.
+RETRY_STATUSES = (407, 429, 500, 502, 503, 504)
+# seconds the hedge delay (percentile of the latencies of the proxies) is reused before it's computed again.
+HEDGE_DELAY_TTL = 10
+
+
+class FetchError(Exception):
+    """raised when every attempt of a request failed."""
+
+    def __init__(self, url: str, errors: List[Tuple[Proxy, BaseException]]) -> None:
+        if errors:
+            super().__init__(f"all {len(errors)} attempts to fetch {url} failed")
+
+        else:
+            super().__init__(f"no usable proxy to fetch {url}")
+
+        # (proxy, error) of each attempt
+        self.errors: List[Tuple[Proxy, BaseException]] = errors
+
+
+class BadStatus(Exception):
+    """the error of an attempt which got one of the RETRY_STATUSES."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"status {status}")
+        self.status: int = status
+
+
+class FetchResponse:
+    """a response read by Fetcher.fetch()."""
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        headers: CIMultiDictProxy,
+        body: bytes,
+        proxy: Proxy,
+        elapsed: float,
+        attempts: int,
+    ) -> None:
+        self.url: str = url
+        self.status: int = status
+        self.headers: CIMultiDictProxy = headers
+        self.body: bytes = body
+        # the proxy which answered, the time it took and the number of attempts started (including hedged ones).
+        self.proxy: Proxy = proxy
+        self.elapsed: float = elapsed
+        self.attempts: int = attempts
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+    def __repr__(self) -> str:
+        return f"<FetchResponse {self.status} {self.url} via {self.proxy.url}>"
+
+
+class Fetcher:
+    """makes requests through the proxies of a ProxyQuery.
+    a failed request (an error or one of the RETRY_STATUSES) is retried on another proxy, failing proxies
+    (verified and not working, a recent failure in `health_cache`) are not chosen, and the outcome of every
+    request is recorded in the proxy (see Proxy.record()) and in the health cache.
+
+    with `hedge` a second request is sent through another proxy if the first one didn't answer within the
+    90th percentile of the latencies of the proxies (and a third one after another delay, ... as long as
+    there are retries left), the first answer wins and the other requests are cancelled.
+
+    http(s) proxies share one session (the connections to each proxy are kept alive), the other proxies
+    use their session in session_cache.
+
+    usage: `async with Fetcher(query, hedge=True) as fetcher: response = await fetcher.fetch(url)`
+    """
+
+    def __init__(
+        self,
+        proxy_query: ProxyQuery,
+        retries: int = DEFAULT_FETCH_RETRIES,
+        timeout: float = None,
+        hedge: bool = False,
+        hedge_delay: float = None,
+        strategy: str = UNIFORM,
+    ) -> None:
+        """Fetcher Constructor
+
+        :param proxy_query: the proxies used for the requests
+        :type proxy_query: ProxyQuery
+        :param retries: additional attempts after a failed one (hedged requests are attempts too), defaults to DEFAULT_FETCH_RETRIES
+        :type retries: int, optional
+        :param timeout: timeout of an attempt, defaults to DEFAULT_TIMEOUT
+        :type timeout: float, optional
+        :param hedge: whether to send a hedged request through another proxy when an attempt is slow, defaults to False
+        :type hedge: bool, optional
+        :param hedge_delay: seconds before the hedged request, if not provided the 90th percentile of the latencies
+            of the proxies is used (DEFAULT_HEDGE_DELAY if they're unknown), defaults to None
+        :type hedge_delay: float, optional
+        :param strategy: strategy of ProxyQuery.random() used to choose the proxies, defaults to "uniform"
+        :type strategy: str, optional
+        """
+        self.proxy_query: ProxyQuery = proxy_query
+        self.retries: int = retries
+        self.timeout: float = timeout if timeout is not None else DEFAULT_TIMEOUT
+        self.hedge: bool = hedge
+        self.hedge_delay: Optional[float] = hedge_delay
+        self.strategy: str = strategy
+
+        self._session: Optional[ClientSession] = None
+        # (time it was computed, percentile) of the latencies
+        self._percentile: Optional[Tuple[float, float]] = None
+
+    async def fetch(self, url: str, method: str = "GET", **kwargs) -> FetchResponse:
+        """makes a request through the proxies, the body is read before it's returned.
+
+        :param url: the url
+        :type url: str
+        :param method: the http method, defaults to "GET"
+        :type method: str, optional
+        :param kwargs: passed to ClientSession.request() (headers, data, params, ...)
+        :raises FetchError: raises FetchError if every attempt failed or there is no usable proxy
+        :return: the response
+        :rtype: FetchResponse
+        """
+        started = time.perf_counter()
+        tried: Set[Proxy] = set()
+        errors: List[Tuple[Proxy, BaseException]] = []
+        # running attempt -> its proxy
+        running: Dict[asyncio.Task, Proxy] = {}
+
+        def launch() -> None:
+            if len(tried) > self.retries:
+                return
+
+            proxy = self._choose(tried)
+            if proxy is not None:
+                tried.add(proxy)
+                task = asyncio.ensure_future(self._attempt(proxy, method, url, kwargs))
+                running[task] = proxy
+
+        try:
+            launch()
+            while running:
+                # a hedged request is sent every hedge delay until an attempt answers or the retries run out.
+                hedging = self.hedge and len(tried) <= self.retries
+                delay = self._hedge_delay() if hedging else None
+                done, _ = await asyncio.wait(
+                    running, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch()
+                    continue
+
+                for task in done:
+                    proxy = running.pop(task)
+                    result = task.result()
+                    if isinstance(result, FetchResponse):
+                        result.elapsed = time.perf_counter() - started
+                        result.attempts = len(tried)
+                        return result
+
+                    errors.append((proxy, result))
+
+                if not running:
+                    launch()
+
+        finally:
+            for task in running:
+                task.cancel()
+
+            # the losing attempts are finished (their connections released) before fetch() returns.
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        raise FetchError(url, errors)
+
+    async def _attempt(
+        self, proxy: Proxy, method: str, url: str, kwargs: dict
+    ) -> Union[FetchResponse, BaseException]:
+        """the internal method which makes a request through a proxy and records the outcome,
+        returns the response or the error.
+        """
+        started = time.perf_counter()
+        try:
+            async with self._session_for(proxy) as (session, proxy_url):
+                async with session.request(
+                    method, url, proxy=proxy_url, timeout=self.timeout, **kwargs
+                ) as res:
+                    if res.status in RETRY_STATUSES:
+                        raise BadStatus(res.status)
+
+                    body = await res.read()
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            self._record(proxy, False)
+            return e
+
+        elapsed = time.perf_counter() - started
+        self._record(proxy, True, elapsed)
+        return FetchResponse(url, res.status, res.headers, body, proxy, elapsed, 1)
+
+    def _choose(self, tried: Set[Proxy]) -> Optional[Proxy]:
+        """the internal method used to choose a proxy which isn't tried yet and isn't known to fail."""
+        health_cache = self.proxy_query.health_cache
+        for _ in range(SELECTION_ATTEMPTS):
+            proxy = self.proxy_query.random(self.strategy)
+            if proxy is None:
+                return None
+
+            cached = health_cache.get(proxy)
+            failing = (cached is not None and not cached[1]) or (
+                proxy.verified and not proxy.working
+            )
+            if proxy not in tried and not failing:
+                return proxy
+
+        return None
+
+    def _record(self, proxy: Proxy, working: bool, latency: float = None) -> None:
+        proxy.record(working, latency)
+        self.proxy_query.health_cache.put(proxy, working)
+
+    def _hedge_delay(self) -> float:
+        """the internal method which returns the seconds before a hedged request."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+
+        now = time.time()
+        if self._percentile is None or now - self._percentile[0] > HEDGE_DELAY_TTL:
+            latencies = sorted(
+                proxy.latency_ewma
+                for proxy in self.proxy_query
+                if proxy.latency_ewma is not None
+            )
+            delay = (
+                latencies[int(HEDGE_PERCENTILE * (len(latencies) - 1))]
+                if latencies
+                else DEFAULT_HEDGE_DELAY
+            )
+            self._percentile = (now, delay)
+
+        return self._percentile[1]
+
+    @asynccontextmanager
+    async def _session_for(
+        self, proxy: Proxy
+    ) -> AsyncIterator[Tuple[ClientSession, Optional[str]]]:
+        """the internal method which yields the session of a proxy and the proxy url of the request."""
+        if proxy.type.is_http():
+            if self._session is None:
+                self._session = ClientSession(connector=TCPConnector(limit=0))
+
+            yield self._session, f"http://{proxy.ip}:{proxy.port}"
+            return
+
+        async with session_cache.lease(proxy) as session:
+            yield session, None
+
+    async def close(self) -> None:
+        """closes the shared session, the sessions of the other proxies stay in session_cache."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "Fetcher":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def __repr__(self) -> str:
+        return f"<Fetcher {len(self.proxy_query)} proxies>"
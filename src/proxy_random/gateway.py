@@ -0,0 +1,335 @@
+"""
+contains the ProxyGateway class, a local forward proxy which sends every connection through a proxy of a pool.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+from proxy_random.config import (
+    DEFAULT_GATEWAY_HOST,
+    DEFAULT_GATEWAY_PORT,
+    DEFAULT_GATEWAY_RETRIES,
+    DEFAULT_TIMEOUT,
+)
+from proxy_random.metrics import failure_reason, metrics
+from proxy_random.pool import ProxyPool
+from proxy_random.proxy import Proxy
+from proxy_random.query import SELECTION_ATTEMPTS, UNIFORM, ProxyQuery
+
+# maximum size of the request line and headers.
+MAX_HEADER_SIZE = 65536
+CHUNK_SIZE = 65536
+
+
+class GatewayError(Exception):
+    """raised when a connection can't be forwarded, the status is sent to the client."""
+
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(f"{status} {reason}")
+        self.status: int = status
+        self.reason: str = reason
+
+
+class ProxyGateway:
+    """a local forward proxy (plain http requests and CONNECT tunnels) which forwards each client connection
+    through an upstream proxy chosen from a ProxyPool or a ProxyQuery, so many processes can share one verified pool
+    through a single endpoint (e.g. `requests.get(url, proxies={"http": gateway.url, "https": gateway.url})`).
+
+    if connecting to the upstream fails (or it refuses the CONNECT) the proxy is reported as failing
+    and the connection is retried on another one. upstream connections are only pinned per client connection:
+    a client connection stays on its upstream connection until one of them closes it, so a keep-alive client
+    reuses it, but upstream connections are never pooled or reused across client connections.
+    only http(s) upstream proxies are used.
+
+    usage: `async with ProxyGateway(pool) as gateway: ...` or `await gateway.start()` ... `await gateway.stop()`
+    """
+
+    def __init__(
+        self,
+        source: Union[ProxyPool, ProxyQuery],
+        host: str = DEFAULT_GATEWAY_HOST,
+        port: int = DEFAULT_GATEWAY_PORT,
+        retries: int = DEFAULT_GATEWAY_RETRIES,
+        timeout: float = None,
+        strategy: str = UNIFORM,
+        sticky: bool = False,
+    ) -> None:
+        """ProxyGateway Constructor
+
+        :param source: the proxies, a ProxyPool (get() and report() are used) or a ProxyQuery (random() or for_key())
+        :type source: Union[ProxyPool, ProxyQuery]
+        :param host: address to listen on, defaults to DEFAULT_GATEWAY_HOST
+        :type host: str, optional
+        :param port: port to listen on (0 picks a free port), defaults to DEFAULT_GATEWAY_PORT
+        :type port: int, optional
+        :param retries: upstream proxies tried for a connection, defaults to DEFAULT_GATEWAY_RETRIES
+        :type retries: int, optional
+        :param timeout: timeout of connecting to the upstream proxy (and of its CONNECT response), defaults to DEFAULT_TIMEOUT
+        :type timeout: float, optional
+        :param strategy: strategy of ProxyQuery.random(), not used with a ProxyPool, defaults to "uniform"
+        :type strategy: str, optional
+        :param sticky: whether the upstream is chosen by the target host with ProxyQuery.for_key(), so a site always sees
+            the same proxy while it works (not used with a ProxyPool), defaults to False
+        :type sticky: bool, optional
+        """
+        self.source: Union[ProxyPool, ProxyQuery] = source
+        self.host: str = host
+        self.port: int = port
+        self.retries: int = retries
+        self.timeout: float = timeout if timeout is not None else DEFAULT_TIMEOUT
+        self.strategy: str = strategy
+        self.sticky: bool = sticky
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        # handler of each open client connection -> its writer
+        self._handlers: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    @property
+    def url(self) -> str:
+        """the url of the gateway, used as the proxy of the clients.
+
+        :return: the url
+        :rtype: str
+        """
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        """starts listening, `port` is the actual port afterwards."""
+        if self._server is None:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port, limit=MAX_HEADER_SIZE
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """stops listening and closes the open connections."""
+        if self._server is None:
+            return
+
+        server, self._server = self._server, None
+        server.close()
+
+        # the open connections first, newer pythons wait for them in wait_closed().
+        for handler, writer in list(self._handlers.items()):
+            writer.close()
+            handler.cancel()
+
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        """starts the gateway and serves until cancelled."""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+
+        finally:
+            await self.stop()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """the internal method which serves a client connection."""
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        upstream_writer = None
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+
+            method, target = _request_target(head)
+            tunnel = method == "CONNECT"
+            try:
+                upstream_reader, upstream_writer = await self._connect(
+                    target, head, tunnel
+                )
+
+            except GatewayError as e:
+                writer.write(
+                    f"HTTP/1.1 {e.status} {e.reason}\r\nContent-Length: 0\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if metrics.enabled:
+                    metrics.count("gateway_connections_total", result=str(e.status))
+
+                return
+
+            if tunnel:
+                writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+
+            else:
+                upstream_writer.write(head)
+
+            if metrics.enabled:
+                metrics.count("gateway_connections_total", result="ok")
+
+            await asyncio.gather(
+                _pipe(reader, upstream_writer), _pipe(upstream_reader, writer)
+            )
+
+        except (ConnectionError, OSError):
+            pass
+
+        except asyncio.CancelledError:
+            # cancelled by stop(), the streams are closed below.
+            pass
+
+        finally:
+            self._handlers.pop(task, None)
+            for stream in (upstream_writer, writer):
+                if stream is not None:
+                    stream.close()
+
+    async def _connect(
+        self, target: str, head: bytes, tunnel: bool
+    ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """the internal method which opens the upstream connection of a request, retried on other proxies.
+        for a tunnel the upstream proxy must accept the CONNECT request first.
+        """
+        try:
+            host = target.rsplit(":", 1)[0] if tunnel else urlsplit(target).hostname
+
+        except ValueError:
+            # e.g. an unclosed ipv6 bracket
+            host = None
+
+        if not host:
+            raise GatewayError(400, "Bad Request")
+
+        tried: Set[Proxy] = set()
+        for _ in range(self.retries):
+            proxy = self._choose(host, tried)
+            if proxy is None:
+                break
+
+            tried.add(proxy)
+            started = time.perf_counter()
+            try:
+                upstream_reader, upstream_writer = await asyncio.wait_for(
+                    asyncio.open_connection(proxy.ip, proxy.port, limit=MAX_HEADER_SIZE),
+                    self.timeout,
+                )
+                if tunnel:
+                    try:
+                        status = await asyncio.wait_for(
+                            _tunnel(upstream_reader, upstream_writer, head), self.timeout
+                        )
+
+                    except BaseException:
+                        # e.g. a timeout or the handler is cancelled, the connection isn't returned.
+                        upstream_writer.close()
+                        raise
+
+                    if status != 200:
+                        upstream_writer.close()
+                        raise ConnectionError(f"CONNECT refused with {status}")
+
+            except Exception as e:
+                self._report(proxy)
+                if metrics.enabled:
+                    metrics.observe(
+                        "gateway_upstream_seconds",
+                        time.perf_counter() - started,
+                        result=failure_reason(e),
+                    )
+
+                continue
+
+            if metrics.enabled:
+                metrics.observe(
+                    "gateway_upstream_seconds", time.perf_counter() - started, result="ok"
+                )
+
+            return upstream_reader, upstream_writer
+
+        if not tried:
+            raise GatewayError(503, "No Proxy Available")
+
+        raise GatewayError(502, "Bad Gateway")
+
+    def _choose(self, host: str, tried: Set[Proxy]) -> Optional[Proxy]:
+        """the internal method used to choose an http proxy which isn't tried yet."""
+        if self.sticky and isinstance(self.source, ProxyQuery):
+            proxy = self.source.for_key(host)
+            if proxy is not None and proxy not in tried and proxy.type.is_http():
+                return proxy
+
+        for _ in range(SELECTION_ATTEMPTS):
+            if isinstance(self.source, ProxyPool):
+                proxy = self.source.get()
+
+            else:
+                proxy = self.source.random(self.strategy)
+
+            if proxy is None:
+                return None
+
+            if proxy not in tried and proxy.type.is_http():
+                return proxy
+
+        return None
+
+    def _report(self, proxy: Proxy) -> None:
+        """the internal method used to report a failing upstream, so it's not chosen again soon."""
+        if isinstance(self.source, ProxyPool):
+            self.source.report(proxy, False)
+
+        else:
+            proxy.record(False)
+            self.source.health_cache.put(proxy, False)
+
+    async def __aenter__(self) -> "ProxyGateway":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    def __repr__(self) -> str:
+        return f"<ProxyGateway {self.url}>"
+
+
+def _request_target(head: bytes) -> Tuple[str, str]:
+    """the method and the target of the request line."""
+    request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    parts = request_line.split()
+    if len(parts) != 3:
+        return "", ""
+
+    return parts[0].upper(), parts[1]
+
+
+async def _tunnel(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, head: bytes
+) -> int:
+    """sends the CONNECT request of the client to the upstream proxy, returns the status of the response."""
+    writer.write(head)
+    await writer.drain()
+    response = await reader.readuntil(b"\r\n\r\n")
+    try:
+        return int(response.split(b" ", 2)[1])
+
+    except (IndexError, ValueError):
+        return 0
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """copies the data of a connection to another one until the end of the stream."""
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+
+            writer.write(data)
+            await writer.drain()
+
+        if writer.can_write_eof():
+            writer.write_eof()
+
+    except (ConnectionError, OSError):
+        writer.close()
@@ -0,0 +1,589 @@
+"""
+contains the HealthChecker class which is used to check health of many proxies at once
+and the HealthCache class which remembers the results.
+"""
+import asyncio
+import threading
+import time
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from aiohttp import ClientSession, TCPConnector
+
+from proxy_random.config import (
+    DEFAULT_BREAKER_FAILURES,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_HEALTH_TTL,
+    DEFAULT_MAX_BACKOFF,
+    DEFAULT_NEGATIVE_TTL,
+    DEFAULT_TCP_CONCURRENCY,
+    DEFAULT_TCP_TIMEOUT,
+    DEFAULT_TIMEOUT,
+    DNS_CACHE_TTL,
+    TEST_URL,
+)
+from proxy_random.metrics import metrics
+from proxy_random.utils import (
+    check_proxy_anonymity,
+    check_proxy_connect,
+    check_proxy_health,
+    check_proxy_https,
+)
+
+
+class Stage:
+    """a stage of a staged health check, a proxy is working if it passes all the stages in order.
+    cheap stages go first so the expensive ones only run on the proxies which passed them.
+    each stage has its own concurrency and timeout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        check: Callable[..., Awaitable[bool]],
+        concurrency: int = None,
+        timeout: float = None,
+        latency: bool = False,
+    ) -> None:
+        """Stage Constructor
+
+        :param name: name of the stage, used in the stats
+        :type name: str
+        :param check: `async check(proxy, timeout, session) -> bool`
+        :type check: Callable[..., Awaitable[bool]]
+        :param concurrency: maximum number of checks of this stage running at the same time, defaults to DEFAULT_CONCURRENCY
+        :type concurrency: int, optional
+        :param timeout: timeout of the check, defaults to DEFAULT_TIMEOUT
+        :type timeout: float, optional
+        :param latency: whether the duration of this stage is recorded as the latency of the proxy, defaults to False
+        :type latency: bool, optional
+        """
+        self.name: str = name
+        self.check: Callable[..., Awaitable[bool]] = check
+        self.concurrency: int = (
+            concurrency if concurrency is not None else DEFAULT_CONCURRENCY
+        )
+        if self.concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1")
+
+        self.timeout: float = timeout if timeout is not None else DEFAULT_TIMEOUT
+        self.latency: bool = latency
+
+    def __repr__(self) -> str:
+        return f"<Stage {self.name}>"
+
+
+# module level functions instead of lambdas, so the built-in stages can be pickled (see check_sharded()).
+async def _connect_check(proxy, timeout: float, session: ClientSession) -> bool:  # type: ignore[Proxy]
+    return await check_proxy_connect(proxy, timeout)
+
+
+async def _url_check(
+    check: Callable[..., Awaitable[bool]],
+    test_url: str,
+    proxy,  # type: ignore[Proxy]
+    timeout: float,
+    session: ClientSession,
+) -> bool:
+    return await check(proxy, test_url, timeout, session)
+
+
+def tcp_stage(concurrency: int = None, timeout: float = None) -> Stage:
+    """a TCP connect probe, drops the unreachable proxies before any request is made.
+
+    :param concurrency: defaults to DEFAULT_TCP_CONCURRENCY
+    :type concurrency: int, optional
+    :param timeout: defaults to DEFAULT_TCP_TIMEOUT
+    :type timeout: float, optional
+    :rtype: Stage
+    """
+    return Stage(
+        "tcp",
+        _connect_check,
+        concurrency if concurrency is not None else DEFAULT_TCP_CONCURRENCY,
+        timeout if timeout is not None else DEFAULT_TCP_TIMEOUT,
+    )
+
+
+def http_stage(test_url: str = None, concurrency: int = None, timeout: float = None) -> Stage:
+    """the usual health check, a GET request to `test_url` through the proxy.
+
+    :param test_url: defaults to TEST_URL
+    :type test_url: str, optional
+    :param concurrency: defaults to DEFAULT_CONCURRENCY
+    :type concurrency: int, optional
+    :param timeout: defaults to DEFAULT_TIMEOUT
+    :type timeout: float, optional
+    :rtype: Stage
+    """
+    return Stage(
+        "http",
+        partial(_url_check, check_proxy_health, test_url),
+        concurrency,
+        timeout,
+        latency=True,
+    )
+
+
+def anonymity_stage(test_url: str = None, concurrency: int = None, timeout: float = None) -> Stage:
+    """checks that the proxy doesn't reveal the client address (see check_proxy_anonymity).
+
+    :param test_url: defaults to ANONYMITY_TEST_URL
+    :type test_url: str, optional
+    :param concurrency: defaults to DEFAULT_CONCURRENCY
+    :type concurrency: int, optional
+    :param timeout: defaults to DEFAULT_TIMEOUT
+    :type timeout: float, optional
+    :rtype: Stage
+    """
+    return Stage(
+        "anonymity",
+        partial(_url_check, check_proxy_anonymity, test_url),
+        concurrency,
+        timeout,
+    )
+
+
+def https_stage(test_url: str = None, concurrency: int = None, timeout: float = None) -> Stage:
+    """checks that the proxy supports https (CONNECT) requests.
+
+    :param test_url: defaults to CONNECT_TEST_URL
+    :type test_url: str, optional
+    :param concurrency: defaults to DEFAULT_CONCURRENCY
+    :type concurrency: int, optional
+    :param timeout: defaults to DEFAULT_TIMEOUT
+    :type timeout: float, optional
+    :rtype: Stage
+    """
+    return Stage(
+        "https",
+        partial(_url_check, check_proxy_https, test_url),
+        concurrency,
+        timeout,
+    )
+
+
+class HealthCache:
+    """health check results by ip:port, so proxies checked recently aren't checked again
+    (also when they are extracted again and are different objects).
+    a working result is used for `ttl` seconds, a failed one for `negative_ttl` seconds doubled on every
+    failure in a row (at most `max_backoff`).
+
+    it's a circuit breaker too: after `max_failures` failures in a row the circuit of the proxy is open,
+    it's not selected by ProxyQuery.random() until the backoff passes, then the next check closes the circuit
+    (if it works) or opens it again for longer.
+    it's thread-safe, e.g. ProxyPool.report() stores results from the threads of the callers.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_HEALTH_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        max_failures: int = DEFAULT_BREAKER_FAILURES,
+    ) -> None:
+        """HealthCache Constructor
+
+        :param ttl: seconds a working result is used, defaults to DEFAULT_HEALTH_TTL
+        :type ttl: float, optional
+        :param negative_ttl: seconds the first failed result is used, doubled on every failure in a row, defaults to DEFAULT_NEGATIVE_TTL
+        :type negative_ttl: float, optional
+        :param max_backoff: maximum seconds a failed result is used, defaults to DEFAULT_MAX_BACKOFF
+        :type max_backoff: float, optional
+        :param max_failures: failures in a row which open the circuit of a proxy, defaults to DEFAULT_BREAKER_FAILURES
+        :type max_failures: int, optional
+        """
+        self.ttl: float = ttl
+        self.negative_ttl: float = negative_ttl
+        self.max_backoff: float = max_backoff
+        self.max_failures: int = max_failures
+
+        # ip:port -> (time of the check, working, failures in a row)
+        self._results: Dict[Tuple[str, int], Tuple[float, bool, int]] = {}
+        self._lock = threading.Lock()
+
+    def _lifetime(self, working: bool, failures: int) -> float:
+        if working:
+            return self.ttl
+
+        return min(self.negative_ttl * 2 ** (failures - 1), self.max_backoff)
+
+    def get(self, proxy) -> Optional[Tuple[float, bool]]:  # type: ignore[Proxy]
+        """returns the cached result of a proxy if it's still fresh.
+
+        :param proxy: the proxy
+        :type proxy: Proxy
+        :return: time of the check and whether it worked, None if there is no fresh result
+        :rtype: Optional[tuple[float, bool]]
+        """
+        with self._lock:
+            result = self._results.get((proxy.ip, proxy.port))
+
+        if result is None:
+            return None
+
+        checked_at, working, failures = result
+        if time.time() - checked_at >= self._lifetime(working, failures):
+            return None
+
+        return checked_at, working
+
+    def put(self, proxy, working: bool, checked_at: float = None) -> None:  # type: ignore[Proxy]
+        """stores the result of a check.
+
+        :param proxy: the checked proxy
+        :type proxy: Proxy
+        :param working: whether the proxy worked
+        :type working: bool
+        :param checked_at: unix timestamp of the check, defaults to now
+        :type checked_at: float, optional
+        """
+        key = (proxy.ip, proxy.port)
+        if checked_at is None:
+            checked_at = time.time()
+
+        # the failures in a row are read and incremented at once.
+        with self._lock:
+            failures = 0
+            if not working:
+                previous = self._results.get(key)
+                failures = (previous[2] if previous is not None else 0) + 1
+
+            self._results[key] = (checked_at, working, failures)
+
+    def is_open(self, proxy) -> bool:  # type: ignore[Proxy]
+        """whether the circuit of the proxy is open (it failed `max_failures` times in a row and the backoff didn't pass yet).
+
+        :param proxy: the proxy
+        :type proxy: Proxy
+        :return: True if the proxy shouldn't be used
+        :rtype: bool
+        """
+        with self._lock:
+            result = self._results.get((proxy.ip, proxy.port))
+
+        if result is None:
+            return False
+
+        checked_at, working, failures = result
+        return (
+            not working
+            and failures >= self.max_failures
+            and time.time() - checked_at < self._lifetime(working, failures)
+        )
+
+    def prune(self) -> None:
+        """removes the results which are not fresh anymore."""
+        now = time.time()
+        with self._lock:
+            self._results = {
+                key: result
+                for key, result in self._results.items()
+                if now - result[0] < self._lifetime(result[1], result[2])
+            }
+
+    def clear(self) -> None:
+        """removes all the results."""
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __repr__(self) -> str:
+        return f"<HealthCache {len(self._results)} results>"
+
+
+class HealthChecker:
+    """bounded concurrency health checker.
+    all the checks share one session (and its connection pool, DNS cache and SSL context).
+    """
+
+    def __init__(
+        self,
+        test_url: str = None,
+        timeout: int = None,
+        concurrency: int = None,
+        cache: HealthCache = None,
+        force: bool = False,
+        stages: List[Stage] = None,
+    ) -> None:
+        """HealthChecker Constructor
+
+        :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time, if not provided DEFAULT_CONCURRENCY will be used, defaults to None
+        :type concurrency: int, optional
+        :param cache: cache of the results, proxies with a fresh result aren't checked again and the new results are stored in it, defaults to None
+        :type cache: HealthCache, optional
+        :param force: whether to check the proxies which have a fresh result in the cache too (the results are still stored), defaults to False
+        :type force: bool, optional
+        :param stages: check the proxies in stages (e.g. [tcp_stage(), http_stage()]) instead of a single request to `test_url`,
+            `concurrency` is then the number of proxies in the pipeline (the default is the largest stage concurrency)
+            and `test_url` and `timeout` are not used, defaults to None
+        :type stages: list[Stage], optional
+        """
+        self.test_url: str = test_url if test_url is not None else TEST_URL
+        self.timeout: Union[int, None] = timeout
+        self.stages: Optional[List[Stage]] = stages
+        if concurrency is None:
+            concurrency = (
+                max(stage.concurrency for stage in stages)
+                if stages
+                else DEFAULT_CONCURRENCY
+            )
+
+        self.concurrency: int = concurrency
+        if self.concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1")
+
+        self.cache: Optional[HealthCache] = cache
+        self.force: bool = force
+
+        # stats of the checks done by this checker, `cached` results are not counted as checked.
+        self.checked: int = 0
+        self.working: int = 0
+        self.cached: int = 0
+        self.elapsed: float = 0.0
+        # stage name -> [checked, passed]
+        self.stage_stats: Dict[str, List[int]] = {
+            stage.name: [0, 0] for stage in stages or ()
+        }
+        self._stage_semaphores: List[asyncio.Semaphore] = []
+
+        self._started: Union[float, None] = None
+        self._session: Union[ClientSession, None] = None
+        self._semaphore: Union[asyncio.Semaphore, None] = None
+
+    @property
+    def checks_per_second(self) -> float:
+        """the throughput of the checker.
+
+        :return: number of finished checks per second
+        :rtype: float
+        """
+        if self.elapsed == 0:
+            return 0.0
+
+        return self.checked / self.elapsed
+
+    async def open(self) -> None:
+        """creates the shared session, called automatically when the checker is used as a context manager."""
+        if self._session is None:
+            connector = TCPConnector(
+                limit=self.concurrency,
+                ttl_dns_cache=DNS_CACHE_TTL,
+            )
+            self._session = ClientSession(
+                connector=connector,
+                headers={
+                    "Accept": "*/*",
+                },
+                trace_configs=metrics.trace_configs(),
+            )
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._stage_semaphores = [
+                asyncio.Semaphore(stage.concurrency) for stage in self.stages or ()
+            ]
+
+    async def close(self) -> None:
+        """closes the shared session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def check(self, proxy) -> bool:  # type: ignore[Proxy]
+        """checks a single proxy, at most `concurrency` checks run at the same time.
+
+        :param proxy: the proxy to check
+        :type proxy: Proxy
+        :return: returns True if the proxy is working, False otherwise
+        :rtype: bool
+        """
+        if self.cache is not None and not self.force:
+            cached = self.cache.get(proxy)
+            if cached is not None:
+                checked_at, working = cached
+                if proxy.checked_at is None or proxy.checked_at < checked_at:
+                    proxy.checked_at = checked_at
+                    proxy.verified = True
+                    proxy.working = working
+
+                self.cached += 1
+                if metrics.enabled:
+                    metrics.count("health_cache_hits_total")
+
+                return working
+
+        await self.open()
+
+        if self._started is None:
+            self._started = time.perf_counter()
+
+        async with self._semaphore:
+            if self.stages:
+                result = await self._check_stages(proxy)
+
+            else:
+                result = await proxy._check_health(
+                    self.test_url, self.timeout, session=self._session
+                )
+
+        if self.cache is not None:
+            self.cache.put(proxy, result, proxy.checked_at)
+
+        # wall clock time since the first check, not the sum of the checks.
+        self.elapsed = time.perf_counter() - self._started
+        self.checked += 1
+        if result:
+            self.working += 1
+
+        return result
+
+    async def _check_stages(self, proxy) -> bool:  # type: ignore[Proxy]
+        """the internal method used to run the stages on a proxy, stops at the first failed stage."""
+        latency = None
+        working = True
+        for stage, semaphore in zip(self.stages, self._stage_semaphores):
+            async with semaphore:
+                started = time.perf_counter()
+                passed = await stage.check(proxy, stage.timeout, self._session)
+
+            stats = self.stage_stats[stage.name]
+            stats[0] += 1
+            if metrics.enabled:
+                metrics.count(
+                    "health_stage_total",
+                    stage=stage.name,
+                    result="passed" if passed else "failed",
+                )
+
+            if not passed:
+                working = False
+                break
+
+            stats[1] += 1
+            if stage.latency:
+                latency = time.perf_counter() - started
+
+        proxy._set_health(working, latency)
+        return working
+
+    async def _worker(
+        self, proxies: Union[Iterator, asyncio.Queue], found: asyncio.Queue = None
+    ) -> None:
+        """the internal method used to check proxies until there are no proxies left, the working ones are put in `found`.
+        `proxies` is an iterator shared by the workers or a queue which is fed while checking, None in the queue marks the end.
+        """
+        while True:
+            if isinstance(proxies, asyncio.Queue):
+                proxy = await proxies.get()
+                if proxy is None:
+                    # for the other workers.
+                    proxies.put_nowait(None)
+                    return
+
+            else:
+                proxy = next(proxies, None)
+                if proxy is None:
+                    return
+
+            if await self.check(proxy) and found is not None:
+                found.put_nowait(proxy)
+
+    async def check_all(self, proxies: Union[Iterable, asyncio.Queue]) -> None:
+        """checks all the given proxies.
+        only `concurrency` workers are created so the number of open sockets stays bounded.
+
+        :param proxies: the proxies to check, or a queue the proxies are put in as they arrive (put None after the last one)
+        :type proxies: Union[Iterable[Proxy], asyncio.Queue]
+        """
+        if not isinstance(proxies, asyncio.Queue):
+            proxies = iter(proxies)
+
+        workers = [
+            asyncio.ensure_future(self._worker(proxies)) for _ in range(self.concurrency)
+        ]
+        try:
+            await asyncio.gather(*workers)
+
+        finally:
+            # if a worker failed (or the call is cancelled) the others are stopped too,
+            # they shouldn't keep using a session which is about to be closed.
+            for task in workers:
+                task.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def iter_healthy(
+        self, proxies: Union[Iterable, asyncio.Queue], limit: int = None
+    ) -> AsyncIterator:
+        """checks the given proxies and yields each working proxy as soon as its check passes.
+        when `limit` working proxies are found (or the iteration is stopped) the remaining checks are cancelled.
+
+        :param proxies: the proxies to check, or a queue the proxies are put in as they arrive (put None after the last one)
+        :type proxies: Union[Iterable[Proxy], asyncio.Queue]
+        :param limit: stop after this many working proxies are found, defaults to None
+        :type limit: int, optional
+        :yield: working proxies
+        :rtype: AsyncIterator[Proxy]
+        """
+        if limit is not None and limit <= 0:
+            return
+
+        if not isinstance(proxies, asyncio.Queue):
+            proxies = iter(proxies)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        workers = [
+            asyncio.ensure_future(self._worker(proxies, queue))
+            for _ in range(self.concurrency)
+        ]
+        finished = asyncio.gather(*workers, return_exceptions=True)
+        # None marks that there is nothing left to check.
+        finished.add_done_callback(lambda _: queue.put_nowait(None))
+
+        found = 0
+        try:
+            while limit is None or found < limit:
+                proxy = await queue.get()
+                if proxy is None:
+                    for result in finished.result():
+                        if isinstance(result, Exception):
+                            raise result
+
+                    break
+
+                found += 1
+                yield proxy
+
+        finally:
+            for task in workers:
+                task.cancel()
+
+            await finished
+
+    async def __aenter__(self) -> "HealthChecker":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def __repr__(self) -> str:
+        return f"<HealthChecker {self.checked} checked, {self.checks_per_second:.1f}/s>"
@@ -0,0 +1,282 @@
+"""
+contains the Metrics class which receives the timings and counters of the fetch, parse and health check phases
+and the sinks they can be sent to (a callback, logging or a Prometheus text exporter).
+"""
+import asyncio
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from aiohttp import (
+    ClientConnectorError,
+    ClientHttpProxyError,
+    ClientResponseError,
+    ClientSession,
+    TraceConfig,
+)
+from aiohttp_proxy.errors import ProxyError, SocksError
+
+from proxy_random.config import DEFAULT_METRIC_BUCKETS
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# `sink(kind, name, value, labels)`, kind is COUNTER, GAUGE or HISTOGRAM.
+Sink = Callable[[str, str, float, Dict[str, str]], None]
+
+
+def failure_reason(error: BaseException) -> str:
+    """the reason of a failed request, used as a label.
+
+    :param error: the exception raised by the request
+    :type error: BaseException
+    :return: "timeout", "refused", "bad_status", "bad_body", "connection" or "error"
+    :rtype: str
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+
+    if isinstance(error, ConnectionRefusedError) or (
+        isinstance(error, ClientConnectorError)
+        and isinstance(error.os_error, ConnectionRefusedError)
+    ):
+        return "refused"
+
+    # the proxy rejected the CONNECT request (or the socks handshake).
+    if isinstance(error, (ClientHttpProxyError, ClientResponseError, ProxyError, SocksError)):
+        return "bad_status"
+
+    # ValueError covers invalid json.
+    if isinstance(error, ValueError):
+        return "bad_body"
+
+    if isinstance(error, OSError):
+        return "connection"
+
+    return "error"
+
+
+class Metrics:
+    """sends the events of the package to the registered sinks.
+    without sinks `enabled` is False and the instrumented code skips the timing, so disabled metrics cost a flag check.
+
+    the events:
+
+    - provider_fetch_seconds (histogram, provider, result): fetching the page of a provider
+    - provider_parse_seconds (histogram, provider): running the extractor
+    - provider_errors_total (counter, provider, phase, reason)
+    - provider_proxies (gauge, provider): proxies listed by the provider
+    - proxy_check_seconds (histogram, check, result): a single request (or connection) of a check of a proxy
+      (tcp, http, anonymity, https), result is "ok" or the failure reason (see failure_reason)
+    - health_cache_hits_total (counter): checks answered by the HealthCache
+    - health_stage_total (counter, stage, result): proxies which passed or failed each stage
+    - dns_resolve_seconds (histogram, host), connect_seconds (histogram): from the sessions of the package
+    - proxies (gauge): proxies in RandomProxy.proxy_query
+    - pool_ready, pool_tracked (gauges): verified and tracked proxies of a ProxyPool
+
+    sessions created while metrics are disabled are not traced (see trace_configs()).
+    """
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self._sinks: List[Sink] = []
+
+    def add_sink(self, sink: Sink) -> None:
+        """starts sending the events to a sink.
+
+        :param sink: `sink(kind, name, value, labels)`, e.g. a function, LoggingSink or PrometheusSink
+        :type sink: Sink
+        """
+        self._sinks.append(sink)
+        self.enabled = True
+
+    def remove_sink(self, sink: Sink) -> None:
+        """stops sending the events to a sink.
+
+        :param sink: the sink
+        :type sink: Sink
+        """
+        self._sinks.remove(sink)
+        self.enabled = bool(self._sinks)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """increments a counter."""
+        self._emit(COUNTER, name, value, labels)
+
+    def gauge(self, name: str, value: float, **labels: str) -> None:
+        """sets a gauge."""
+        self._emit(GAUGE, name, value, labels)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """adds a value (usually seconds) to a histogram."""
+        self._emit(HISTOGRAM, name, value, labels)
+
+    def _emit(self, kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+        for sink in self._sinks:
+            try:
+                sink(kind, name, value, labels)
+
+            except Exception as e:
+                print(f"Error in metrics sink {sink!r}: {e}")
+
+    def trace_configs(self) -> List[TraceConfig]:
+        """the trace configs of a new ClientSession, they time the dns resolution and the connections.
+
+        :return: the trace configs, empty if metrics are disabled
+        :rtype: list[TraceConfig]
+        """
+        if not self.enabled:
+            return []
+
+        async def dns_start(
+            session: ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            context.dns_started = time.perf_counter()
+
+        async def dns_end(
+            session: ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.observe(
+                "dns_resolve_seconds",
+                time.perf_counter() - context.dns_started,
+                host=params.host,
+            )
+
+        async def connect_start(
+            session: ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            context.connect_started = time.perf_counter()
+
+        async def connect_end(
+            session: ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.observe("connect_seconds", time.perf_counter() - context.connect_started)
+
+        trace_config = TraceConfig()
+        trace_config.on_dns_resolvehost_start.append(dns_start)
+        trace_config.on_dns_resolvehost_end.append(dns_end)
+        trace_config.on_connection_create_start.append(connect_start)
+        trace_config.on_connection_create_end.append(connect_end)
+        return [trace_config]
+
+    def __repr__(self) -> str:
+        return f"<Metrics {len(self._sinks)} sinks>"
+
+
+# the instance used by the package.
+metrics = Metrics()
+
+
+class LoggingSink:
+    """logs every event, e.g. `metrics.add_sink(LoggingSink())`."""
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.DEBUG) -> None:
+        """LoggingSink Constructor
+
+        :param logger: the logger, defaults to the "proxy_random.metrics" logger
+        :type logger: logging.Logger, optional
+        :param level: level of the log records, defaults to logging.DEBUG
+        :type level: int, optional
+        """
+        self.logger: logging.Logger = (
+            logger if logger is not None else logging.getLogger(__name__)
+        )
+        self.level: int = level
+
+    def __call__(self, kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+        if self.logger.isEnabledFor(self.level):
+            labels_text = "".join(f" {key}={value}" for key, value in labels.items())
+            self.logger.log(self.level, "%s %s %g%s", kind, name, value, labels_text)
+
+
+class PrometheusSink:
+    """aggregates the events, render() returns them in the Prometheus text format.
+    counters are summed, gauges keep the last value and histograms count the values in `buckets`.
+    safe to render from another thread (e.g. a web server).
+    """
+
+    def __init__(
+        self, namespace: str = "proxy_random", buckets: Sequence[float] = DEFAULT_METRIC_BUCKETS
+    ) -> None:
+        """PrometheusSink Constructor
+
+        :param namespace: prefix of the metric names, defaults to "proxy_random"
+        :type namespace: str, optional
+        :param buckets: upper bounds of the histogram buckets, defaults to DEFAULT_METRIC_BUCKETS
+        :type buckets: Sequence[float], optional
+        """
+        self.namespace: str = namespace
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+
+        # name -> (kind, labels -> value), a histogram value is [count per bucket..., sum, count]
+        self._series: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, str], ...], list]]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(name, (kind, {}))[1]
+            if kind == HISTOGRAM:
+                counts = series.get(key)
+                if counts is None:
+                    counts = series[key] = [0] * (len(self.buckets) + 2)
+
+                for i, bound in enumerate(self.buckets):
+                    if value <= bound:
+                        counts[i] += 1
+
+                counts[-2] += value
+                counts[-1] += 1
+
+            elif kind == COUNTER:
+                series[key] = [series.get(key, [0])[0] + value]
+
+            else:
+                series[key] = [value]
+
+    def render(self) -> str:
+        """returns the aggregated metrics in the Prometheus text exposition format.
+
+        :return: the metrics
+        :rtype: str
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, series) in sorted(self._series.items()):
+                name = f"{self.namespace}_{name}" if self.namespace else name
+                lines.append(f"# TYPE {name} {kind}")
+                for key, values in series.items():
+                    if kind != HISTOGRAM:
+                        lines.append(f"{name}{_labels(key)} {values[0]:g}")
+                        continue
+
+                    for bound, count in zip(self.buckets, values):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', f'{bound:g}'),))} {count}")
+
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{name}_sum{_labels(key)} {values[-2]:g}")
+                    lines.append(f"{name}_count{_labels(key)} {values[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """drops the aggregated metrics."""
+        with self._lock:
+            self._series.clear()
+
+    def __repr__(self) -> str:
+        return f"<PrometheusSink {len(self._series)} metrics>"
+
+
+def _labels(key: Tuple[Tuple[str, str], ...]) -> str:
+    if not key:
+        return ""
+
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
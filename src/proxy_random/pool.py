@@ -0,0 +1,365 @@
+"""
+contains the ProxyPool class, a long running service which keeps a set of verified proxies ready.
+"""
+import asyncio
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from proxy_random.config import (
+    DEFAULT_MAX_FAILURES,
+    DEFAULT_RECHECK_INTERVAL,
+    DEFAULT_REFRESH_INTERVAL,
+)
+from proxy_random.health import HealthChecker
+from proxy_random.metrics import metrics
+from proxy_random.proxy import Proxy
+from proxy_random.random_proxy import RandomProxy
+from proxy_random.shared import SharedProxyTable
+
+# seconds between two rounds of the background loop.
+TICK = 1
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyPool:
+    """keeps the proxies of a RandomProxy fresh in the background.
+    providers are refreshed every `refresh_interval` seconds, proxies are re-checked when their result gets old
+    (the stalest first, failing proxies are re-checked with exponential backoff)
+    and proxies which fail `max_failures` times in a row are evicted.
+    get() returns a random verified proxy in O(1) without blocking.
+    with `shared_table` the verified proxies are published to it after every round, so other processes can use them,
+    and the proxies they report as failing there are checked again.
+
+    usage inside an event loop: `await pool.start()` ... `await pool.stop()`
+    usage from threads: `pool.start_thread()` ... `pool.stop_thread()`
+    """
+
+    def __init__(
+        self,
+        random_proxy: RandomProxy = None,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        recheck_interval: float = DEFAULT_RECHECK_INTERVAL,
+        max_failures: int = DEFAULT_MAX_FAILURES,
+        test_url: str = None,
+        timeout: int = None,
+        concurrency: int = None,
+        shared_table: SharedProxyTable = None,
+    ) -> None:
+        """ProxyPool Constructor
+
+        :param random_proxy: the RandomProxy used to fetch the proxies, if not provided one with the default providers is used, defaults to None
+        :type random_proxy: RandomProxy, optional
+        :param refresh_interval: seconds between two refreshes of the providers, defaults to DEFAULT_REFRESH_INTERVAL
+        :type refresh_interval: float, optional
+        :param recheck_interval: seconds a health check result is used before the proxy is checked again, defaults to DEFAULT_RECHECK_INTERVAL
+        :type recheck_interval: float, optional
+        :param max_failures: number of failed checks in a row after which the proxy is evicted, defaults to DEFAULT_MAX_FAILURES
+        :type max_failures: int, optional
+        :param test_url: test url used to check health of proxies, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time, defaults to None
+        :type concurrency: int, optional
+        :param shared_table: a table the verified proxies are published to (see SharedProxyTable), defaults to None
+        :type shared_table: SharedProxyTable, optional
+        """
+        self.random_proxy: RandomProxy = (
+            random_proxy if random_proxy is not None else RandomProxy()
+        )
+        self.refresh_interval: float = refresh_interval
+        self.recheck_interval: float = recheck_interval
+        self.max_failures: int = max_failures
+        self.test_url: Optional[str] = test_url
+        self.timeout: Optional[int] = timeout
+        self.concurrency: Optional[int] = concurrency
+        self.shared_table: Optional[SharedProxyTable] = shared_table
+
+        # ip:port -> proxy, all the proxies the pool knows about.
+        self._proxies: Dict[Tuple[str, int], Proxy] = {}
+        # ip:port -> failed checks in a row
+        self._failures: Dict[Tuple[str, int], int] = {}
+        # (time of the next check, ip:port), entries which don't match _next_check (evicted or rescheduled proxies)
+        # are skipped when popped.
+        self._schedule: List[Tuple[float, Tuple[str, int]]] = []
+        # ip:port -> time of the next check, one pending check per proxy.
+        self._next_check: Dict[Tuple[str, int], float] = {}
+
+        # the verified working proxies, a list and the positions in it so add, remove and random choice are O(1).
+        self._ready: List[Proxy] = []
+        self._positions: Dict[Tuple[str, int], int] = {}
+        # failing proxies reported by the users, checked in the next round.
+        self._reported: Set[Tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        # incremented when the ready set changes, and its value at the last publish to shared_table.
+        self._ready_version: int = 0
+        self._published_version: Optional[int] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self) -> Optional[Proxy]:
+        """returns a random verified proxy, safe to call from any thread.
+
+        :return: a working proxy, None if no proxy is verified yet
+        :rtype: Optional[Proxy]
+        """
+        with self._lock:
+            if not self._ready:
+                return None
+
+            return random.choice(self._ready)
+
+    def report(self, proxy: Proxy, working: bool, latency: float = None) -> None:
+        """reports the result of using a proxy, a failing proxy is removed from the ready set and checked again soon.
+        safe to call from any thread.
+
+        :param proxy: the proxy
+        :type proxy: Proxy
+        :param working: whether the proxy worked
+        :type working: bool
+        :param latency: response time of the request in seconds, used in the score of the proxy, defaults to None
+        :type latency: float, optional
+        """
+        key = (proxy.ip, proxy.port)
+        # the proxy may be a row of storage replaced by a removal, the score goes to the tracked one.
+        proxy = self._proxies.get(key, proxy)
+        proxy.record(working, latency)
+        self.random_proxy.proxy_query.health_cache.put(proxy, working)
+        if not working:
+            self._discard(key)
+            with self._lock:
+                self._reported.add(key)
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def _add_ready(self, key: Tuple[str, int], proxy: Proxy) -> None:
+        with self._lock:
+            if key not in self._positions:
+                self._positions[key] = len(self._ready)
+                self._ready.append(proxy)
+                self._ready_version += 1
+
+    def _discard(self, key: Tuple[str, int]) -> None:
+        with self._lock:
+            position = self._positions.pop(key, None)
+            if position is None:
+                return
+
+            self._ready_version += 1
+            # move the last proxy into the hole.
+            last = self._ready.pop()
+            if position < len(self._ready):
+                self._ready[position] = last
+                self._positions[(last.ip, last.port)] = position
+
+    def _schedule_check(self, key: Tuple[str, int], at: float) -> None:
+        """sets the time of the next check of a proxy, replacing the pending one."""
+        self._next_check[key] = at
+        heapq.heappush(self._schedule, (at, key))
+
+    def _track(self, proxies: List[Proxy]) -> None:
+        """starts scheduling checks for the proxies, proxies with a fresh result are ready right away."""
+        now = time.time()
+        for proxy in proxies:
+            key = (proxy.ip, proxy.port)
+            if key in self._proxies:
+                continue
+
+            self._proxies[key] = proxy
+            checked_at = proxy.checked_at
+            fresh = checked_at is not None and checked_at + self.recheck_interval > now
+            if proxy.verified and fresh:
+                if proxy.working:
+                    self._add_ready(key, proxy)
+
+                self._schedule_check(key, checked_at + self.recheck_interval)
+
+            else:
+                self._schedule_check(key, 0)
+
+    def _untrack(self, proxies: List[Proxy]) -> None:
+        for proxy in proxies:
+            key = (proxy.ip, proxy.port)
+            self._proxies.pop(key, None)
+            self._failures.pop(key, None)
+            self._next_check.pop(key, None)
+            self._discard(key)
+
+    def _rebind(self) -> None:
+        """looks the tracked proxies up again in proxy_query after a removal.
+        a removal rebuilds the storage, with ProxyColumns the rows the pool holds would point at the old columns.
+        """
+        for proxy in self.random_proxy.proxy_query._proxy_list:
+            key = (proxy.ip, proxy.port)
+            if key in self._proxies:
+                self._proxies[key] = proxy
+
+        with self._lock:
+            self._ready = [self._proxies.get((proxy.ip, proxy.port), proxy) for proxy in self._ready]
+
+    async def refresh(self) -> None:
+        """refreshes the providers and starts tracking the new proxies."""
+        added, removed = await self.random_proxy.arefresh()
+        self._untrack(removed)
+        self._track(added)
+        if removed:
+            self._rebind()
+
+    async def check_due(self) -> None:
+        """checks the proxies whose result is old (or which are never checked)."""
+        with self._lock:
+            reported, self._reported = self._reported, set()
+
+        due: Dict[Tuple[str, int], Proxy] = {}
+        for key in reported:
+            if key in self._proxies:
+                due[key] = self._proxies[key]
+
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            at, key = heapq.heappop(self._schedule)
+            if self._next_check.get(key) != at:
+                continue
+
+            del self._next_check[key]
+            proxy = self._proxies.get(key)
+            if proxy is not None:
+                due[key] = proxy
+
+        if not due:
+            return
+
+        dead = []
+
+        async def check(proxy: Proxy) -> None:
+            key = (proxy.ip, proxy.port)
+            if await checker.check(proxy):
+                self._failures.pop(key, None)
+                self._add_ready(key, proxy)
+                self._schedule_check(key, time.time() + self.recheck_interval)
+                return
+
+            self._discard(key)
+            failures = self._failures.get(key, 0) + 1
+            if failures >= self.max_failures:
+                dead.append(proxy)
+                return
+
+            self._failures[key] = failures
+            # unreliable proxies are checked less often.
+            backoff = self.recheck_interval * 2 ** (failures - 1)
+            self._schedule_check(key, time.time() + backoff)
+
+        # due proxies are always checked, the results still go to the shared cache.
+        checker = HealthChecker(
+            self.test_url,
+            self.timeout,
+            self.concurrency,
+            self.random_proxy.proxy_query.health_cache,
+            force=True,
+            stages=self.random_proxy.stages,
+        )
+        async with checker:
+            await asyncio.gather(*(check(proxy) for proxy in due.values()))
+
+        self._untrack(dead)
+        if dead:
+            self.random_proxy.proxy_query._remove(dead)
+            self._rebind()
+
+    def publish(self) -> None:
+        """publishes the verified proxies to `shared_table` if they changed since the last publish,
+        the proxies reported as failing in the table are checked in the next round. called after every round.
+        """
+        for key in self.shared_table.failing():
+            self._discard(key)
+            with self._lock:
+                self._reported.add(key)
+
+        with self._lock:
+            if self._published_version == self._ready_version:
+                return
+
+            self._published_version = self._ready_version
+            ready = self._ready[::]
+
+        self.shared_table.publish(ready)
+
+    async def run(self) -> None:
+        """the background loop, runs until cancelled."""
+        self._track(list(self.random_proxy.proxy_query))
+        next_refresh = 0.0
+        while True:
+            try:
+                if time.time() >= next_refresh:
+                    next_refresh = time.time() + self.refresh_interval
+                    await self.refresh()
+
+                await self.check_due()
+                if self.shared_table is not None:
+                    self.publish()
+
+                if metrics.enabled:
+                    metrics.gauge("pool_ready", len(self._ready))
+                    metrics.gauge("pool_tracked", len(self._proxies))
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                # the loop keeps running, the round is retried after the tick.
+                logger.exception("Error in proxy pool")
+
+            await asyncio.sleep(TICK)
+
+    async def start(self) -> None:
+        """starts the background loop in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        """stops the background loop."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+    def start_thread(self) -> None:
+        """starts the background loop in a new thread with its own event loop."""
+        if self._thread is not None:
+            return
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="proxy-pool", daemon=True
+        )
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def stop_thread(self) -> None:
+        """stops the background loop started by start_thread()."""
+        if self._thread is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+    def __repr__(self) -> str:
+        return f"<ProxyPool {len(self._ready)} ready of {len(self._proxies)}>"
@@ -1,12 +1,17 @@
 """
 contains the provider class which is used to register a provider and parse the response.
 """
-from typing import Callable
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Callable, List, Optional, Tuple
 
 from aiohttp import ClientSession
 
+from proxy_random.metrics import failure_reason, metrics
+from proxy_random.proxy import Proxy
 from proxy_random.query import ProxyQuery
-from proxy_random.utils import get_page
+from proxy_random.utils import get_page_if_modified, parse_last_checked
 
 
 class Provider:
@@ -24,6 +29,10 @@ class Provider:
         self.extractor: Callable = extractor
         self.proxies_query: ProxyQuery = ProxyQuery([])
 
+        # validators of the last fetched page, used for conditional requests in refresh().
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
     def set_extractor(self, extractor: Callable) -> None:
         """used to set the extractor function if not provided in the constructor.
 
@@ -37,23 +46,153 @@ class Provider:
         else:
             raise TypeError(f"extractor must be callable")
 
-    async def extract(self, session: ClientSession) -> None:
+    async def extract(self, session: ClientSession, executor: Executor = None) -> None:
         """the method used to extract proxies from the provider.
         shouldn't be used directly, use the extract_proxies method in RandomProxy class instead.
 
         :param session: session used to fetch the url
         :type session: ClientSession
+        :param executor: executor used to run the extractor off the event loop (the extractor must be picklable for process pools), if not provided the extractor runs on the event loop, defaults to None
+        :type executor: Executor, optional
         :raises ValueError: raises ValueError if the extractor function is not provided.
         """
         if self.extractor is None:
             raise ValueError(f"extractor must be set")
 
-        res = await get_page(self.url, session)
+        res = await self._fetch(session, conditional=False)
         if res is not None:
-            try:
-                self.proxies_query = self.extractor(res)
-            except Exception as e:
-                print(f"Error extracting proxies from {self.url}: {e}")
+            proxies_query = await self._parse(res, executor, time.time())
+            if proxies_query is not None:
+                self.proxies_query = proxies_query
+
+    async def refresh(
+        self, session: ClientSession, executor: Executor = None
+    ) -> Tuple[List[Proxy], List[Proxy]]:
+        """fetches the provider again with a conditional request (the page isn't parsed if it's not modified)
+        and updates the proxies, the proxies which are still in the list are kept (with their health state), only their last_checked is updated.
+        shouldn't be used directly, use the refresh method in RandomProxy class instead.
+
+        :param session: session used to fetch the url
+        :type session: ClientSession
+        :param executor: executor used to run the extractor off the event loop, defaults to None
+        :type executor: Executor, optional
+        :raises ValueError: raises ValueError if the extractor function is not provided.
+        :return: the added and the removed proxies
+        :rtype: tuple[list[Proxy], list[Proxy]]
+        """
+        if self.extractor is None:
+            raise ValueError(f"extractor must be set")
+
+        res = await self._fetch(session, conditional=True)
+        if res is None:
+            return [], []
+
+        proxies_query = await self._parse(res, executor, time.time())
+        if proxies_query is None:
+            return [], []
+
+        old = {(proxy.ip, proxy.port): proxy for proxy in self.proxies_query}
+        proxies = []
+        added = []
+        for proxy in proxies_query:
+            key = (proxy.ip, proxy.port)
+            if key in old:
+                kept = old.pop(key)
+                kept.last_checked = proxy.last_checked
+                proxies.append(kept)
+
+            else:
+                proxies.append(proxy)
+                added.append(proxy)
+
+        self.proxies_query = ProxyQuery(proxies)
+        return added, list(old.values())
+
+    async def _fetch(self, session: ClientSession, conditional: bool) -> Optional[str]:
+        """the internal method used to get the page, keeps the validators for the next conditional request."""
+        started = time.perf_counter()
+        try:
+            res, etag, last_modified = await get_page_if_modified(
+                self.url,
+                session,
+                self.etag if conditional else None,
+                self.last_modified if conditional else None,
+            )
+
+        except Exception as e:
+            if metrics.enabled:
+                reason = failure_reason(e)
+                metrics.observe(
+                    "provider_fetch_seconds",
+                    time.perf_counter() - started,
+                    provider=self.url,
+                    result=reason,
+                )
+                metrics.count(
+                    "provider_errors_total", provider=self.url, phase="fetch", reason=reason
+                )
+
+            raise
+
+        if metrics.enabled:
+            # no page is a 304 of a conditional request or an error status.
+            result = "ok" if res is not None else "not_modified" if conditional else "bad_status"
+            metrics.observe(
+                "provider_fetch_seconds",
+                time.perf_counter() - started,
+                provider=self.url,
+                result=result,
+            )
+
+        if res is not None:
+            self.etag, self.last_modified = etag, last_modified
+
+        return res
+
+    async def _parse(
+        self, res: str, executor: Executor = None, fetched_at: float = None
+    ) -> Optional[ProxyQuery]:
+        """the internal method used to run the extractor, returns None if the extractor fails.
+        relative last checked times ("12 secs ago") are turned into timestamps relative to `fetched_at`.
+        """
+        started = time.perf_counter()
+        try:
+            if executor is None:
+                proxies_query = self.extractor(res)
+
+            else:
+                proxies_query = await asyncio.get_running_loop().run_in_executor(
+                    executor, self.extractor, res
+                )
+
+        except Exception as e:
+            print(f"Error extracting proxies from {self.url}: {e}")
+            if metrics.enabled:
+                metrics.count(
+                    "provider_errors_total",
+                    provider=self.url,
+                    phase="parse",
+                    reason=type(e).__name__,
+                )
+
+            return None
+
+        if metrics.enabled:
+            metrics.observe(
+                "provider_parse_seconds", time.perf_counter() - started, provider=self.url
+            )
+            metrics.gauge("provider_proxies", len(proxies_query), provider=self.url)
+
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        # set without BaseProxy.__setattr__, the proxies are new so no index of them is stale.
+        init = object.__setattr__
+        for proxy in proxies_query:
+            if isinstance(proxy.last_checked, str):
+                init(proxy, "last_checked", parse_last_checked(proxy.last_checked, fetched_at))
+
+        return proxies_query
 
     def get_proxy_query(self) -> ProxyQuery:
         """returns the proxy query object.
@@ -2,14 +2,83 @@
 contains the Proxy and BaseProxy class which contains the information about proxies.
 """
 
+import math
+import time
+from typing import Any, Dict, Optional
+
+from aiohttp import ClientSession
 from aiohttp_proxy import ProxyType
 
+from proxy_random.config import LATENCY_EWMA_ALPHA, SCORE_TOLERANCE
+from proxy_random.sessions import session_cache
 from proxy_random.utils import check_proxy_health
 
+# the fields ProxyQuery builds indexes of (see BaseProxy.versions).
+INDEXED_FIELDS = (
+    "ip",
+    "port",
+    "country_code",
+    "country",
+    "anonymity",
+    "google",
+    "https",
+    "verified",
+    "working",
+    "last_checked",
+)
+
+# the fields set by the health checks.
+HEALTH_FIELDS = (
+    "verified",
+    "working",
+    "checked_at",
+    "latency",
+    "latency_ewma",
+    "successes",
+    "failures",
+)
+
+
+def _score_bucket(score: Optional[float]) -> Optional[int]:
+    """the bucket of a score on a logarithmic scale, the scores of a bucket differ by less than SCORE_TOLERANCE."""
+    if not score:
+        return None
+
+    return math.floor(math.log(score, 1 + SCORE_TOLERANCE))
+
 
 class BaseProxy:
     """The base proxy class"""
 
+    # slots instead of a per instance __dict__ to keep large pools small,
+    # custom fields (extra kwargs) are stored in the `extra` dict, e.g. proxy.extra["source"] = "...".
+    __slots__ = (
+        "ip",
+        "port",
+        "country_code",
+        "country",
+        "anonymity",
+        "google",
+        "https",
+        "last_checked",
+        "_verified",
+        "_working",
+        "checked_at",
+        "latency",
+        "latency_ewma",
+        "successes",
+        "failures",
+        "type",
+        "extra",
+    )
+
+    # field -> number of times that field of any proxy was set (one of INDEXED_FIELDS),
+    # used by ProxyQuery to know which of its indexes are stale.
+    versions: Dict[str, int] = dict.fromkeys(INDEXED_FIELDS, 0)
+    # bumped when a recorded result moves the score of a proxy to another bucket (see record()),
+    # used by ProxyQuery to know when the weights of random("weighted") are stale.
+    score_version: int = 0
+
     def __init__(
         self,
         ip: str=None,
@@ -19,7 +88,7 @@ class BaseProxy:
         anonymity: str=None,
         google: bool=None,
         https: bool=None,
-        last_checked: str=None,
+        last_checked: float=None,
         **kwargs,
     ) -> None:
         """BaseProxy constructor, Don't use this class directly, instead use the Proxy class.
@@ -38,29 +107,136 @@ class BaseProxy:
         :type google: bool
         :param https: whether it's a https proxy
         :type https: bool
-        :param last_checked: last checked time
-        :type last_checked: str
+        :param last_checked: unix timestamp of when the provider last checked the proxy (relative times like "12 secs ago" are converted by the Provider)
+        :type last_checked: float
         """
+        # custom fields, created when the first one is passed.
+        self.extra: Optional[Dict[str, Any]] = None
 
-        self.ip: str = ip
-        self.port: int = port
-        self.country_code: str = country_code
-        self.country: str = country
-        self.anonymity: str = anonymity
-        self.google: bool = google
-        self.https: bool = https
-        # TODO: parse last_checked for better querying.
-        self.last_checked: str = last_checked
+        # set without __setattr__, a new proxy doesn't make any index stale.
+        init = object.__setattr__
+        init(self, "ip", ip)
+        init(self, "port", port)
+        init(self, "country_code", country_code)
+        init(self, "country", country)
+        init(self, "anonymity", anonymity)
+        init(self, "google", google)
+        init(self, "https", https)
+        init(self, "last_checked", last_checked)
 
         # whether it's verified that the proxy is working or not.
-        self.verified: bool = False
-        self.working: bool = False
+        self._verified: bool = False
+        self._working: bool = False
+        # unix timestamp of the last health check.
+        self.checked_at: Optional[float] = None
+        # response time (seconds) of the last successful request and its moving average.
+        self.latency: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        # number of successful and failed requests (health checks and reported results).
+        self.successes: int = 0
+        self.failures: int = 0
 
         for argname, arg in kwargs.items():
-            setattr(self, argname, arg)
+            try:
+                setattr(self, argname, arg)
+
+            except AttributeError:
+                if self.extra is None:
+                    self.extra = {}
+
+                self.extra[argname] = arg
 
         self.type: str = ProxyType.HTTPS if self.https else ProxyType.HTTP
 
+    def __getattr__(self, name: str) -> Any:
+        # only called when the attribute is not found in the slots.
+        if name != "extra":
+            extra = self.extra
+            if extra is not None and name in extra:
+                return extra[name]
+
+        raise AttributeError(f"Proxy has no attribute {name}")
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        versions = BaseProxy.versions
+        if name in versions:
+            versions[name] += 1
+
+    def __setstate__(self, state: tuple) -> None:
+        # unpickled (e.g. returned by an extractor in a process pool) without __setattr__ like in __init__,
+        # a new proxy doesn't make any index stale.
+        _, slots = state
+        for name, value in slots.items():
+            object.__setattr__(self, name, value)
+
+    @property
+    def verified(self) -> bool:
+        """whether the proxy is checked or not."""
+        return self._verified
+
+    @verified.setter
+    def verified(self, value: bool) -> None:
+        self._verified = value
+
+    @property
+    def working(self) -> bool:
+        """whether the proxy was working in the last check or not."""
+        return self._working
+
+    @working.setter
+    def working(self, value: bool) -> None:
+        self._working = value
+
+    @property
+    def score(self) -> Optional[float]:
+        """the expected cost of using the proxy (lower is better), the average latency divided by the success rate.
+
+        :return: the score, None if the latency of the proxy is unknown
+        :rtype: Optional[float]
+        """
+        if self.latency_ewma is None:
+            return None
+
+        # laplace smoothing, so a single failure doesn't make the score infinite.
+        success_rate = (self.successes + 1) / (self.successes + self.failures + 2)
+        return self.latency_ewma / success_rate
+
+    def record(self, working: bool, latency: float = None) -> None:
+        """records the result of a request made through the proxy.
+
+        :param working: whether the request succeeded
+        :type working: bool
+        :param latency: response time in seconds, only used if the request succeeded, defaults to None
+        :type latency: float, optional
+        """
+        bucket = _score_bucket(self.score)
+        if working:
+            self.successes += 1
+            if latency is not None:
+                self.latency = latency
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency
+
+                else:
+                    self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+
+        else:
+            self.failures += 1
+
+        if _score_bucket(self.score) != bucket:
+            BaseProxy.score_version += 1
+
+    def session(self) -> ClientSession:
+        """returns a keep-alive session whose requests go through the proxy, from the shared session cache
+        (repeated requests reuse the connections to the proxy). must be called while an event loop is running,
+        don't close the session, it's closed when it's evicted from the cache or by `await session_cache.close()`.
+
+        :return: the session of the proxy
+        :rtype: ClientSession
+        """
+        return session_cache.get(self)
+
     @property
     def url(self) -> str:
         """the proxy url in format of ip:port
@@ -70,7 +246,7 @@ class BaseProxy:
         """
         return f"{self.ip}:{self.port}"
 
-    async def _check_health(self, test_url=None, timeout=None) -> bool:
+    async def _check_health(self, test_url=None, timeout=None, session=None) -> bool:
         """checks the proxy health by making a request to the test_url.
         should not be used directly, instead use ProxyQuery.check_health.
 
@@ -78,17 +254,40 @@ class BaseProxy:
         :type test_url: str, optional
         :param timeout: timout used in the test request, if not provided 5 seconds will be used, defaults to None
         :type timeout: int, optional
+        :param session: shared session used for the request (see HealthChecker), a new one is created if not provided, defaults to None
+        :type session: ClientSession, optional
         :return: returns True if the proxy is working, False otherwise
         :rtype: bool
         """
+        # the state is only updated when the check finishes, so a cancelled check
+        # doesn't leave the proxy marked as verified.
+        started = time.perf_counter()
+        working = await check_proxy_health(self, test_url, timeout, session)
+        self._set_health(working, time.perf_counter() - started)
+
+        return self.working
+
+    def _set_health(self, working: bool, latency: float = None) -> None:
+        """the internal method used to store the result of a health check.
+
+        :param working: whether the proxy passed the check
+        :type working: bool
+        :param latency: response time of the check in seconds, defaults to None
+        :type latency: float, optional
+        """
+        self.record(working, latency)
+        self.checked_at = time.time()
         self.verified = True
-        if await check_proxy_health(self, test_url, timeout):
-            self.working = True
+        self.working = working
 
-        else:
-            self.working = False
+    def _copy_health(self, other: "BaseProxy") -> None:
+        """copies the health check results of another proxy (with the same ip and port).
 
-        return self.working
+        :param other: the checked proxy
+        :type other: BaseProxy
+        """
+        for name in HEALTH_FIELDS:
+            setattr(self, name, getattr(other, name))
 
     def __str__(self) -> str:
         return f"{self.ip}:{self.port}"
@@ -96,9 +295,62 @@ class BaseProxy:
     def __repr__(self) -> str:
         return f"<Proxy {self.ip}:{self.port}>"
 
+    def merge(self, other: "BaseProxy") -> bool:
+        """merges the information of the same proxy (same ip and port) listed by another provider into this one.
+        https and google are or-ed, the newest last_checked and the newest health check result are kept,
+        missing fields are filled from the other proxy. the type is kept, it's derived from https when the proxy is created.
+
+        :param other: the same proxy from another provider
+        :type other: BaseProxy
+        :return: True if any field of this proxy changed
+        :rtype: bool
+        """
+        changed = False
+        for name in ("google", "https"):
+            value, other_value = getattr(self, name), getattr(other, name)
+            if other_value is not None and not value and other_value != value:
+                setattr(self, name, other_value)
+                changed = True
+
+        for name in ("country_code", "country", "anonymity"):
+            if not getattr(self, name) and getattr(other, name):
+                setattr(self, name, getattr(other, name))
+                changed = True
+
+        if other.last_checked is not None and (
+            self.last_checked is None or other.last_checked > self.last_checked
+        ):
+            self.last_checked = other.last_checked
+            changed = True
+
+        if other.checked_at is not None and (
+            self.checked_at is None or other.checked_at > self.checked_at
+        ):
+            self._copy_health(other)
+            changed = True
+
+        if other.extra:
+            extra = dict(self.extra or {})
+            for name, value in other.extra.items():
+                extra.setdefault(name, value)
+
+            if len(extra) != len(self.extra or {}):
+                # assigned at once, ColumnProxy stores a copy.
+                self.extra = extra
+                changed = True
+
+        return changed
+
     def __eq__(self, other) -> bool:
+        if not isinstance(other, BaseProxy):
+            return NotImplemented
+
         return self.ip == other.ip and self.port == other.port
 
+    def __hash__(self) -> int:
+        # same fields as __eq__, so the same proxy from different providers is one set/dict member.
+        return hash((self.ip, self.port))
+
 
 class Proxy(BaseProxy):
     """
@@ -107,5 +359,7 @@ class Proxy(BaseProxy):
     it's most likely that you won't use this class directly if you use the default providers.
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -1,58 +1,556 @@
 """
 contains the class used to query fetched proxies
 """
-import asyncio
+import hashlib
+import heapq
+import math
 import random
-from datetime import datetime
-from typing import Callable, List, Optional, Union
+import struct
+import time
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import attrgetter
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-from proxy_random.proxy import Proxy
+from aiohttp import ClientSession
+
+from proxy_random.config import DEFAULT_SHARD_SIZE
+from proxy_random.health import HealthCache, HealthChecker
+from proxy_random.proxy import BaseProxy, Proxy
+from proxy_random.sessions import session_cache
+from proxy_random.shard import iter_sharded
+from proxy_random.utils import run_sync, sync_loop
+
+# steps of a lazy query plan.
+FILTER = "filter"  # (FILTER, conditions, custom filters)
+ORDER = "order"  # (ORDER, attribute, reverse)
+REVERSE = "reverse"  # (REVERSE,)
+LIMIT = "limit"  # (LIMIT, limit)
+
+# numeric attributes with a sorted index, used by the range filters and order_by().
+# unknown (None) values are ordered first.
+SORTED_ATTRIBUTES = ("last_checked",)
+
+# strategies of ProxyQuery.random()
+UNIFORM = "uniform"
+WEIGHTED = "weighted"
+POWER_OF_TWO = "power_of_two"
+STRATEGIES = (UNIFORM, WEIGHTED, POWER_OF_TWO)
+# random picks before random() filters out the proxies with an open circuit.
+SELECTION_ATTEMPTS = 8
+# the weights of random("weighted") are rebuilt after (length / STALE_SCORES_DIVISOR) scores changed,
+# so the weights of a large query stay O(1) per recorded result.
+STALE_SCORES_DIVISOR = 100
+
+# points of each proxy on the hash ring of for_key(), all of them come from one 64 bytes blake2b digest.
+RING_REPLICAS = 8
+
+
+class Range:
+    """a range condition of a filter, matches `low <= value <= high` (a missing bound is unbounded).
+    unknown (None) values never match.
+    """
+
+    __slots__ = ("low", "high")
+
+    def __init__(self, low: float = None, high: float = None) -> None:
+        self.low = low
+        self.high = high
+
+    def __contains__(self, value: Optional[float]) -> bool:
+        return (
+            value is not None
+            and (self.low is None or value >= self.low)
+            and (self.high is None or value <= self.high)
+        )
+
+    def __repr__(self) -> str:
+        return f"<Range {self.low} - {self.high}>"
+
+
+def _order_key(attribute: str) -> Callable[[Proxy], Any]:
+    """the sort key of order_by(), the unknown values of SORTED_ATTRIBUTES come first."""
+    if attribute in SORTED_ATTRIBUTES:
+        get = attrgetter(attribute)
+
+        def key(proxy: Proxy) -> Tuple[bool, Any]:
+            value = get(proxy)
+            return (False, 0) if value is None else (True, value)
+
+        return key
+
+    return attrgetter(attribute)
+
+
+def _ring_points(proxy: Proxy) -> Tuple[int, ...]:
+    """positions of the proxy on the hash ring, stable between processes (unlike hash())."""
+    digest = hashlib.blake2b(f"{proxy.ip}:{proxy.port}".encode(), digest_size=8 * RING_REPLICAS)
+    return struct.unpack(f">{RING_REPLICAS}Q", digest.digest())
+
+
+def _key_hash(key: Union[str, bytes]) -> int:
+    """position of a key on the hash ring."""
+    if isinstance(key, str):
+        key = key.encode()
+
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+def _score_key(proxy: Proxy) -> float:
+    """score of the proxy for comparisons, proxies without a score are the worst."""
+    score = proxy.score
+    return math.inf if score is None else score
 
 
 class ProxyQuery:
-    """ProxyQuery class used to work with fetched proxies."""
+    """ProxyQuery class used to work with fetched proxies.
+    filter(), order_by(), desc() and limit() are lazy, nothing is computed until the proxies are used
+    (iteration, len(), random(), first(), ...). pending plans run before their source is changed in place
+    (+=, a refresh) or health checked by its own methods (check_health(), iter_healthy(), check_health_sharded()),
+    so those see the proxies of the time they were called. other changes of the proxies (setting an attribute,
+    a check of another query, a ProxyPool) are seen by a plan which hasn't run yet, use len() or list() to run it.
+    """
+
+    # results of the health checks by ip:port, shared by all the queries (replace it to use different ttls).
+    health_cache: HealthCache = HealthCache()
 
     def __init__(self, proxy_list: List[Proxy]) -> None:
         """
         :param proxy_list: list of proxies
         :type proxy_list: list[Proxy]
         """
-        self._proxy_list: List[Proxy] = proxy_list
+        self._proxies: Optional[List[Proxy]] = proxy_list
         self.created_at = datetime.now()
 
-    async def _check_health(self, test_url=None, timeout=None) -> "ProxyQuery":
-        """the internal method used to check health of proxies
-        don't use this method directly, instead use ProxyQuery.check_health().
+        # filter(), order_by(), desc() and limit() don't touch the proxies, they return a query
+        # with a plan (steps applied on the proxies of `_source`) which runs the first time the proxies are needed.
+        self._source: Optional[ProxyQuery] = None
+        self._steps: List[tuple] = []
+        # the queries with a plan on this query, they're evaluated before this query is changed in place
+        # (+=, refresh) or health checked, so they see the proxies of the time they were created, like an eager filter.
+        self._plans: Optional[weakref.WeakSet] = None
+
+        # the checker used in the last health check, contains the throughput stats.
+        self.health_checker: Optional[HealthChecker] = None
+
+        # attribute -> value -> positions of the proxies in _proxy_list.
+        self._indexes: Dict[str, Dict[Any, Set[int]]] = {}
+        # attribute -> (sorted known values, positions in that order after the unknown ones, number of unknown values).
+        self._sorted_indexes: Dict[str, Tuple[List[Any], List[int], int]] = {}
+        # attribute -> BaseProxy.versions[attribute] when its indexes were built.
+        self._index_versions: Dict[str, int] = {}
+        # (ip, port) -> position of the first proxy with that address, used to merge duplicates.
+        self._keys: Optional[Dict[Tuple[str, int], int]] = None
+        # ((score version, length), probabilities, aliases) used by random("weighted").
+        self._alias: Optional[Tuple[Tuple[int, int], List[float], List[int]]] = None
+        # (length, sorted points, position of the proxy of each point) used by for_key().
+        self._ring: Optional[Tuple[int, array, array]] = None
+
+    @property
+    def _proxy_list(self) -> List[Proxy]:
+        """the proxies of the query, runs the plan if the query is not evaluated yet."""
+        if self._source is not None:
+            self._proxies = self._run_plan()
+            self._source = None
+            self._steps = []
+
+        return self._proxies
+
+    @_proxy_list.setter
+    def _proxy_list(self, proxy_list: List[Proxy]) -> None:
+        self._proxies = proxy_list
+        self._source = None
+        self._steps = []
+
+    def _chain(self, step: tuple) -> "ProxyQuery":
+        """the internal method used to add a step to the plan, returns a new (not evaluated) ProxyQuery.
+        consecutive filters are merged into one step and desc() right after order_by() becomes a reverse sort.
+
+        :param step: the step to add
+        :type step: tuple
+        :return: a new ProxyQuery
+        :rtype: ProxyQuery
+        """
+        if self._source is None:
+            source, steps = self, []
+
+        else:
+            source, steps = self._source, self._steps[::]
+
+        last = steps[-1] if steps else None
+        if step[0] == FILTER and last is not None and last[0] == FILTER:
+            steps[-1] = (FILTER, last[1] + step[1], last[2] + step[2])
+
+        elif step[0] == REVERSE and last is not None and last[0] == ORDER:
+            steps[-1] = (ORDER, last[1], not last[2])
+
+        elif step[0] == REVERSE and last is not None and last[0] == REVERSE:
+            steps.pop()
+
+        elif (
+            step[0] == LIMIT
+            and last is not None
+            and last[0] == LIMIT
+            and min(step[1], last[1]) >= 0
+        ):
+            steps[-1] = (LIMIT, min(last[1], step[1]))
+
+        else:
+            steps.append(step)
+
+        query = ProxyQuery(None)
+        query._source = source
+        query._steps = steps
+        if source._plans is None:
+            source._plans = weakref.WeakSet()
+
+        source._plans.add(query)
+        return query
+
+    def _run_pending_plans(self) -> None:
+        """the internal method used to evaluate the queries with a plan on this query, called before it's changed in place."""
+        if not self._plans:
+            return
+
+        plans, self._plans = list(self._plans), None
+        for query in plans:
+            if query._source is self:
+                # runs the plan.
+                query._proxy_list
+
+    def _run_plans_before_check(self) -> None:
+        """the internal method used to evaluate the pending plans which see the health written by a check of this query,
+        the plans on this query and on its source (this query is one of them if it's not evaluated yet).
+        """
+        if self._source is not None:
+            self._source._run_pending_plans()
+
+        self._run_pending_plans()
+
+    def _run_plan(self) -> List[Proxy]:
+        """the internal method used to run the plan of the query.
+
+        :return: the resulting proxies
+        :rtype: list[Proxy]
+        """
+        proxies = self._source._proxy_list
+        steps = self._steps
+        i = 0
+        while i < len(steps):
+            step = steps[i]
+            if step[0] == FILTER:
+                _, conditions, filters = step
+                if i == 0 and conditions:
+                    # the source is evaluated so its indexes can be used.
+                    proxies = self._source._lookup(conditions)
+
+                elif conditions:
+                    proxies = [
+                        proxy
+                        for proxy in proxies
+                        if all(
+                            getattr(proxy, name, None) in values
+                            for name, values in conditions
+                        )
+                    ]
+
+                for f in filters:
+                    proxies = filter(f, proxies)
+
+                proxies = list(proxies)
+
+            elif step[0] == ORDER:
+                _, attribute, reverse = step
+                key = _order_key(attribute)
+                # sorted(x)[::-1] is the same as a reverse sort of reversed(x) (ties included).
+                ordered = reversed(proxies) if reverse else proxies
+                following = steps[i + 1] if i + 1 < len(steps) else None
+                limit = None
+                if following is not None and following[0] == LIMIT and following[1] >= 0:
+                    limit = following[1]
+
+                if i == 0 and attribute in SORTED_ATTRIBUTES:
+                    # the source is evaluated, the first `limit` positions of its sorted index are the result.
+                    _, positions, _ = self._source._sorted_index(attribute)
+                    if reverse:
+                        positions = reversed(positions)
+
+                    proxies = [proxies[j] for j in islice(positions, limit)]
+                    if limit is not None:
+                        i += 1
+
+                elif limit is not None and limit < len(proxies):
+                    # top-k with a heap instead of sorting everything.
+                    if reverse:
+                        proxies = heapq.nlargest(limit, ordered, key=key)
+
+                    else:
+                        proxies = heapq.nsmallest(limit, ordered, key=key)
+
+                    i += 1
+
+                else:
+                    proxies = sorted(ordered, key=key, reverse=reverse)
+
+            elif step[0] == REVERSE:
+                proxies = proxies[::-1]
+
+            elif step[0] == LIMIT:
+                proxies = proxies[: step[1]]
+
+            i += 1
+
+        if proxies is self._source._proxy_list:
+            proxies = proxies[::]
+
+        return proxies
+
+    async def acheck_health(
+        self, test_url=None, timeout=None, concurrency=None, force=False, stages=None
+    ) -> "ProxyQuery":
+        """Check health of proxies, the async version of check_health().
+        usage: `await query.acheck_health()`
 
         :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
         :type test_url: str, optional
         :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
         :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time, defaults to None
+        :type concurrency: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
         :return: The proxy query with updated proxies
         :rtype: ProxyQuery
         """
-        tasks = []
-        for proxy in self._proxy_list:
-            tasks.append(asyncio.ensure_future(proxy._check_health(test_url, timeout)))
-        await asyncio.gather(*tasks)
+        self._run_plans_before_check()
+        self.health_cache.prune()
+        self.health_checker = HealthChecker(
+            test_url, timeout, concurrency, self.health_cache, force, stages
+        )
+        async with self.health_checker as checker:
+            await checker.check_all(self._proxy_list)
+
         return self
 
-    def check_health(self, test_url=None, timeout=None) -> "ProxyQuery":
+    def check_health(
+        self, test_url=None, timeout=None, concurrency=None, force=False, stages=None
+    ) -> "ProxyQuery":
         """Check health of proxies.
 
         :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
         :type test_url: str, optional
         :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
         :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time (throughput is available in `health_checker` after the check), defaults to None
+        :type concurrency: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
+        :raises RuntimeError: raises RuntimeError if it's called inside a running event loop, use acheck_health() there
         :return: The proxy query with updated proxies
         :rtype: ProxyQuery
         """
-        asyncio.get_event_loop().run_until_complete(
-            self._check_health(test_url, timeout)
+        return run_sync(
+            self.acheck_health(test_url, timeout, concurrency, force, stages),
+            "await ProxyQuery.acheck_health()",
+        )
+
+    async def iter_healthy(
+        self,
+        test_url=None,
+        timeout=None,
+        concurrency=None,
+        limit=None,
+        force=False,
+        stages=None,
+    ) -> AsyncIterator[Proxy]:
+        """checks health of proxies and yields the working ones as soon as they pass.
+        usage: `async for proxy in query.iter_healthy(limit=20): ...`
+
+        :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time, defaults to None
+        :type concurrency: int, optional
+        :param limit: stop (and cancel the remaining checks) after this many working proxies are found, defaults to None
+        :type limit: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
+        :yield: working proxies
+        :rtype: AsyncIterator[Proxy]
+        """
+        self._run_plans_before_check()
+        self.health_checker = HealthChecker(
+            test_url, timeout, concurrency, self.health_cache, force, stages
+        )
+        async with self.health_checker as checker:
+            async for proxy in checker.iter_healthy(self._proxy_list, limit):
+                yield proxy
+
+    def iter_healthy_sync(
+        self,
+        test_url=None,
+        timeout=None,
+        concurrency=None,
+        limit=None,
+        force=False,
+        stages=None,
+    ) -> Iterator[Proxy]:
+        """the synchronous version of iter_healthy.
+        the checks are paused while the caller is working with a yielded proxy.
+
+        :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time, defaults to None
+        :type concurrency: int, optional
+        :param limit: stop (and cancel the remaining checks) after this many working proxies are found, defaults to None
+        :type limit: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
+        :raises RuntimeError: raises RuntimeError if it's called inside a running event loop, use iter_healthy() there
+        :yield: working proxies
+        :rtype: Iterator[Proxy]
+        """
+        loop = sync_loop("async for ... in ProxyQuery.iter_healthy()")
+        proxies = self.iter_healthy(
+            test_url, timeout, concurrency, limit, force, stages
         )
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(proxies.__anext__())
+
+                except StopAsyncIteration:
+                    return
+
+        finally:
+            try:
+                loop.run_until_complete(proxies.aclose())
+
+            finally:
+                # like run_sync(), nothing closes the cached sessions of the checks later.
+                loop.run_until_complete(session_cache.close())
+
+    async def acheck_health_sharded(
+        self,
+        processes=None,
+        test_url=None,
+        timeout=None,
+        concurrency=None,
+        stages=None,
+        checkpoint=None,
+        shard_size=DEFAULT_SHARD_SIZE,
+        force=False,
+    ) -> "ProxyQuery":
+        """checks health of proxies in several worker processes, for lists too large for one event loop (see iter_sharded).
+        the results are copied into the proxies of the query as each shard finishes.
+        usage: `await query.acheck_health_sharded(processes=8, checkpoint="checks.jsonl")`
+
+        :param processes: number of worker processes, defaults to the number of cpus
+        :type processes: int, optional
+        :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time in each process, defaults to None
+        :type concurrency: int, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
+        :param checkpoint: path of a file the finished shards are stored in, an interrupted run started again
+            with the same file only checks the remaining proxies, defaults to None
+        :type checkpoint: str, optional
+        :param shard_size: number of proxies sent to a worker process at once, defaults to DEFAULT_SHARD_SIZE
+        :type shard_size: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :return: The proxy query with updated proxies
+        :rtype: ProxyQuery
+        """
+        self._run_plans_before_check()
+        self.health_cache.prune()
+        async for _ in iter_sharded(
+            self._proxy_list,
+            processes,
+            test_url,
+            timeout,
+            concurrency,
+            stages,
+            shard_size,
+            checkpoint,
+            self.health_cache,
+            force,
+        ):
+            pass
+
         return self
 
-    def filter(  # TODO: change how this method works.
+    def check_health_sharded(
+        self,
+        processes=None,
+        test_url=None,
+        timeout=None,
+        concurrency=None,
+        stages=None,
+        checkpoint=None,
+        shard_size=DEFAULT_SHARD_SIZE,
+        force=False,
+    ) -> "ProxyQuery":
+        """the synchronous version of acheck_health_sharded.
+
+        :param processes: number of worker processes, defaults to the number of cpus
+        :type processes: int, optional
+        :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+        :type test_url: str, optional
+        :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+        :type timeout: int, optional
+        :param concurrency: maximum number of checks running at the same time in each process, defaults to None
+        :type concurrency: int, optional
+        :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
+        :param checkpoint: path of a file the finished shards are stored in, an interrupted run started again
+            with the same file only checks the remaining proxies, defaults to None
+        :type checkpoint: str, optional
+        :param shard_size: number of proxies sent to a worker process at once, defaults to DEFAULT_SHARD_SIZE
+        :type shard_size: int, optional
+        :param force: whether to check the proxies which have a fresh result in `health_cache` too, defaults to False
+        :type force: bool, optional
+        :raises RuntimeError: raises RuntimeError if it's called inside a running event loop, use acheck_health_sharded() there
+        :return: The proxy query with updated proxies
+        :rtype: ProxyQuery
+        """
+        return run_sync(
+            self.acheck_health_sharded(
+                processes, test_url, timeout, concurrency, stages, checkpoint, shard_size, force
+            ),
+            "await ProxyQuery.acheck_health_sharded()",
+        )
+
+    def filter(
         self,
         ip: Optional[str] = None,  # kinda useless
         port: Optional[Union[int, List[int]]] = None,
@@ -63,10 +561,9 @@ class ProxyQuery:
         https: Optional[bool] = None,
         verified: Optional[bool] = None,
         working: Optional[bool] = None,
-        last_checked: Optional[
-            Union[str, List[str]]
-        ] = None,  # kinda dumb 'cause it's not parsed yet.
+        last_checked: Optional[Union[float, List[float]]] = None,
         custom_filters: Union[Callable, List[Callable]] = None,
+        fresher_than: Optional[Union[timedelta, float]] = None,
     ) -> "ProxyQuery":
         """method used to filter the proxies.
 
@@ -86,77 +583,51 @@ class ProxyQuery:
         :type verified: bool, optional
         :param working: filter based on it's working or not(proxies should be verified use check_health before filtering based on this field), defaults to None
         :type working: bool, optional
-        :param last_checked: filter based on last checked time (don't use), defaults to None
-        :type last_checked: Union[ str, list[str] ], optional
+        :param last_checked: filter based on the exact last checked timestamp (use fresher_than instead), defaults to None
+        :type last_checked: Union[ float, list[float] ], optional
+        :param fresher_than: only the proxies which the provider checked within this time (seconds or timedelta) from now, uses a sorted index, defaults to None
+        :type fresher_than: Union[timedelta, float], optional
         :return: returns a new ProxyQuery with filtered proxies
         :rtype: ProxyQuery
         """
-        filters: List[Callable] = []
+        conditions: List[Tuple[str, List[Any]]] = []
         if ip is not None:
-            filters.append(lambda x: x.ip == ip)
+            conditions.append(("ip", [ip]))
 
         if port is not None:
-            if isinstance(port, int):
-                filters.append(lambda x: x.port == port)
-
-            elif isinstance(port, list):
-                filters.append(lambda x: x.port in port)
-
-            else:
-                raise TypeError(f"port must be int or list[int]")
+            conditions.append(("port", self._values("port", port, int)))
 
         if country_code is not None:
-            if isinstance(country_code, str):
-                filters.append(lambda x: x.country_code == country_code)
-
-            elif isinstance(country_code, list):
-                filters.append(lambda x: x.country_code in country_code)
-
-            else:
-                raise TypeError(f"country_code must be str or list[str]")
+            conditions.append(("country_code", self._values("country_code", country_code, str)))
 
         if country is not None:
-            if isinstance(country, str):
-                filters.append(lambda x: x.country == country)
-
-            elif isinstance(country, list):
-                filters.append(lambda x: x.country in country)
-
-            else:
-                raise TypeError(f"country must be str or list[str]")
+            conditions.append(("country", self._values("country", country, str)))
 
         if anonymity is not None:
-            if isinstance(anonymity, str):
-                filters.append(lambda x: x.anonymity == anonymity)
-
-            elif isinstance(anonymity, list):
-                filters.append(lambda x: x.anonymity in anonymity)
-
-            else:
-                raise TypeError(f"anonymity must be str or list[str]")
+            conditions.append(("anonymity", self._values("anonymity", anonymity, str)))
 
         if google is not None:
-            filters.append(lambda x: x.google == google)
+            conditions.append(("google", [google]))
 
         if https is not None:
-            filters.append(lambda x: x.https == https)
+            conditions.append(("https", [https]))
 
         if verified is not None:
-            filters.append(lambda x: x.verified == verified)
+            conditions.append(("verified", [verified]))
 
         if working is not None:
-            filters.append(lambda x: x.working == working)
+            conditions.append(("working", [working]))
 
         if last_checked is not None:
-            if isinstance(last_checked, str):
-                filters.append(lambda x: x.last_checked == last_checked)
+            conditions.append(("last_checked", self._values("last_checked", last_checked, (int, float))))
 
-            elif isinstance(last_checked, list):
-                filters.append(lambda x: x.last_checked in last_checked)
+        if fresher_than is not None:
+            if isinstance(fresher_than, timedelta):
+                fresher_than = fresher_than.total_seconds()
 
-            else:
-                raise TypeError(f"last_checked must be str or list[str]")
+            conditions.append(("last_checked", Range(low=time.time() - fresher_than)))
 
+        filters: List[Callable] = []
         if custom_filters is not None:
             if isinstance(custom_filters, Callable):
                 filters.append(custom_filters)
@@ -164,7 +635,140 @@ class ProxyQuery:
             elif isinstance(custom_filters, list):
                 filters.extend(custom_filters)
 
-        return self._filter(filters)
+        return self._chain((FILTER, conditions, filters))
+
+    @staticmethod
+    def _values(name: str, value: Any, kind: type) -> List[Any]:
+        """the internal method used to turn a filter argument to the list of accepted values.
+
+        :raises TypeError: raises TypeError if the value is not `kind` or list of `kind`
+        """
+        if isinstance(value, kind):
+            return [value]
+
+        if isinstance(value, list):
+            return value
+
+        kind_name = kind.__name__ if isinstance(kind, type) else kind[-1].__name__
+        raise TypeError(f"{name} must be {kind_name} or list[{kind_name}]")
+
+    def _index(self, attribute: str) -> Dict[Any, Set[int]]:
+        """the internal method used to get the index of an attribute, builds it if it doesn't exist.
+
+        :param attribute: the attribute name
+        :type attribute: str
+        :return: a mapping from the values to the positions of the proxies with that value
+        :rtype: dict[Any, set[int]]
+        """
+        self._drop_stale_indexes()
+        index = self._indexes.get(attribute)
+        if index is None:
+            index = {}
+            self._index_proxies(index, attribute, 0, self._proxy_list)
+            self._indexes[attribute] = index
+            self._set_index_version(attribute)
+
+        return index
+
+    def _sorted_index(self, attribute: str) -> Tuple[List[Any], List[int], int]:
+        """the internal method used to get the sorted index of one of SORTED_ATTRIBUTES, builds it if it doesn't exist.
+
+        :param attribute: the attribute name
+        :type attribute: str
+        :return: the sorted known values, the positions of the proxies in order (unknown values first) and the number of unknown values
+        :rtype: tuple[list[Any], list[int], int]
+        """
+        self._drop_stale_indexes()
+        index = self._sorted_indexes.get(attribute)
+        if index is None:
+            values = [getattr(proxy, attribute) for proxy in self._proxy_list]
+            unknown = [i for i, value in enumerate(values) if value is None]
+            known = sorted(
+                (i for i, value in enumerate(values) if value is not None),
+                key=values.__getitem__,
+            )
+            index = ([values[i] for i in known], unknown + known, len(unknown))
+            self._sorted_indexes[attribute] = index
+            self._set_index_version(attribute)
+
+        return index
+
+    def _range(self, attribute: str, condition: Range) -> List[int]:
+        """the internal method used to find the positions of the proxies in a range with binary search, O(log n + matches)."""
+        values, positions, unknown = self._sorted_index(attribute)
+        low = 0 if condition.low is None else bisect_left(values, condition.low)
+        high = len(values) if condition.high is None else bisect_right(values, condition.high)
+        return positions[unknown + low : unknown + high]
+
+    def _drop_stale_indexes(self) -> None:
+        """the internal method used to drop the indexes of the attributes which are set on any proxy since they were built."""
+        versions = BaseProxy.versions
+        for attribute, version in list(self._index_versions.items()):
+            if versions[attribute] != version:
+                self._indexes.pop(attribute, None)
+                self._sorted_indexes.pop(attribute, None)
+                del self._index_versions[attribute]
+
+    def _set_index_version(self, attribute: str) -> None:
+        """the internal method used to remember the version of an attribute whose index is built,
+        attributes which aren't in INDEXED_FIELDS (custom fields) are never stale.
+        """
+        version = BaseProxy.versions.get(attribute)
+        if version is not None:
+            self._index_versions[attribute] = version
+
+    @staticmethod
+    def _index_proxies(
+        index: Dict[Any, Set[int]], attribute: str, start: int, proxies: List[Proxy]
+    ) -> None:
+        """the internal method used to add proxies to an index, `start` is the position of the first proxy."""
+        for i, proxy in enumerate(proxies, start):
+            value = getattr(proxy, attribute, None)
+            positions = index.get(value)
+            if positions is None:
+                index[value] = {i}
+
+            else:
+                positions.add(i)
+
+    def _lookup(self, conditions: List[Tuple[str, List[Any]]]) -> List[Proxy]:
+        """the internal method used to filter the proxies using the indexes.
+        don't use this method directly.
+
+        :param conditions: pairs of attribute name and the accepted values
+        :type conditions: list[tuple[str, list[Any]]]
+        :return: returns the matching proxies in their original order
+        :rtype: list[Proxy]
+        """
+        matches: List[Set[int]] = []
+        for attribute, values in conditions:
+            if isinstance(values, Range):
+                positions = set(self._range(attribute, values))
+
+            elif len(values) == 1:
+                index = self._index(attribute)
+                positions = index.get(values[0], set())
+
+            else:
+                index = self._index(attribute)
+                positions = set()
+                for value in values:
+                    positions = positions.union(index.get(value, ()))
+
+            if not positions:
+                return []
+
+            matches.append(positions)
+
+        # intersecting from the smallest set keeps it O(smallest match).
+        matches.sort(key=len)
+        result = matches[0]
+        for positions in matches[1:]:
+            result = result & positions
+            if not result:
+                return []
+
+        return [self._proxy_list[i] for i in sorted(result)]
 
     def _filter(self, filters: List[Callable]) -> "ProxyQuery":
         """the internal method used to filter the proxies based on the given filters.
@@ -175,11 +779,7 @@ class ProxyQuery:
         :return: returns a new ProxyQuery with filtered proxies
         :rtype: ProxyQuery
         """
-        proxy_list = self._proxy_list[::]
-        for f in filters:
-            proxy_list = filter(f, proxy_list)
-
-        return ProxyQuery(list(proxy_list))
+        return self._chain((FILTER, [], filters))
 
     def order_by(self, attribute: str) -> "ProxyQuery":
         """order the proxies by the given attribute in ascending order.
@@ -191,14 +791,16 @@ class ProxyQuery:
         :return: returns a new ProxyQuery with proxies in ordered
         :rtype: ProxyQuery
         """
+        # the proxies are not evaluated yet, so the attribute is checked on the source proxies.
+        source = self if self._source is None else self._source
         try:
-            if not hasattr(self._proxy_list[0], attribute):
+            if not hasattr(source._proxy_list[0], attribute):
                 raise AttributeError(f"Proxy has no attribute {attribute}")
 
         except IndexError:
             return ProxyQuery([])
 
-        return ProxyQuery(sorted(self._proxy_list, key=lambda x: getattr(x, attribute)))
+        return self._chain((ORDER, attribute, False))
 
     def asc(self) -> "ProxyQuery":
         """use after order_by() to order in descending order.
@@ -217,20 +819,175 @@ class ProxyQuery:
         :return: returns a new ProxyQuery with the proxies in reversed order
         :rtype: ProxyQuery
         """
-        return ProxyQuery(self._proxy_list[::-1])
+        return self._chain((REVERSE,))
 
-    def random(self) -> Proxy:
+    def random(self, strategy: str = UNIFORM) -> Proxy:
         """returns a random proxy from the ProxyQuery.
 
+        proxies whose circuit is open in `health_cache` (they failed too many times in a row) are not selected.
+
+        strategies:
+            - "uniform": every proxy has the same chance.
+            - "weighted": proxies are chosen with probability proportional to 1 / score (fast and reliable
+              proxies are chosen more), proxies without a score get the average weight.
+            - "power_of_two": two proxies are chosen uniformly and the one with the better score is returned.
+
+        :param strategy: the selection strategy, defaults to "uniform"
+        :type strategy: str, optional
+        :raises ValueError: raises ValueError if the strategy is unknown
         :return: a random proxy
         :rtype: Proxy
         """
+        if strategy not in STRATEGIES:
+            raise ValueError(
+                f"strategy must be one of {', '.join(STRATEGIES)}, not {strategy!r}"
+            )
 
         if self._proxy_list is None or len(self._proxy_list) == 0:
             return None
 
+        # a few tries before filtering out the proxies with an open circuit, they are rare.
+        for _ in range(SELECTION_ATTEMPTS):
+            proxy = self._choose(strategy)
+            if not self.health_cache.is_open(proxy):
+                return proxy
+
+        available = [
+            proxy for proxy in self._proxy_list if not self.health_cache.is_open(proxy)
+        ]
+        if not available:
+            return None
+
+        return ProxyQuery(available)._choose(strategy)
+
+    def _choose(self, strategy: str) -> Proxy:
+        """the internal method used to choose a random proxy with the given strategy, the query must not be empty."""
+        if strategy == WEIGHTED:
+            probabilities, aliases = self._alias_table()
+            i = random.randrange(len(probabilities))
+            if random.random() >= probabilities[i]:
+                i = aliases[i]
+
+            return self._proxy_list[i]
+
+        if strategy == POWER_OF_TWO:
+            first = random.choice(self._proxy_list)
+            second = random.choice(self._proxy_list)
+            return second if _score_key(second) < _score_key(first) else first
+
         return random.choice(self._proxy_list)
 
+    def _alias_table(self) -> Tuple[List[float], List[int]]:
+        """the internal method which returns the alias table (Vose's method) of the weights used by random("weighted"),
+        so a weighted choice is O(1). the table is rebuilt when the proxies change or enough scores changed noticeably
+        (see BaseProxy.score_version), at most 1 / STALE_SCORES_DIVISOR of the weights are stale.
+
+        :return: probability and alias of each position
+        :rtype: tuple[list[float], list[int]]
+        """
+        proxy_list = self._proxy_list
+        key = (BaseProxy.score_version, len(proxy_list))
+        if self._alias is not None:
+            (score_version, length), probabilities, aliases = self._alias
+            if length == key[1] and key[0] - score_version < max(
+                length // STALE_SCORES_DIVISOR, 1
+            ):
+                return probabilities, aliases
+
+        scores = [proxy.score for proxy in proxy_list]
+        known = [1 / score for score in scores if score]
+        default = sum(known) / len(known) if known else 1.0
+        weights = [1 / score if score else default for score in scores]
+
+        n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+        probabilities = [1.0] * n
+        aliases = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+
+            else:
+                large.append(more)
+
+        self._alias = (key, probabilities, aliases)
+        return probabilities, aliases
+
+    def for_key(self, key: Union[str, bytes]) -> Optional[Proxy]:
+        """returns the proxy of a key (e.g. a domain or a session id), the same key gets the same proxy while it works,
+        so sites which tie sessions to an ip see one ip.
+
+        the proxies are placed on a consistent hash ring, a key is served by the first usable proxy after it.
+        when a proxy fails (it's verified and not working, or its circuit is open in `health_cache`) only its keys
+        move to the next proxies, and adding or removing proxies only moves the keys of those proxies.
+        a lookup is O(log n), the ring is built the first time after the proxies change.
+
+        :param key: the key
+        :type key: Union[str, bytes]
+        :return: the proxy of the key, None if no proxy is usable
+        :rtype: Optional[Proxy]
+        """
+        proxy_list = self._proxy_list
+        if proxy_list is None or len(proxy_list) == 0:
+            return None
+
+        points, owners = self._hash_ring()
+        start = bisect_right(points, _key_hash(key))
+        size = len(points)
+        for step in range(size):
+            proxy = proxy_list[owners[(start + step) % size]]
+            if (proxy.working or not proxy.verified) and not self.health_cache.is_open(proxy):
+                return proxy
+
+        return None
+
+    def session_for(
+        self, key: Union[str, bytes] = None, strategy: str = UNIFORM
+    ) -> Tuple[Optional[Proxy], Optional[ClientSession]]:
+        """chooses a proxy and returns it with its keep-alive session (see Proxy.session()).
+
+        :param key: if provided the proxy of the key is used (see for_key()), otherwise a random one, defaults to None
+        :type key: Union[str, bytes], optional
+        :param strategy: the strategy of random(), defaults to "uniform"
+        :type strategy: str, optional
+        :return: the proxy and its session, (None, None) if there is no usable proxy
+        :rtype: tuple[Optional[Proxy], Optional[ClientSession]]
+        """
+        proxy = self.for_key(key) if key is not None else self.random(strategy)
+        if proxy is None:
+            return None, None
+
+        return proxy, session_cache.get(proxy)
+
+    def _hash_ring(self) -> Tuple[array, array]:
+        """the internal method which returns the hash ring used by for_key(), rebuilt when the proxies change.
+
+        :return: the sorted points and the position of the proxy of each point
+        :rtype: tuple[array, array]
+        """
+        proxy_list = self._proxy_list
+        if self._ring is not None and self._ring[0] == len(proxy_list):
+            return self._ring[1], self._ring[2]
+
+        points = []
+        for proxy in proxy_list:
+            points.extend(_ring_points(proxy))
+
+        order = sorted(range(len(points)), key=points.__getitem__)
+        sorted_points = array("Q", (points[i] for i in order))
+        owners = array("I", (i // RING_REPLICAS for i in order))
+
+        self._ring = (len(proxy_list), sorted_points, owners)
+        return sorted_points, owners
+
     def first(self) -> Union[Proxy, None]:
         """returns the first proxy from the ProxyQuery.
 
@@ -262,23 +1019,132 @@ class ProxyQuery:
         :return: the first `limit` proxies
         :rtype: ProxyQuery
         """
-        return ProxyQuery(self._proxy_list[:limit])
+        return self._chain((LIMIT, limit))
 
-    def union(self, other: "ProxyQuery") -> "ProxyQuery":
+    def union(self, other: "ProxyQuery", dedup: bool = False) -> "ProxyQuery":
         """returns a new ProxyQuery with the union of the proxies in the ProxyQuery and the other ProxyQuery.
 
         :param other: the other ProxyQuery
         :type other: ProxyQuery
+        :param dedup: whether to merge the proxies of the other ProxyQuery which are already in this one (same ip and port)
+            into the existing proxies (see Proxy.merge) instead of adding them again, defaults to False
+        :type dedup: bool, optional
         :return: the union of the proxies in the ProxyQuery and the other ProxyQuery
         :rtype: ProxyQuery
         """
-        return ProxyQuery(self._proxy_list + other._proxy_list)
+        if dedup:
+            query = ProxyQuery(self._proxy_list + type(self._proxy_list)())
+            query._merge(other)
+            return query
+
+        query = ProxyQuery(self._proxy_list + other._proxy_list)
+        # carry over the already built indexes instead of building them from scratch.
+        self._drop_stale_indexes()
+        for attribute, index in self._indexes.items():
+            index = {value: set(positions) for value, positions in index.items()}
+            self._index_proxies(index, attribute, len(self), other._proxy_list)
+            query._indexes[attribute] = index
+            if attribute in self._index_versions:
+                query._index_versions[attribute] = self._index_versions[attribute]
+
+        return query
+
+    def _key_index(self) -> Dict[Tuple[str, int], int]:
+        """the internal method used to get the position of each address, builds it if it doesn't exist."""
+        if self._keys is None:
+            self._keys = {}
+            for i, proxy in enumerate(self._proxy_list):
+                self._keys.setdefault((proxy.ip, proxy.port), i)
+
+        return self._keys
+
+    def _merge(self, other: "ProxyQuery") -> List[Proxy]:
+        """the internal method used to add the proxies of another query in place without duplicates.
+        a proxy which is already in the query (same ip and port) is merged into the existing one, O(len(other)).
+        don't use this method directly.
+
+        :param other: the proxies to add
+        :type other: ProxyQuery
+        :return: the added proxies, as stored in this query
+        :rtype: list[Proxy]
+        """
+        self._run_pending_plans()
+        keys = self._key_index()
+        proxy_list = self._proxy_list
+        start = len(proxy_list)
+        added = []
+        changed = False
+        for proxy in other._proxy_list:
+            key = (proxy.ip, proxy.port)
+            position = keys.get(key)
+            if position is None:
+                keys[key] = start + len(added)
+                added.append(proxy)
+
+            elif position < start:
+                changed = proxy_list[position].merge(proxy) or changed
+
+            else:
+                added[position - start].merge(proxy)
+
+        if changed:
+            # the merged fields of the existing proxies changed.
+            self._indexes = {}
+            self._sorted_indexes = {}
+            self._index_versions = {}
+            self._alias = None
+
+        self.__iadd__(ProxyQuery(added))
+        return self._proxy_list[start:]
+
+    def _remove(self, proxies: List[Proxy]) -> None:
+        """the internal method used to remove proxies (by ip and port) in place.
+        don't use this method directly.
+
+        :param proxies: the proxies to remove, each one removes one matching proxy
+        :type proxies: list[Proxy]
+        """
+        if not proxies:
+            return
+
+        self._run_pending_plans()
+        removed = Counter((proxy.ip, proxy.port) for proxy in proxies)
+        kept = []
+        for proxy in self._proxy_list:
+            key = (proxy.ip, proxy.port)
+            if removed[key] > 0:
+                removed[key] -= 1
+
+            else:
+                kept.append(proxy)
+
+        # same storage as before (list or ProxyColumns), positions changed so the indexes are rebuilt.
+        self._proxy_list = type(self._proxy_list)(kept)
+        self._indexes = {}
+        self._sorted_indexes = {}
+        self._index_versions = {}
+        self._keys = None
+        self._alias = None
+        self._ring = None
 
     def __add__(self, other: "ProxyQuery") -> "ProxyQuery":
         return self.union(other)
 
     def __iadd__(self, other: "ProxyQuery") -> "ProxyQuery":
+        self._run_pending_plans()
+        start = len(self._proxy_list)
         self._proxy_list += other._proxy_list
+        if self._indexes:
+            added = self._proxy_list[start:]
+            for attribute, index in self._indexes.items():
+                self._index_proxies(index, attribute, start, added)
+
+        if self._keys is not None:
+            for i, proxy in enumerate(self._proxy_list[start:], start):
+                self._keys.setdefault((proxy.ip, proxy.port), i)
+
+        # rebuilt when needed, a refresh also updates last_checked of the kept proxies.
+        self._sorted_indexes = {}
         return self
 
     def __getitem__(self, i: Union[slice, int]) -> Proxy:
@@ -5,15 +5,24 @@ contains the main class to manage providers and proxies.
 import asyncio
 import random
 import time
-from typing import List, Union
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple, Union
 
 from aiohttp import ClientSession, TCPConnector
 from aiohttp_proxy import ProxyConnector
 
+from proxy_random.cache import ProxyCache
+from proxy_random.columns import ProxyColumns
 from proxy_random.config import HTTP_PROXY_URL, HTTPS_PROXY_URL
 from proxy_random.extract import parse_response
+from proxy_random.fetch import Fetcher
+from proxy_random.health import HealthChecker, Stage
+from proxy_random.metrics import metrics
 from proxy_random.provider import Provider
+from proxy_random.proxy import Proxy
 from proxy_random.query import ProxyQuery
+from proxy_random.utils import run_sync
 
 
 class RandomProxy(object):
@@ -26,10 +35,16 @@ class RandomProxy(object):
         timeout: int = None,
         use_defaults: bool = True,
         proxy: str = None,
+        concurrency: int = None,
+        columnar: bool = False,
+        executor: Executor = None,
+        cache: ProxyCache = None,
+        dedup: bool = False,
+        stages: List[Stage] = None,
     ) -> None:
         """RandomProxy Constructor
 
-        :param verify: whether to verify the proxies right after proxies are extracted from providers (it's not recommended) filter the proxies then use ProxyQuery.check_health(), defaults to False
+        :param verify: whether to verify the proxies right after proxies are extracted from providers (the proxies of each provider are checked as soon as it is parsed, see aiter_verified()), it is usually better to filter the proxies then use ProxyQuery.check_health(), defaults to False
         :type verify: bool, optional
         :param test_url: test url used for testing proxies(don't use this if you want to use ProxyQuery.check_health() instead pass the test_url to ProxyQuery.check_health it self), defaults to None
         :type test_url: str, optional
@@ -39,10 +54,24 @@ class RandomProxy(object):
         :type use_defaults: bool, optional
         :param proxy: proxy used to fetch the providers' url(recommended if you live in a country that these websites are blocked by government or ISP), defaults to None
         :type proxy: str, optional
+        :param concurrency: maximum number of health checks running at the same time when verify is True, defaults to None
+        :type concurrency: int, optional
+        :param columnar: whether to store the proxies in ProxyColumns (compact storage for large pools), defaults to False
+        :type columnar: bool, optional
+        :param executor: thread or process pool used to run the extractors, so parsing doesn't block the event loop and overlaps with fetching the other providers, defaults to None
+        :type executor: Executor, optional
+        :param cache: on-disk cache of the proxies and their health, providers which are in the cache and not stale aren't fetched again, defaults to None
+        :type cache: ProxyCache, optional
+        :param dedup: whether to keep one proxy per ip:port in proxy_query, a proxy listed by multiple providers is merged
+            (see Proxy.merge) instead of being added again, defaults to False
+        :type dedup: bool, optional
+        :param stages: check the proxies in stages when verify is True, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+        :type stages: list[Stage], optional
         """
         random.seed(time.time())
+        self.proxy_providers: List[Provider] = []
         if use_defaults:
-            self.proxy_providers: List[Provider] = [
+            self.proxy_providers = [
                 Provider(HTTP_PROXY_URL, parse_response),
                 Provider(HTTPS_PROXY_URL, parse_response),
             ]
@@ -50,11 +79,16 @@ class RandomProxy(object):
         self.verify: bool = verify
         self.test_url: Union[str, None] = test_url
         self.timeout: Union[int, None] = timeout
+        self.concurrency: Union[int, None] = concurrency
+        self.executor: Union[Executor, None] = executor
+        self.cache: Union[ProxyCache, None] = cache
+        self.dedup: bool = dedup
+        self.stages: Union[List[Stage], None] = stages
 
         # Optional: used for fetching proxies from a specific proxy provider
         self.proxy: Union[str, None] = proxy
 
-        self.proxy_query: ProxyQuery = ProxyQuery([])
+        self.proxy_query: ProxyQuery = ProxyQuery(ProxyColumns() if columnar else [])
 
     def add_provider(self, provider: Provider) -> None:
         """add a provider to the list of providers
@@ -72,32 +106,228 @@ class RandomProxy(object):
     def extract_proxies(self) -> ProxyQuery:
         """extracts the proxies from providers
 
+        :raises RuntimeError: raises RuntimeError if it's called inside a running event loop, use aextract_proxies() there
         :return: a ProxyQuery object containing the proxies
         :rtype: ProxyQuery
         """
-        asyncio.get_event_loop().run_until_complete(self._extract_proxies())
+        return run_sync(
+            self.aextract_proxies(), "await RandomProxy.aextract_proxies()"
+        )
+
+    async def aextract_proxies(self, session: ClientSession = None) -> ProxyQuery:
+        """extracts the proxies from providers, the async version of extract_proxies().
+        usage: `await rp.aextract_proxies()`
+
+        :param session: session used to fetch the providers, if not provided a new one is created (using `proxy`), defaults to None
+        :type session: ClientSession, optional
+        :return: a ProxyQuery object containing the proxies
+        :rtype: ProxyQuery
+        """
+        if self.verify:
+            async for _ in self.aiter_verified(session=session):
+                pass
+
+        else:
+            await self._extract(session)
+
         return self.proxy_query
 
-    async def _extract_proxies(self) -> ProxyQuery:
-        """the internal method used to extracts the proxies from providers
-        don't use this method directly, use the extract_proxies method instead.
+    async def aiter_verified(
+        self, limit: int = None, session: ClientSession = None
+    ) -> AsyncIterator[Proxy]:
+        """extracts the proxies and checks their health at the same time, yields each working proxy as soon as its check passes.
+        the proxies of a provider are checked as soon as it's parsed (not after the slowest provider), every ip:port is
+        checked once (the duplicates get the result of the first one) and the proxies with a fresh result in the cache aren't checked.
+        usage: `async for proxy in rp.aiter_verified(limit=20): ...`
+
+        :param limit: stop (and cancel the remaining checks, not the extraction) after this many working proxies are found, defaults to None
+        :type limit: int, optional
+        :param session: session used to fetch the providers, if not provided a new one is created (using `proxy`), defaults to None
+        :type session: ClientSession, optional
+        :yield: working proxies
+        :rtype: AsyncIterator[Proxy]
         """
-        if self.proxy is not None:
-            connector = ProxyConnector.from_url(self.proxy)
+        queue: asyncio.Queue = asyncio.Queue()
+        checked: Dict[Tuple[str, int], Proxy] = {}
+        duplicates: List[Proxy] = []
+
+        async def feed(proxies: List[Proxy]) -> None:
+            for proxy in proxies:
+                if proxy.verified:
+                    continue
+
+                key = (proxy.ip, proxy.port)
+                if key in checked:
+                    duplicates.append(proxy)
+
+                else:
+                    checked[key] = proxy
+                    queue.put_nowait(proxy)
+
+        async def extract() -> None:
+            try:
+                await self._extract(session, feed)
+
+            finally:
+                # None marks the end of the proxies, also when the extraction fails.
+                queue.put_nowait(None)
+
+        producer = asyncio.ensure_future(extract())
+        self.proxy_query.health_checker = HealthChecker(
+            self.test_url,
+            self.timeout,
+            self.concurrency,
+            self.proxy_query.health_cache,
+            stages=self.stages,
+        )
+        try:
+            async with self.proxy_query.health_checker as checker:
+                async for proxy in checker.iter_healthy(queue, limit):
+                    yield proxy
+
+            await producer
+
+        finally:
+            if not producer.done():
+                producer.cancel()
+
+            for proxy in duplicates:
+                original = checked[(proxy.ip, proxy.port)]
+                if original.verified:
+                    proxy._copy_health(original)
+
+            self.save_health()
+
+    async def _extract(
+        self,
+        session: ClientSession = None,
+        on_extracted: Callable[[List[Proxy]], Awaitable[None]] = None,
+    ) -> None:
+        """the internal method used to extract the proxies of all the providers into proxy_query.
+        `on_extracted` is awaited with the proxies added by each provider (as stored in proxy_query) as soon as they are merged.
+        """
+        async def extract(provider: Provider) -> None:
+            cached = None if self.cache is None else self.cache.load(provider.url)
+            if cached is not None:
+                provider.proxies_query = cached
+
+            else:
+                await provider.extract(session, self.executor)
+                if self.cache is not None and len(provider.get_proxy_query()) > 0:
+                    self.cache.store(provider.url, provider.get_proxy_query())
+
+            # merged as soon as the provider is done, not after the slowest one.
+            added = self._merge(provider.get_proxy_query())
+            if on_extracted is not None:
+                await on_extracted(added)
+
+        async with self._session(session) as session:
+            await asyncio.gather(*(extract(provider) for provider in self.proxy_providers))
+
+    def refresh(self) -> Tuple[List[Proxy], List[Proxy]]:
+        """fetches the providers again and updates proxy_query with the changes.
+        unlike extract_proxies it doesn't duplicate the proxies, pages which are not modified (304) aren't parsed
+        and the proxies which are still listed keep their health state.
+
+        :raises RuntimeError: raises RuntimeError if it's called inside a running event loop, use arefresh() there
+        :return: the added and the removed proxies
+        :rtype: tuple[list[Proxy], list[Proxy]]
+        """
+        return run_sync(self.arefresh(), "await RandomProxy.arefresh()")
+
+    async def arefresh(
+        self, session: ClientSession = None
+    ) -> Tuple[List[Proxy], List[Proxy]]:
+        """refreshes the proxies, the async version of refresh().
+        a provider which fails keeps its proxies, the changes of the other providers are still applied.
+
+        :param session: session used to fetch the providers, if not provided a new one is created (using `proxy`), defaults to None
+        :type session: ClientSession, optional
+        :return: the added and the removed proxies
+        :rtype: tuple[list[Proxy], list[Proxy]]
+        """
+        added: List[Proxy] = []
+        removed: List[Proxy] = []
+
+        async def refresh(provider: Provider) -> None:
+            provider_added, provider_removed = await provider.refresh(session, self.executor)
+            # the provider has replaced its proxies, so its changes are applied right away (without awaiting).
+            if self.dedup:
+                # a proxy dropped by one provider stays if another provider still lists it.
+                listed = set()
+                for other in self.proxy_providers:
+                    listed.update(other.get_proxy_query())
+
+                provider_removed = [proxy for proxy in provider_removed if proxy not in listed]
+
+            self.proxy_query._remove(provider_removed)
+            removed.extend(provider_removed)
+            added.extend(self._merge(ProxyQuery(provider_added)))
+            if self.cache is not None and (provider_added or provider_removed):
+                self.cache.store(provider.url, provider.get_proxy_query())
+
+        async with self._session(session) as session:
+            results = await asyncio.gather(
+                *(refresh(provider) for provider in self.proxy_providers),
+                return_exceptions=True,
+            )
+
+        for provider, result in zip(self.proxy_providers, results):
+            if isinstance(result, Exception):
+                print(f"Error refreshing proxies from {provider.url}: {result}")
+
+            elif isinstance(result, BaseException):
+                raise result
+
+        return added, removed
+
+    def _merge(self, query: ProxyQuery) -> List[Proxy]:
+        """the internal method used to add the proxies of a provider to proxy_query, returns the added proxies as stored in proxy_query."""
+        if self.dedup:
+            added = self.proxy_query._merge(query)
+
         else:
-            connector = TCPConnector()
+            start = len(self.proxy_query)
+            self.proxy_query += query
+            added = self.proxy_query[start:]
 
-        tasks = []
-        async with ClientSession(connector=connector) as session:
-            for provider in self.proxy_providers:
-                tasks.append(asyncio.ensure_future(provider.extract(session)))
+        if metrics.enabled:
+            metrics.gauge("proxies", len(self.proxy_query))
 
-            await asyncio.gather(*tasks)
+        return added
 
-        for provider in self.proxy_providers:
-            self.proxy_query += provider.get_proxy_query()
+    @asynccontextmanager
+    async def _session(self, session: ClientSession = None) -> AsyncIterator[ClientSession]:
+        """the internal method which yields the given session, or a new one which is closed afterwards."""
+        if session is not None:
+            yield session
+            return
 
-        if self.verify:
-            self.proxy_query.check_health(self.test_url, self.timeout)
+        async with ClientSession(
+            connector=self._connector(), trace_configs=metrics.trace_configs()
+        ) as session:
+            yield session
 
-        return self.proxy_query
+    def _connector(self) -> TCPConnector:
+        """the internal method used to create the connector used to fetch the providers."""
+        if self.proxy is not None:
+            return ProxyConnector.from_url(self.proxy)
+
+        return TCPConnector()
+
+    def fetcher(self, **kwargs) -> Fetcher:
+        """returns a Fetcher which makes requests through the proxies of proxy_query, with failover and hedged requests.
+        the proxies added later are used too.
+
+        :param kwargs: passed to the Fetcher constructor (retries, timeout, hedge, hedge_delay, strategy)
+        :return: the fetcher, close it (or use it as an async context manager) when it's not needed anymore
+        :rtype: Fetcher
+        """
+        return Fetcher(self.proxy_query, **kwargs)
+
+    def save_health(self) -> None:
+        """saves the health check results of proxy_query to the cache (if there is one).
+        call it after checking the health of the proxies, so the results are available after a restart.
+        """
+        if self.cache is not None:
+            self.cache.update_health(self.proxy_query)
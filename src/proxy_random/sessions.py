@@ -0,0 +1,133 @@
+"""
+contains the SessionCache class, an LRU cache of keep-alive sessions bound to a proxy.
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from aiohttp import ClientSession
+from aiohttp_proxy import ProxyConnector
+
+from proxy_random.config import DEFAULT_SESSION_CACHE_SIZE
+
+
+class SessionCache:
+    """keeps a ClientSession (with a ProxyConnector) per proxy, keyed by ip, port and type,
+    so repeated requests through the same proxy reuse its connections instead of a new TCP (and TLS) handshake.
+
+    at most `max_size` sessions are kept per event loop, the least recently used idle sessions are closed
+    when there are more. a session is idle when it's not leased (see lease()), sessions returned by get()
+    may be closed when they are evicted, so get them again instead of keeping them.
+    sessions belong to the event loop they are created in, call close() before the loop is closed.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_SESSION_CACHE_SIZE) -> None:
+        """SessionCache Constructor
+
+        :param max_size: maximum number of idle sessions kept per event loop, defaults to DEFAULT_SESSION_CACHE_SIZE
+        :type max_size: int, optional
+        """
+        self.max_size: int = max_size
+
+        # event loop -> ((ip, port, type) -> [session, number of leases] in least recently used order,
+        # the tasks closing the evicted sessions)
+        self._loops: WeakKeyDictionary = WeakKeyDictionary()
+
+    @staticmethod
+    def _key(proxy) -> Tuple[str, int, str]:  # type: ignore[Proxy]
+        return proxy.ip, proxy.port, proxy.type.value
+
+    def _sessions(self) -> "Tuple[OrderedDict[Tuple[str, int, str], List], Set[asyncio.Task]]":
+        """the internal method which returns the sessions of the running event loop and the tasks closing the evicted ones."""
+        loop = asyncio.get_running_loop()
+        sessions = self._loops.get(loop)
+        if sessions is None:
+            sessions = self._loops[loop] = (OrderedDict(), set())
+
+        return sessions
+
+    def _entry(self, proxy) -> List:  # type: ignore[Proxy]
+        """the internal method which returns the [session, leases] of a proxy, the session is created if needed."""
+        sessions, closing = self._sessions()
+        key = self._key(proxy)
+        entry = sessions.get(key)
+        if entry is None or entry[0].closed:
+            connector = ProxyConnector(proxy_type=proxy.type, host=proxy.ip, port=proxy.port)
+            session = ClientSession(connector=connector, headers={"Accept": "*/*"})
+            entry = sessions[key] = [session, 0]
+            self._evict(sessions, closing)
+
+        else:
+            sessions.move_to_end(key)
+
+        return entry
+
+    def _evict(
+        self, sessions: "OrderedDict[Tuple[str, int, str], List]", closing: Set[asyncio.Task]
+    ) -> None:
+        """the internal method which closes the least recently used idle sessions above max_size."""
+        excess = len(sessions) - self.max_size
+        if excess <= 0:
+            return
+
+        for key, (session, leases) in list(sessions.items())[:-1]:
+            if excess <= 0:
+                break
+
+            if leases == 0:
+                del sessions[key]
+                excess -= 1
+                task = asyncio.ensure_future(session.close())
+                closing.add(task)
+                task.add_done_callback(closing.discard)
+
+    def get(self, proxy) -> ClientSession:  # type: ignore[Proxy]
+        """returns the session of a proxy, must be called while an event loop is running.
+
+        :param proxy: the proxy
+        :type proxy: Proxy
+        :return: a session whose requests go through the proxy
+        :rtype: ClientSession
+        """
+        return self._entry(proxy)[0]
+
+    @asynccontextmanager
+    async def lease(self, proxy) -> AsyncIterator[ClientSession]:  # type: ignore[Proxy]
+        """yields the session of a proxy, it isn't evicted while it's leased.
+
+        :param proxy: the proxy
+        :type proxy: Proxy
+        """
+        entry = self._entry(proxy)
+        entry[1] += 1
+        try:
+            yield entry[0]
+
+        finally:
+            entry[1] -= 1
+
+    async def close(self) -> None:
+        """closes the sessions of the running event loop."""
+        sessions, closing = self._sessions()
+        while sessions:
+            _, (session, _) = sessions.popitem(last=False)
+            await session.close()
+
+        if closing:
+            await asyncio.gather(*closing, return_exceptions=True)
+
+    def __len__(self) -> int:
+        try:
+            return len(self._sessions()[0])
+
+        except RuntimeError:
+            return 0
+
+    def __repr__(self) -> str:
+        return f"<SessionCache max {self.max_size}>"
+
+
+# the cache used by the package (Proxy.session(), ProxyQuery.session_for(), health checks and Fetcher).
+session_cache = SessionCache()
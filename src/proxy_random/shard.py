@@ -0,0 +1,236 @@
+"""
+contains iter_sharded() which splits the health checks of a large proxy list across several processes.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+from aiohttp_proxy import ProxyType
+
+from proxy_random.config import DEFAULT_SHARD_SIZE
+from proxy_random.health import HealthCache, HealthChecker, Stage
+from proxy_random.proxy import HEALTH_FIELDS, BaseProxy, Proxy
+from proxy_random.sessions import session_cache
+
+# (ip, port, type) of a proxy, the health fields are sent and returned as tuples in HEALTH_FIELDS order.
+Key = Tuple[str, int, str]
+Result = Tuple[Key, tuple]
+
+
+def _key(proxy: BaseProxy) -> Key:
+    return proxy.ip, proxy.port, proxy.type.value
+
+
+def _health(proxy: BaseProxy) -> tuple:
+    return tuple(getattr(proxy, name) for name in HEALTH_FIELDS)
+
+
+def _set_health(proxy: BaseProxy, health: tuple) -> None:
+    for name, value in zip(HEALTH_FIELDS, health):
+        setattr(proxy, name, value)
+
+
+def _check_shard(
+    shard: List[Result],
+    test_url: Optional[str],
+    timeout: Optional[float],
+    concurrency: Optional[int],
+    stages: Optional[List[Stage]],
+) -> List[Result]:
+    """checks a shard in a worker process, returns the new health fields of its proxies."""
+    proxies = []
+    for (ip, port, type_value), health in shard:
+        proxy = Proxy(ip=ip, port=port)
+        proxy.type = ProxyType(type_value)
+        # the current fields, so the moving average and the counters continue from them.
+        _set_health(proxy, health)
+        proxies.append(proxy)
+
+    async def check() -> None:
+        try:
+            async with HealthChecker(test_url, timeout, concurrency, stages=stages) as checker:
+                await checker.check_all(proxies)
+
+        finally:
+            await session_cache.close()
+
+    # a new event loop, a forked worker has a copy of the (running) loop of the parent.
+    asyncio.run(check())
+    return [(_key(proxy), _health(proxy)) for proxy in proxies]
+
+
+def _load_checkpoint(path: str) -> Dict[Key, tuple]:
+    """the results stored in a checkpoint file, a line which wasn't written completely is skipped."""
+    results: Dict[Key, tuple] = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    key, health = json.loads(line)
+                    results[tuple(key)] = tuple(health)
+
+                except ValueError:
+                    continue
+
+    except FileNotFoundError:
+        pass
+
+    return results
+
+
+def _open_checkpoint(path: str) -> TextIO:
+    """opens a checkpoint file for appending. a last line which wasn't written completely is ended first,
+    so it stays a line of its own (skipped by _load_checkpoint) instead of corrupting the next result.
+    """
+    torn = False
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+
+    checkpoint_file = open(path, "a")
+    if torn:
+        checkpoint_file.write("\n")
+
+    return checkpoint_file
+
+
+async def iter_sharded(
+    proxies: Iterable[BaseProxy],
+    processes: int = None,
+    test_url: str = None,
+    timeout: float = None,
+    concurrency: int = None,
+    stages: List[Stage] = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    checkpoint: str = None,
+    cache: HealthCache = None,
+    force: bool = False,
+) -> AsyncIterator[BaseProxy]:
+    """checks the proxies in `processes` worker processes, each one runs its own HealthChecker on a shard
+    (`shard_size` proxies) at a time. the results of a shard are copied into the given proxy objects
+    (verified, working, checked_at, latency, ...) as soon as the shard is done and its proxies are yielded,
+    so the checks scale with the cores instead of a single event loop.
+
+    with `checkpoint` the results of every finished shard are appended to that file, if the run is interrupted
+    a new run with the same file takes the stored results instead of checking those proxies again.
+    the file is removed when the run completes.
+
+    stages are sent to the workers so they must be picklable (the built-in stages are),
+    on platforms which spawn processes the caller must be importable (the `if __name__ == "__main__":` guard).
+
+    :param proxies: the proxies to check
+    :type proxies: Iterable[BaseProxy]
+    :param processes: number of worker processes, defaults to the number of cpus
+    :type processes: int, optional
+    :param test_url: test url used to check health of proxies, if not provided default url will be used, defaults to None
+    :type test_url: str, optional
+    :param timeout: timeout used in the test request, if not provided 5 seconds will be used, defaults to None
+    :type timeout: float, optional
+    :param concurrency: maximum number of checks running at the same time in each process, defaults to None
+    :type concurrency: int, optional
+    :param stages: check the proxies in stages, e.g. [tcp_stage(), http_stage()] (see HealthChecker), defaults to None
+    :type stages: list[Stage], optional
+    :param shard_size: number of proxies sent to a worker at once, defaults to DEFAULT_SHARD_SIZE
+    :type shard_size: int, optional
+    :param checkpoint: path of the checkpoint file, defaults to None
+    :type checkpoint: str, optional
+    :param cache: proxies with a fresh result in the cache aren't checked and the new results are stored in it, defaults to None
+    :type cache: HealthCache, optional
+    :param force: whether to check the proxies which have a fresh result in the cache too, defaults to False
+    :type force: bool, optional
+    :yield: the checked proxies, in the order their shards finish
+    :rtype: AsyncIterator[BaseProxy]
+    """
+    if shard_size < 1:
+        raise ValueError(f"shard_size must be at least 1")
+
+    stored = _load_checkpoint(checkpoint) if checkpoint is not None else {}
+
+    # key -> the proxies with that key, a list may contain the same proxy more than once.
+    targets: Dict[Key, List[BaseProxy]] = {}
+    shards: List[List[Result]] = [[]]
+    # the keys whose stored result is put in the cache, a result is put once however many copies there are.
+    restored: Set[Key] = set()
+    for proxy in proxies:
+        key = _key(proxy)
+        if key in stored:
+            _set_health(proxy, stored[key])
+            if cache is not None and key not in restored:
+                restored.add(key)
+                cache.put(proxy, proxy.working, proxy.checked_at)
+
+            yield proxy
+            continue
+
+        if cache is not None and not force:
+            cached = cache.get(proxy)
+            if cached is not None:
+                checked_at, working = cached
+                if proxy.checked_at is None or proxy.checked_at < checked_at:
+                    proxy.checked_at = checked_at
+                    proxy.verified = True
+                    proxy.working = working
+
+                yield proxy
+                continue
+
+        if key in targets:
+            targets[key].append(proxy)
+            continue
+
+        targets[key] = [proxy]
+        if len(shards[-1]) == shard_size:
+            shards.append([])
+
+        shards[-1].append((key, _health(proxy)))
+
+    if not targets:
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        return
+
+    loop = asyncio.get_running_loop()
+    processes = processes if processes is not None else os.cpu_count() or 1
+    checkpoint_file = _open_checkpoint(checkpoint) if checkpoint is not None else None
+    executor = ProcessPoolExecutor(min(processes, len(shards)))
+    futures = [
+        loop.run_in_executor(
+            executor, _check_shard, shard, test_url, timeout, concurrency, stages
+        )
+        for shard in shards
+    ]
+    try:
+        for future in asyncio.as_completed(futures):
+            results = await future
+            if checkpoint_file is not None:
+                for result in results:
+                    checkpoint_file.write(json.dumps(result) + "\n")
+
+                checkpoint_file.flush()
+
+            for key, health in results:
+                for proxy in targets[key]:
+                    _set_health(proxy, health)
+
+                if cache is not None:
+                    # once per key, otherwise every copy would count as another failure in a row.
+                    cache.put(proxy, proxy.working, proxy.checked_at)
+
+                for proxy in targets[key]:
+                    yield proxy
+
+    finally:
+        for future in futures:
+            future.cancel()
+
+        executor.shutdown(wait=False)
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+
+    if checkpoint is not None:
+        os.remove(checkpoint)
@@ -0,0 +1,379 @@
+"""
+contains the SharedProxyTable class, a table of verified proxies in shared memory which other processes read in place.
+"""
+import mmap
+import os
+import random
+import socket
+import struct
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp_proxy import ProxyType
+
+from proxy_random.config import DEFAULT_SHARED_CAPACITY, LATENCY_EWMA_ALPHA
+from proxy_random.proxy import BaseProxy, Proxy
+
+# generation (odd while a publish is being written), capacity, count.
+HEADER = struct.Struct("<QII")
+# checked_at, latency_ewma, successes, failures, ip, port, type, flags.
+# the 8 byte fields come first so they're aligned and a single field is written at once.
+RECORD = struct.Struct("<ddII16sHBB4x")
+# offsets of the fields updated by report()
+LATENCY_EWMA = 8
+SUCCESSES = 16
+FAILURES = 20
+FLAGS = 43
+COUNTER = struct.Struct("<I")
+FLOAT = struct.Struct("<d")
+
+# bits of the flags field.
+VERIFIED = 1
+WORKING = 2
+HTTPS = 4
+GOOGLE = 8
+IPV6 = 16
+
+NO_VALUE = float("nan")
+PROXY_TYPES = list(ProxyType)
+# random picks before random() scans the table for a working proxy.
+SELECTION_ATTEMPTS = 8
+
+
+def _pack_ip(ip: str) -> Optional[Tuple[bytes, int]]:
+    """the packed address and the IPV6 flag, None if the ip isn't an ipv4 or ipv6 address."""
+    try:
+        return socket.inet_pton(socket.AF_INET, ip), 0
+
+    except (OSError, TypeError):
+        pass
+
+    try:
+        return socket.inet_pton(socket.AF_INET6, ip), IPV6
+
+    except (OSError, TypeError):
+        return None
+
+
+def _unpack_ip(packed: bytes, flags: int) -> str:
+    if flags & IPV6:
+        return socket.inet_ntop(socket.AF_INET6, packed)
+
+    return socket.inet_ntop(socket.AF_INET, packed[:4])
+
+
+class SharedProxyTable:
+    """a fixed size table of proxies (address, type, flags, health and latency) in a memory mapped file,
+    so many processes share one verified pool without pickling or copying it.
+
+    one process publishes the proxies (publish() or a ProxyPool with `shared_table`), the others attach to the same
+    path and pick proxies with lock-free reads: every publish increments a generation counter (odd while it's written)
+    and a read is retried if the generation changed during it. reports (see report()) update the health fields
+    of a record in place, so they're visible to every process right away, a report is written again if a publish
+    started during it. concurrent reports of the same proxy from different processes may lose a counter increment,
+    the health is advisory anyway.
+
+    use a path on a memory backed filesystem (e.g. /dev/shm on linux) to keep the table out of the disk.
+
+    usage: `table = SharedProxyTable("/dev/shm/proxies", create=True)` in the publisher and
+    `table = SharedProxyTable("/dev/shm/proxies")` in the workers, then `proxy = table.random()`
+    """
+
+    def __init__(
+        self, path: str, create: bool = False, capacity: int = DEFAULT_SHARED_CAPACITY
+    ) -> None:
+        """SharedProxyTable Constructor, attaches to the table at `path` or creates it.
+
+        :param path: path of the file backing the table
+        :type path: str
+        :param create: whether to create a new (empty) table, an existing file is overwritten, defaults to False
+        :type create: bool, optional
+        :param capacity: maximum number of proxies of a new table (48 bytes each), defaults to DEFAULT_SHARED_CAPACITY
+        :type capacity: int, optional
+        :raises ValueError: raises ValueError if the file isn't a table
+        """
+        self.path: str = path
+        if create:
+            if capacity < 1:
+                raise ValueError(f"capacity must be at least 1")
+
+            self._file = open(path, "w+b")
+            self._file.truncate(HEADER.size + capacity * RECORD.size)
+
+        else:
+            self._file = open(path, "r+b")
+
+        self._buffer = mmap.mmap(self._file.fileno(), 0)
+        if create:
+            HEADER.pack_into(self._buffer, 0, 0, capacity, 0)
+
+        self.capacity: int = (
+            HEADER.unpack_from(self._buffer, 0)[1] if len(self._buffer) >= HEADER.size else 0
+        )
+        if self.capacity == 0 or len(self._buffer) < HEADER.size + self.capacity * RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a proxy table")
+
+        # (generation, (ip, port) -> position) of this process, rebuilt when the generation changes.
+        self._positions: Optional[Tuple[int, Dict[Tuple[str, int], int]]] = None
+
+    @property
+    def generation(self) -> int:
+        """the number of publishes (times 2) since the table was created, odd while a publish is being written.
+
+        :return: the generation
+        :rtype: int
+        """
+        return HEADER.unpack_from(self._buffer, 0)[0]
+
+    def publish(self, proxies: Iterable[BaseProxy]) -> int:
+        """replaces the proxies of the table, only one process should publish.
+        proxies beyond the capacity and proxies whose ip isn't an ipv4 or ipv6 address or without a valid port are left out.
+
+        :param proxies: the proxies, e.g. the working proxies of a ProxyQuery
+        :type proxies: Iterable[BaseProxy]
+        :return: the number of published proxies
+        :rtype: int
+        """
+        generation = self.generation
+        HEADER.pack_into(self._buffer, 0, generation + 1, self.capacity, 0)
+        count = 0
+        try:
+            for proxy in proxies:
+                if count == self.capacity:
+                    break
+
+                packed = _pack_ip(proxy.ip)
+                port = proxy.port
+                if packed is None or not isinstance(port, int) or not 0 <= port <= 0xFFFF:
+                    continue
+
+                ip, flags = packed
+                flags |= (
+                    (VERIFIED if proxy.verified else 0)
+                    | (WORKING if proxy.working else 0)
+                    | (HTTPS if proxy.https else 0)
+                    | (GOOGLE if proxy.google else 0)
+                )
+                RECORD.pack_into(
+                    self._buffer,
+                    HEADER.size + count * RECORD.size,
+                    proxy.checked_at if proxy.checked_at is not None else NO_VALUE,
+                    proxy.latency_ewma if proxy.latency_ewma is not None else NO_VALUE,
+                    proxy.successes,
+                    proxy.failures,
+                    ip,
+                    port,
+                    PROXY_TYPES.index(proxy.type),
+                    flags,
+                )
+                count += 1
+
+        finally:
+            HEADER.pack_into(self._buffer, 0, generation + 2, self.capacity, count)
+
+        return count
+
+    def _read(self, read: Callable[[int], Any]) -> Any:
+        """the internal method which runs `read(count)` until no publish happened during it."""
+        while True:
+            generation, _, count = HEADER.unpack_from(self._buffer, 0)
+            if generation & 1:
+                # a publish is being written.
+                time.sleep(0)
+                continue
+
+            try:
+                result = read(count)
+
+            except (IndexError, ValueError):
+                # a record was read while it was overwritten.
+                if HEADER.unpack_from(self._buffer, 0)[0] == generation:
+                    raise
+
+                continue
+
+            if HEADER.unpack_from(self._buffer, 0)[0] == generation:
+                return result
+
+    def _proxy(self, position: int) -> Proxy:
+        """the internal method which creates a Proxy from a record."""
+        (
+            checked_at,
+            latency_ewma,
+            successes,
+            failures,
+            ip,
+            port,
+            type_index,
+            flags,
+        ) = RECORD.unpack_from(self._buffer, HEADER.size + position * RECORD.size)
+        proxy = Proxy(
+            ip=_unpack_ip(ip, flags),
+            port=port,
+            google=bool(flags & GOOGLE),
+            https=bool(flags & HTTPS),
+        )
+        proxy.type = PROXY_TYPES[type_index]
+        proxy.verified = bool(flags & VERIFIED)
+        proxy.working = bool(flags & WORKING)
+        proxy.checked_at = None if checked_at != checked_at else checked_at
+        proxy.latency_ewma = None if latency_ewma != latency_ewma else latency_ewma
+        proxy.successes = successes
+        proxy.failures = failures
+        return proxy
+
+    def _working(self, position: int) -> bool:
+        return bool(self._buffer[HEADER.size + position * RECORD.size + FLAGS] & WORKING)
+
+    def get(self, position: int) -> Optional[Proxy]:
+        """returns the proxy at a position of the table.
+
+        :param position: the position
+        :type position: int
+        :return: the proxy, None if the position is past the end
+        :rtype: Optional[Proxy]
+        """
+        return self._read(
+            lambda count: self._proxy(position) if 0 <= position < count else None
+        )
+
+    def random(self) -> Optional[Proxy]:
+        """returns a random working proxy (not reported as failing since it was published).
+
+        :return: a working proxy, None if there is no working proxy
+        :rtype: Optional[Proxy]
+        """
+
+        def read(count: int) -> Optional[Proxy]:
+            if count == 0:
+                return None
+
+            for _ in range(SELECTION_ATTEMPTS):
+                position = random.randrange(count)
+                if self._working(position):
+                    return self._proxy(position)
+
+            start = random.randrange(count)
+            for i in range(count):
+                position = (start + i) % count
+                if self._working(position):
+                    return self._proxy(position)
+
+            return None
+
+        return self._read(read)
+
+    def proxies(self) -> List[Proxy]:
+        """returns all the proxies of the table.
+
+        :return: the proxies
+        :rtype: list[Proxy]
+        """
+        return self._read(lambda count: [self._proxy(i) for i in range(count)])
+
+    def failing(self) -> List[Tuple[str, int]]:
+        """returns the ip and port of the proxies which are reported as failing since they were published.
+
+        :return: (ip, port) of the failing proxies
+        :rtype: list[tuple[str, int]]
+        """
+
+        def read(count: int) -> List[Tuple[str, int]]:
+            failing = []
+            for position in range(count):
+                offset = HEADER.size + position * RECORD.size
+                flags = self._buffer[offset + FLAGS]
+                if flags & VERIFIED and not flags & WORKING:
+                    _, _, _, _, ip, port, _, _ = RECORD.unpack_from(self._buffer, offset)
+                    failing.append((_unpack_ip(ip, flags), port))
+
+            return failing
+
+        return self._read(read)
+
+    def _position(self, proxy: BaseProxy) -> Tuple[int, Optional[int]]:
+        """the internal method which returns the generation and the position of a proxy in it."""
+        if self._positions is None or self._positions[0] != self.generation:
+
+            def read(count: int) -> Tuple[int, Dict[Tuple[str, int], int]]:
+                # _read() checks the generation didn't change around this read.
+                generation = self.generation
+                positions = {}
+                for position in range(count):
+                    _, _, _, _, ip, port, _, flags = RECORD.unpack_from(
+                        self._buffer, HEADER.size + position * RECORD.size
+                    )
+                    positions[(_unpack_ip(ip, flags), port)] = position
+
+                return generation, positions
+
+            self._positions = self._read(read)
+
+        generation, positions = self._positions
+        return generation, positions.get((proxy.ip, proxy.port))
+
+    def report(self, proxy: BaseProxy, working: bool, latency: float = None) -> None:
+        """reports the result of using a proxy, the record is updated in place so every process sees it.
+        a failing proxy isn't returned by random() until it's published again.
+
+        :param proxy: the proxy
+        :type proxy: BaseProxy
+        :param working: whether the proxy worked
+        :type working: bool
+        :param latency: response time of the request in seconds, defaults to None
+        :type latency: float, optional
+        """
+        proxy.record(working, latency)
+        while True:
+            generation, position = self._position(proxy)
+            if position is None:
+                return
+
+            # a publish started since the positions were read, the record may belong to another proxy.
+            if self.generation != generation:
+                continue
+
+            self._write_report(HEADER.size + position * RECORD.size, working, latency)
+            if self.generation == generation:
+                return
+
+            # a publish ran during the write and overwrote the records, the result is written in the new generation.
+
+    def _write_report(self, offset: int, working: bool, latency: Optional[float]) -> None:
+        """the internal method which updates the health fields of the record at `offset`."""
+        if working:
+            successes = COUNTER.unpack_from(self._buffer, offset + SUCCESSES)[0]
+            COUNTER.pack_into(self._buffer, offset + SUCCESSES, successes + 1)
+            if latency is not None:
+                ewma = FLOAT.unpack_from(self._buffer, offset + LATENCY_EWMA)[0]
+                ewma = latency if ewma != ewma else ewma + LATENCY_EWMA_ALPHA * (latency - ewma)
+                FLOAT.pack_into(self._buffer, offset + LATENCY_EWMA, ewma)
+
+            self._buffer[offset + FLAGS] |= VERIFIED | WORKING
+
+        else:
+            failures = COUNTER.unpack_from(self._buffer, offset + FAILURES)[0]
+            COUNTER.pack_into(self._buffer, offset + FAILURES, failures + 1)
+            self._buffer[offset + FLAGS] = (self._buffer[offset + FLAGS] | VERIFIED) & ~WORKING
+
+    def close(self) -> None:
+        """detaches from the table, the file stays for the other processes."""
+        self._buffer.close()
+        self._file.close()
+
+    def unlink(self) -> None:
+        """removes the file of the table, the processes which are attached keep their mapping."""
+        os.remove(self.path)
+
+    def __len__(self) -> int:
+        return HEADER.unpack_from(self._buffer, 0)[2]
+
+    def __enter__(self) -> "SharedProxyTable":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<SharedProxyTable {len(self)} of {self.capacity} proxies>"
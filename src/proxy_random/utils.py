@@ -1,55 +1,353 @@
-from typing import Union
+import asyncio
+import re
+import time
+import warnings
+from typing import Any, Coroutine, Optional, Tuple, Union
 
 from aiohttp import ClientSession
-from aiohttp_proxy import ProxyConnector
 
-from proxy_random.config import TEST_URL
+from proxy_random.config import (
+    ANONYMITY_TEST_URL,
+    CONNECT_TEST_URL,
+    DEFAULT_TCP_TIMEOUT,
+    DEFAULT_TIMEOUT,
+    TEST_URL,
+)
+from proxy_random.metrics import failure_reason, metrics
+from proxy_random.sessions import session_cache
+
+# headers which reveal the address of the client, added by transparent proxies.
+LEAKING_HEADERS = ("x-forwarded-for", "x-real-ip", "forwarded", "client-ip")
+
+# parts of a relative time like "1 hour 5 mins ago".
+AGE_PARTS = re.compile(r"(\d+(?:\.\d+)?)\s*(sec|min|hour|day|week)", re.I)
+AGE_UNITS = {
+    "sec": 1,
+    "min": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 604800,
+}
+
+
+def parse_age(text: Optional[str]) -> Optional[float]:
+    """parses a relative time like "47 mins ago" or "1 hour 5 mins ago".
+
+    :param text: the relative time
+    :type text: Optional[str]
+    :return: the age in seconds, None if it can't be parsed
+    :rtype: Optional[float]
+    """
+    if not text:
+        return None
+
+    parts = AGE_PARTS.findall(text)
+    if not parts:
+        return None
+
+    return sum(float(value) * AGE_UNITS[unit.lower()] for value, unit in parts)
+
+
+def parse_last_checked(value: Union[str, float, None], fetched_at: float) -> Optional[float]:
+    """turns the last checked time of a provider into a unix timestamp.
+
+    :param value: a relative time like "12 secs ago" (relative to `fetched_at`) or a timestamp
+    :type value: Union[str, float, None]
+    :param fetched_at: unix timestamp of when the page was fetched
+    :type fetched_at: float
+    :return: the unix timestamp, None if it's unknown
+    :rtype: Optional[float]
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+
+    age = parse_age(value)
+    return None if age is None else fetched_at - age
+
+
+def sync_loop(alternative: str) -> asyncio.AbstractEventLoop:
+    """returns the event loop used by the synchronous wrappers, the current event loop of the thread
+    (a new one is created and set as the current loop if the thread doesn't have one or it is closed).
+
+    :param alternative: the async api to suggest in the error
+    :type alternative: str
+    :raises RuntimeError: raises RuntimeError if an event loop is running in this thread, a synchronous call would block it
+    :return: the event loop of the current thread
+    :rtype: asyncio.AbstractEventLoop
+    """
+    try:
+        asyncio.get_running_loop()
+
+    except RuntimeError:
+        pass
+
+    else:
+        raise RuntimeError(
+            f"can't block a running event loop, use {alternative} instead"
+        )
+
+    try:
+        with warnings.catch_warnings():
+            # newer pythons warn (or raise) instead of implicitly creating a loop.
+            warnings.simplefilter("ignore", DeprecationWarning)
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+
+    except RuntimeError:
+        loop = None
+
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+    return loop
+
+
+def run_sync(coroutine: Coroutine, alternative: str) -> Any:
+    """runs a coroutine from synchronous code and returns its result.
+
+    :param coroutine: the coroutine to run
+    :type coroutine: Coroutine
+    :param alternative: the async api to suggest if an event loop is already running
+    :type alternative: str
+    :raises RuntimeError: raises RuntimeError if an event loop is running in this thread
+    :return: the result of the coroutine
+    :rtype: Any
+    """
+    try:
+        loop = sync_loop(alternative)
+
+    except RuntimeError:
+        coroutine.close()
+        raise
+
+    try:
+        return loop.run_until_complete(coroutine)
+
+    finally:
+        # the cached sessions of the proxies would outlive the call, nothing closes them later.
+        loop.run_until_complete(session_cache.close())
 
 
 async def get_page(url: str, session: ClientSession) -> Union[str, None]:
+    res, _, _ = await get_page_if_modified(url, session)
+    return res
+
+
+async def get_page_if_modified(
+    url: str,
+    session: ClientSession,
+    etag: str = None,
+    last_modified: str = None,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """conditional GET, returns (page, etag, last modified).
+    page is None if the page is not modified (304) or the request failed.
+    """
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
+
     async with session.get(
         url,
-        headers={"User-Agent": "Mozilla/5.0"},
+        headers=headers,
         timeout=10,
     ) as response:
         if response.status == 200:
-            return await response.text()
+            return (
+                await response.text(),
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
 
-    return None
+    return None, etag, last_modified
 
 
-async def check_proxy_health(
+async def check_proxy_connect(
     proxy,  # type: ignore[Proxy]
-    test_url: str = None,
-    timeout: int = None,
+    timeout: float = None,
 ) -> bool:
-    if test_url is None:
-        test_url = TEST_URL
+    """checks if a TCP connection to the proxy can be opened, much cheaper than a request through the proxy.
 
+    :param proxy: the proxy
+    :type proxy: Proxy
+    :param timeout: timeout of the connection in seconds, defaults to DEFAULT_TCP_TIMEOUT
+    :type timeout: float, optional
+    :return: True if the proxy accepts connections
+    :rtype: bool
+    """
     if timeout is None:
-        timeout = 5
+        timeout = DEFAULT_TCP_TIMEOUT
 
-    connector = ProxyConnector(
-        proxy_type=proxy.type,
-        host=proxy.ip,
-        port=proxy.port,
-    )
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(proxy.ip, proxy.port), timeout
+        )
+
+    except Exception as e:
+        if metrics.enabled:
+            metrics.observe(
+                "proxy_check_seconds",
+                time.perf_counter() - started,
+                check="tcp",
+                result=failure_reason(e),
+            )
+
+        return False
 
+    writer.close()
     try:
-        async with ClientSession(
-            connector=connector,
-            headers={
-                "Accept": "*/*",
-            },
-        ) as session:
-            async with session.get(
-                test_url,
-                timeout=timeout,
-            ) as res:
-                if res.status == 200:
-                    return True
+        # the transport is released once it's closed, not when close() returns.
+        await writer.wait_closed()
 
     except Exception:
         pass
 
-    return False
+    if metrics.enabled:
+        metrics.observe(
+            "proxy_check_seconds", time.perf_counter() - started, check="tcp", result="ok"
+        )
+
+    return True
+
+
+async def check_proxy_anonymity(
+    proxy,  # type: ignore[Proxy]
+    test_url: str = None,
+    timeout: int = None,
+    session: ClientSession = None,
+) -> bool:
+    """checks that the proxy doesn't reveal the client address (LEAKING_HEADERS) to the server.
+
+    :param proxy: the proxy
+    :type proxy: Proxy
+    :param test_url: an url which responds with the received headers as json ({"headers": {...}}), defaults to ANONYMITY_TEST_URL
+    :type test_url: str, optional
+    :param timeout: timeout used in the test request, defaults to DEFAULT_TIMEOUT
+    :type timeout: int, optional
+    :param session: shared session used for the request (http proxies only), defaults to None
+    :type session: ClientSession, optional
+    :return: True if the request worked and no leaking header was received
+    :rtype: bool
+    """
+    body = await _request_through(
+        proxy,
+        test_url if test_url is not None else ANONYMITY_TEST_URL,
+        timeout,
+        session,
+        json=True,
+        check="anonymity",
+    )
+    if not isinstance(body, dict) or not isinstance(body.get("headers"), dict):
+        return False
+
+    received = {name.lower() for name in body["headers"]}
+    return not any(header in received for header in LEAKING_HEADERS)
+
+
+async def check_proxy_https(
+    proxy,  # type: ignore[Proxy]
+    test_url: str = None,
+    timeout: int = None,
+    session: ClientSession = None,
+) -> bool:
+    """checks that the proxy can tunnel https requests (CONNECT).
+
+    :param proxy: the proxy
+    :type proxy: Proxy
+    :param test_url: an https url, defaults to CONNECT_TEST_URL
+    :type test_url: str, optional
+    :param timeout: timeout used in the test request, defaults to DEFAULT_TIMEOUT
+    :type timeout: int, optional
+    :param session: shared session used for the request (http proxies only), defaults to None
+    :type session: ClientSession, optional
+    :return: True if the request worked
+    :rtype: bool
+    """
+    body = await _request_through(
+        proxy,
+        test_url if test_url is not None else CONNECT_TEST_URL,
+        timeout,
+        session,
+        check="https",
+    )
+    return body is not None
+
+
+async def _request_through(
+    proxy,  # type: ignore[Proxy]
+    url: str,
+    timeout: Optional[int],
+    session: Optional[ClientSession],
+    json: bool = False,
+    check: str = "http",
+) -> Any:
+    """makes a GET request through the proxy, returns the body (parsed if `json`) of a 200 response or None.
+    the request is reported to the metrics as a `check` check.
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+
+    started = time.perf_counter()
+    try:
+        status, body = await _get_through(proxy, url, timeout, session, json)
+        result = "ok" if status == 200 else "bad_status"
+
+    except Exception as e:
+        status, body, result = None, None, failure_reason(e)
+
+    if metrics.enabled:
+        metrics.observe(
+            "proxy_check_seconds", time.perf_counter() - started, check=check, result=result
+        )
+
+    return body if status == 200 else None
+
+
+async def _get_through(
+    proxy,  # type: ignore[Proxy]
+    url: str,
+    timeout: int,
+    session: Optional[ClientSession],
+    json: bool,
+) -> Tuple[int, Any]:
+    """the internal method used to make the request of _request_through.
+    returns (status, body), body is None if the status isn't 200.
+    """
+    # http(s) proxies can go through a shared session, the proxy is set per request
+    # exactly like ProxyConnector does, so the connection pool is reused between checks.
+    if session is not None and proxy.type.is_http():
+        async with session.get(
+            url,
+            proxy=f"http://{proxy.ip}:{proxy.port}",
+            timeout=timeout,
+        ) as res:
+            if res.status == 200:
+                return 200, await res.json(content_type=None) if json else await res.read()
+
+            return res.status, None
+
+    # the other proxies use their own session, kept in session_cache for the next requests through the proxy.
+    async with session_cache.lease(proxy) as session:
+        async with session.get(
+            url,
+            timeout=timeout,
+        ) as res:
+            if res.status == 200:
+                return 200, await res.json(content_type=None) if json else await res.read()
+
+            return res.status, None
+
+
+async def check_proxy_health(
+    proxy,  # type: ignore[Proxy]
+    test_url: str = None,
+    timeout: int = None,
+    session: ClientSession = None,
+) -> bool:
+    body = await _request_through(
+        proxy, test_url if test_url is not None else TEST_URL, timeout, session
+    )
+    return body is not None
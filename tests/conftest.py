@@ -0,0 +1,37 @@
+"""
+shared setup of the tests, the package and the local stand-in servers of the benchmarks are imported from the tree.
+"""
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from proxy_random.health import HealthCache  # noqa: E402
+from proxy_random.query import ProxyQuery  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def health_cache(monkeypatch):
+    """a new shared health cache for every test, the local servers may get the ports of an earlier test."""
+    cache = HealthCache()
+    monkeypatch.setattr(ProxyQuery, "health_cache", cache)
+    return cache
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """runs the `async def` tests in a new event loop."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    arguments = {
+        name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames
+    }
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from aiohttp_proxy import ProxyType
+
+from proxy_random import Proxy, ProxyQuery, RandomProxy
+from proxy_random.sessions import session_cache
+from servers import ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+async def test_async_api_inside_a_running_loop():
+    async with ProxyFarm(working=2, refused=1) as farm:
+        query = ProxyQuery(list(farm.proxies))
+        await query.acheck_health(TEST_URL, 2)
+        assert len(query.filter(working=True)) == 2
+
+
+async def test_sync_api_refuses_to_block_the_loop():
+    query = ProxyQuery([Proxy(ip="127.0.0.1", port=1)])
+    with pytest.raises(RuntimeError, match="acheck_health"):
+        query.check_health(TEST_URL, 1)
+
+    with pytest.raises(RuntimeError):
+        next(query.iter_healthy_sync(TEST_URL, 1))
+
+    with pytest.raises(RuntimeError):
+        RandomProxy(use_defaults=False).extract_proxies()
+
+
+def test_iter_healthy_sync_closes_the_sessions():
+    proxies = [Proxy(ip="127.0.0.1", port=port) for port in (1, 2)]
+    for proxy in proxies:
+        # socks checks lease a session from session_cache, nothing listens on the ports.
+        proxy.type = ProxyType.SOCKS5
+
+    async def cached():
+        return len(session_cache)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        assert list(ProxyQuery(proxies).iter_healthy_sync(TEST_URL, 1)) == []
+        assert all(proxy.verified for proxy in proxies)
+        assert loop.run_until_complete(cached()) == 0
+
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+from aiohttp_proxy import ProxyType
+
+from proxy_random import Proxy, RandomProxy
+from proxy_random.cache import ProxyCache
+from proxy_random.extract import parse_response
+from proxy_random.provider import Provider
+from servers import ProviderServer
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ProxyCache(str(tmp_path / "cache.db"))
+    yield cache
+    cache.close()
+
+
+def make_proxies():
+    checked = Proxy(ip="10.0.0.1", port=80, country_code="DE", https=True, last_checked=100.0, source="a")
+    checked.record(True, 0.2)
+    checked.verified = True
+    checked.working = True
+    checked.checked_at = time.time()
+    socks = Proxy(ip="10.0.0.2", port=1080)
+    socks.type = ProxyType.SOCKS5
+    return [checked, socks]
+
+
+def test_store_and_load(cache):
+    cache.store("http://a.invalid/", make_proxies())
+    checked, socks = cache.load("http://a.invalid/")
+
+    assert (checked.ip, checked.port, checked.country_code, checked.https) == ("10.0.0.1", 80, "DE", True)
+    assert checked.last_checked == 100.0
+    assert checked.type is ProxyType.HTTPS
+    assert checked.source == "a"
+    assert checked.verified and checked.working
+    assert checked.latency_ewma == 0.2 and checked.successes == 1
+    assert socks.type is ProxyType.SOCKS5
+    assert not socks.verified
+
+
+def test_stale_provider_isnt_loaded(tmp_path):
+    cache = ProxyCache(str(tmp_path / "cache.db"), ttl=0)
+    cache.store("http://a.invalid/", make_proxies())
+    assert not cache.is_fresh("http://a.invalid/")
+    assert cache.load("http://a.invalid/") is None
+    assert cache.load("http://unknown.invalid/") is None
+    cache.close()
+
+
+def test_old_health_is_loaded_unverified(tmp_path):
+    cache = ProxyCache(str(tmp_path / "cache.db"), health_ttl=60)
+    proxies = make_proxies()
+    proxies[0].checked_at = time.time() - 120
+    cache.store("http://a.invalid/", proxies)
+    checked, _ = cache.load("http://a.invalid/")
+    assert not checked.verified
+    # the measurements are kept.
+    assert checked.latency_ewma == 0.2
+    cache.close()
+
+
+def test_update_health_of_every_provider(cache):
+    cache.store("http://a.invalid/", [Proxy(ip="10.0.0.1", port=80)])
+    cache.store("http://b.invalid/", [Proxy(ip="10.0.0.1", port=80)])
+    proxy = Proxy(ip="10.0.0.1", port=80)
+    proxy.verified = True
+    proxy.working = True
+    proxy.checked_at = time.time()
+    cache.update_health([proxy])
+
+    for url in ("http://a.invalid/", "http://b.invalid/"):
+        assert cache.load(url)[0].working
+
+
+def test_clear(cache):
+    cache.store("http://a.invalid/", make_proxies())
+    cache.clear()
+    assert cache.load("http://a.invalid/") is None
+
+
+def test_used_from_other_threads(cache):
+    errors = []
+
+    def use():
+        try:
+            for _ in range(20):
+                cache.store("http://a.invalid/", make_proxies())
+                cache.load("http://a.invalid/")
+
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+async def test_warm_start_skips_the_provider(tmp_path):
+    path = str(tmp_path / "cache.db")
+    async with ProviderServer() as server:
+        requests = []
+        provider_url = server.url(30)
+
+        def extractor(response):
+            requests.append(1)
+            return parse_response(response)
+
+        for _ in range(2):
+            cache = ProxyCache(path)
+            random_proxy = RandomProxy(use_defaults=False, cache=cache)
+            random_proxy.add_provider(Provider(provider_url, extractor))
+            await random_proxy.aextract_proxies()
+            assert len(random_proxy.proxy_query) == 30
+            cache.close()
+
+        assert len(requests) == 1
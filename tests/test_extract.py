@@ -0,0 +1,102 @@
+import os
+
+import pickle
+
+import pytest
+from aiohttp_proxy import ProxyType
+
+from pages import proxy_list_page
+from proxy_random import ProxyQuery
+from proxy_random.extract import ProxyTableParser, parse_response, parse_response_soup
+from proxy_random.provider import Provider
+from proxy_random.proxy import BaseProxy
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+def fields(query):
+    return [
+        (
+            proxy.ip,
+            proxy.port,
+            proxy.country_code,
+            proxy.country,
+            proxy.anonymity,
+            proxy.google,
+            proxy.https,
+            proxy.last_checked,
+        )
+        for proxy in query
+    ]
+
+
+@pytest.fixture(params=["free-proxy-list.html", "sslproxies.html"])
+def page(request):
+    with open(os.path.join(FIXTURES, request.param), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_same_proxies_as_soup(page):
+    assert fields(parse_response(page)) == fields(parse_response_soup(page))
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_fed_in_parts(page, size):
+    parser = ProxyTableParser()
+    for start in range(0, len(page), size):
+        parser.feed(page[start : start + size])
+
+    parser.close()
+    assert fields(parser.proxies()) == fields(parse_response_soup(page))
+
+
+def test_rows_are_parsed_while_fed():
+    page = proxy_list_page(10)
+    parser = ProxyTableParser()
+    parser.feed(page[: len(page) // 2])
+    assert len(parser.rows) >= 3
+
+
+@pytest.mark.parametrize("omitted", ["</tr>", "</td>", "</td></tr>"])
+def test_omitted_end_tags(omitted):
+    page = proxy_list_page(5)
+    assert fields(parse_response(page.replace(omitted, ""))) == fields(parse_response(page))
+
+
+def test_no_table():
+    with pytest.raises(ValueError):
+        parse_response("<html><body>no proxies</body></html>")
+
+
+@pytest.mark.parametrize("parse", [parse_response, parse_response_soup])
+def test_parsing_keeps_the_indexes(parse):
+    page = proxy_list_page(20)
+    query = parse(page)
+    query.filter(country_code="DE")._proxy_list
+    index = query._indexes["country_code"]
+    versions = dict(BaseProxy.versions)
+
+    parse(page)
+    pickle.loads(pickle.dumps(list(parse(page))))
+
+    assert BaseProxy.versions == versions
+    query.filter(country_code="DE")._proxy_list
+    assert query._indexes["country_code"] is index
+
+
+@pytest.mark.parametrize("parse", [parse_response, parse_response_soup])
+def test_type_follows_https(parse):
+    query = parse(proxy_list_page(20))
+    assert isinstance(query, ProxyQuery)
+    for proxy in query:
+        assert proxy.type is (ProxyType.HTTPS if proxy.https else ProxyType.HTTP)
+
+
+async def test_provider_converts_last_checked():
+    provider = Provider("http://test.invalid/", parse_response)
+    page = proxy_list_page(20)
+    versions = dict(BaseProxy.versions)
+    query = await provider._parse(page, fetched_at=1000.0)
+
+    assert BaseProxy.versions == versions
+    assert all(isinstance(proxy.last_checked, float) and proxy.last_checked <= 1000.0 for proxy in query)
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from proxy_random import ProxyQuery
+from proxy_random.fetch import Fetcher, FetchError
+from proxy_random.health import HealthCache
+from servers import ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+class TrackingFetcher(Fetcher):
+    """a Fetcher which lists the attempts which are finished, also the cancelled ones."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = 0
+        self.finished = 0
+
+    async def _attempt(self, proxy, method, url, kwargs):
+        self.started += 1
+        try:
+            return await super()._attempt(proxy, method, url, kwargs)
+
+        finally:
+            self.finished += 1
+
+
+async def test_failover_to_a_working_proxy():
+    async with ProxyFarm(working=5, refused=1) as farm:
+        query = ProxyQuery(list(farm.proxies))
+        async with Fetcher(query, retries=3, timeout=2) as fetcher:
+            # the refused proxy is chosen first sometimes, a new health cache each time so it's chosen again.
+            for _ in range(40):
+                query.health_cache = HealthCache()
+                response = await fetcher.fetch(TEST_URL)
+                assert response.status == 200
+                assert response.proxy.kind == "working"
+                assert response.json()["origin"] == "127.0.0.1"
+                if response.attempts == 2:
+                    break
+
+        assert response.attempts == 2
+        refused = [proxy for proxy in farm.proxies if proxy.kind == "refused"][0]
+        assert refused.failures >= 1
+        assert query.health_cache.get(refused)[1] is False
+
+
+async def test_every_attempt_failed():
+    async with ProxyFarm(refused=3) as farm:
+        async with Fetcher(ProxyQuery(list(farm.proxies)), retries=5, timeout=2) as fetcher:
+            with pytest.raises(FetchError) as error:
+                await fetcher.fetch(TEST_URL)
+
+        # each proxy is tried at most once.
+        tried = [proxy for proxy, _ in error.value.errors]
+        assert 1 <= len(tried) == len(set(tried)) <= 3
+
+    async with Fetcher(ProxyQuery([])) as fetcher:
+        with pytest.raises(FetchError, match="no usable proxy"):
+            await fetcher.fetch(TEST_URL)
+
+
+async def test_hedged_request_wins_over_a_slow_proxy():
+    async with ProxyFarm(working=1, latency=2) as slow, ProxyFarm(working=1) as fast:
+        query = ProxyQuery(list(slow.proxies) + list(fast.proxies))
+        async with TrackingFetcher(query, retries=1, timeout=5, hedge=True, hedge_delay=0.05) as fetcher:
+            for _ in range(4):
+                started = time.perf_counter()
+                response = await fetcher.fetch(TEST_URL)
+                assert time.perf_counter() - started < 1
+                assert response.proxy is fast.proxies[0]
+                # the losing attempt is cancelled and finished before fetch() returns.
+                assert fetcher.finished == fetcher.started
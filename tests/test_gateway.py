@@ -0,0 +1,102 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from proxy_random import Proxy, ProxyGateway, ProxyQuery
+from servers import ProxyFarm
+
+
+async def test_forwards_and_retries():
+    async with ProxyFarm(working=2, refused=3) as farm:
+        async with ProxyGateway(ProxyQuery(list(farm.proxies)), port=0, retries=8) as gateway:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(5):
+                    async with session.get("http://test.invalid/headers", proxy=gateway.url) as response:
+                        assert response.status == 200
+                        assert (await response.json())["origin"] == "127.0.0.1"
+
+
+async def hello(request):
+    return web.Response(text="hello")
+
+
+async def test_connect_tunnel():
+    app = web.Application()
+    app.router.add_get("/", hello)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with ProxyFarm(working=1) as farm:
+            async with ProxyGateway(ProxyQuery(list(farm.proxies)), port=0) as gateway:
+                reader, writer = await asyncio.open_connection("127.0.0.1", gateway.port)
+                writer.write(f"CONNECT 127.0.0.1:{port} HTTP/1.1\r\n\r\n".encode())
+                assert (await reader.readuntil(b"\r\n\r\n")).startswith(b"HTTP/1.1 200")
+
+                writer.write(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+                await reader.readuntil(b"\r\n\r\n")
+                assert await reader.readexactly(5) == b"hello"
+                writer.close()
+
+    finally:
+        await runner.cleanup()
+
+
+async def test_no_proxy_available():
+    async with ProxyGateway(ProxyQuery([]), port=0) as gateway:
+        async with aiohttp.ClientSession() as session:
+            async with session.get("http://test.invalid/", proxy=gateway.url) as response:
+                assert response.status == 503
+
+
+@pytest.mark.parametrize(
+    "request_line",
+    [b"GARBAGE", b"GET http://[::1/ HTTP/1.1", b"GET /relative HTTP/1.1", b"CONNECT :443 HTTP/1.1"],
+)
+async def test_bad_request(request_line):
+    async with ProxyGateway(ProxyQuery([]), port=0) as gateway:
+        reader, writer = await asyncio.open_connection("127.0.0.1", gateway.port)
+        writer.write(request_line + b"\r\n\r\n")
+        response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 2)
+        assert response.startswith(b"HTTP/1.1 400")
+        writer.close()
+
+
+async def test_stop_closes_open_connections():
+    connections = []
+
+    async def silent(reader, writer):
+        # accepts the CONNECT but never answers it.
+        connections.append(writer)
+        try:
+            await reader.read()
+
+        finally:
+            writer.close()
+
+    upstream = await asyncio.start_server(silent, "127.0.0.1", 0)
+    port = upstream.sockets[0].getsockname()[1]
+    try:
+        gateway = ProxyGateway(ProxyQuery([Proxy(ip="127.0.0.1", port=port)]), port=0, timeout=10)
+        await gateway.start()
+        idle_reader, _ = await asyncio.open_connection("127.0.0.1", gateway.port)
+        tunnel_reader, tunnel_writer = await asyncio.open_connection("127.0.0.1", gateway.port)
+        tunnel_writer.write(b"CONNECT example.com:443 HTTP/1.1\r\n\r\n")
+        while not connections:
+            await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(gateway.stop(), 2)
+
+        assert await asyncio.wait_for(idle_reader.read(), 2) == b""
+        assert await asyncio.wait_for(tunnel_reader.read(), 2) == b""
+        # the upstream connection of the interrupted handshake is closed too.
+        await asyncio.sleep(0.05)
+        assert connections[0].is_closing()
+
+    finally:
+        upstream.close()
+        await upstream.wait_closed()
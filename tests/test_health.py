@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from proxy_random import Proxy, ProxyQuery
+from proxy_random.health import HealthCache, HealthChecker, Stage
+from proxy_random.utils import check_proxy_connect
+from servers import ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+async def test_check_all_sets_the_health():
+    async with ProxyFarm(working=3, refused=2) as farm:
+        async with HealthChecker(TEST_URL, 2, concurrency=2) as checker:
+            await checker.check_all(farm.proxies)
+
+        assert checker.checked == 5
+        assert checker.working == 3
+        assert checker.checks_per_second > 0
+        for proxy in farm.proxies:
+            assert proxy.verified
+            assert proxy.working == (proxy.kind == "working")
+            assert (proxy.latency is not None) == proxy.working
+
+
+async def test_concurrency_is_bounded():
+    running = 0
+    most = 0
+
+    async def check(proxy, timeout, session):
+        nonlocal running, most
+        running += 1
+        most = max(most, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return True
+
+    proxies = [Proxy(ip="10.0.0.1", port=port) for port in range(1, 21)]
+    async with HealthChecker(concurrency=3, stages=[Stage("fake", check)]) as checker:
+        await checker.check_all(proxies)
+
+    assert most == 3
+    assert all(proxy.working for proxy in proxies)
+
+
+async def test_failing_check_stops_the_other_workers():
+    stopped = []
+
+    async def check(proxy, timeout, session):
+        if proxy.port == 1:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("broken check")
+
+        try:
+            await asyncio.sleep(10)
+
+        finally:
+            stopped.append(proxy.port)
+
+        return True
+
+    proxies = [Proxy(ip="10.0.0.1", port=port) for port in range(1, 4)]
+    async with HealthChecker(concurrency=3, stages=[Stage("fake", check)]) as checker:
+        with pytest.raises(RuntimeError):
+            await checker.check_all(proxies)
+
+        # the siblings are cancelled before check_all() returns, not after the session is closed.
+        assert sorted(stopped) == [2, 3]
+
+
+async def test_check_proxy_connect():
+    async with ProxyFarm(working=1, refused=1) as farm:
+        working, refused = farm.proxies
+        assert await check_proxy_connect(working, 1)
+        assert not await check_proxy_connect(refused, 1)
+
+
+def test_check_health_sync():
+    async def start():
+        farm = ProxyFarm(working=2, refused=1)
+        await farm.start()
+        return farm
+
+    loop = asyncio.new_event_loop()
+    try:
+        farm = loop.run_until_complete(start())
+        proxies = list(farm.proxies)
+        query = ProxyQuery(proxies)
+        asyncio.set_event_loop(loop)
+        query.check_health(TEST_URL, 2)
+        assert len(query.filter(working=True)) == 2
+        loop.run_until_complete(farm.close())
+
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def test_fresh_results_arent_checked_again():
+    checked = []
+
+    async def check(proxy, timeout, session):
+        checked.append(proxy.port)
+        return proxy.port != 1
+
+    cache = HealthCache()
+    proxies = [Proxy(ip="10.0.0.1", port=port) for port in range(1, 4)]
+    for force in (False, False, True):
+        async with HealthChecker(cache=cache, force=force, stages=[Stage("fake", check)]) as checker:
+            await checker.check_all([Proxy(ip=proxy.ip, port=proxy.port) for proxy in proxies])
+
+    assert sorted(checked) == [1, 1, 2, 2, 3, 3]
+    assert checker.cached == 0
+
+
+def test_failures_open_the_circuit():
+    cache = HealthCache(max_failures=2, negative_ttl=60)
+    proxy = Proxy(ip="10.0.0.1", port=80)
+    cache.put(proxy, False)
+    assert not cache.is_open(proxy)
+
+    cache.put(proxy, False)
+    assert cache.is_open(proxy)
+
+    cache.put(proxy, True)
+    assert not cache.is_open(proxy)
+    assert cache.get(proxy)[1] is True
+
+
+def test_prune_removes_stale_results():
+    cache = HealthCache(ttl=10)
+    fresh = Proxy(ip="10.0.0.1", port=80)
+    stale = Proxy(ip="10.0.0.2", port=80)
+    cache.put(fresh, True)
+    cache.put(stale, True, time.time() - 60)
+    cache.prune()
+    assert len(cache) == 1
+    assert cache.get(stale) is None
+
+
+def test_concurrent_failures_are_counted():
+    cache = HealthCache(max_failures=10 ** 9, negative_ttl=10 ** 6, max_backoff=10 ** 9)
+    proxy = Proxy(ip="10.0.0.1", port=80)
+
+    def report():
+        for _ in range(2000):
+            cache.put(proxy, False)
+            cache.is_open(proxy)
+
+    def prune():
+        for _ in range(200):
+            cache.prune()
+
+    threads = [threading.Thread(target=report) for _ in range(4)] + [threading.Thread(target=prune)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert cache._results[(proxy.ip, proxy.port)][2] == 8000
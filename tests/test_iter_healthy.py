@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from proxy_random import ProxyQuery
+from servers import ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+async def test_yields_before_the_slow_checks_end():
+    async with ProxyFarm(working=2, hanging=3) as farm:
+        query = ProxyQuery(list(farm.proxies))
+        started = time.perf_counter()
+        first = None
+        found = []
+        async for proxy in query.iter_healthy(TEST_URL, 1):
+            if first is None:
+                first = time.perf_counter() - started
+
+            found.append(proxy)
+
+        assert sorted(proxy.kind for proxy in found) == ["working", "working"]
+        # the hanging proxies time out after a second, the working ones don't wait for them.
+        assert first < 0.5
+        assert sum(proxy.verified for proxy in farm.proxies) == 5
+
+
+async def test_limit_cancels_the_remaining_checks():
+    async with ProxyFarm(working=3, hanging=5) as farm:
+        query = ProxyQuery(list(farm.proxies))
+        started = time.perf_counter()
+        found = [proxy async for proxy in query.iter_healthy(TEST_URL, 5, limit=2)]
+
+        assert len(found) == 2
+        assert time.perf_counter() - started < 2
+        # the hanging proxies were never verified, their checks were cancelled.
+        assert not any(proxy.verified for proxy in farm.proxies if proxy.kind == "hanging")
+
+
+async def test_break_cancels_the_remaining_checks():
+    async with ProxyFarm(working=1, hanging=3) as farm:
+        query = ProxyQuery(list(farm.proxies))
+        iterator = query.iter_healthy(TEST_URL, 5)
+        async for _ in iterator:
+            break
+
+        await iterator.aclose()
+        await asyncio.sleep(0)
+        assert query.health_checker._session is None
+
+
+def test_iter_healthy_sync():
+    async def start():
+        farm = ProxyFarm(working=3, refused=2)
+        await farm.start()
+        return farm
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        farm = loop.run_until_complete(start())
+        query = ProxyQuery(list(farm.proxies))
+        found = list(query.iter_healthy_sync(TEST_URL, 2, limit=2))
+        assert len(found) == 2
+        assert all(proxy.working for proxy in found)
+        loop.run_until_complete(farm.close())
+
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+
+import pytest
+
+from proxy_random import ProxyQuery, RandomProxy
+from proxy_random.extract import parse_response
+from proxy_random.metrics import (
+    COUNTER,
+    GAUGE,
+    LoggingSink,
+    Metrics,
+    PrometheusSink,
+    failure_reason,
+    metrics,
+)
+from proxy_random.provider import Provider
+from servers import ProviderServer, ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+@pytest.fixture
+def events():
+    """the events sent to the package's metrics while the test runs."""
+    events = []
+
+    def sink(kind, name, value, labels):
+        events.append((kind, name, value, labels))
+
+    metrics.add_sink(sink)
+    yield events
+    metrics.remove_sink(sink)
+
+
+def test_disabled_without_sinks():
+    disabled = Metrics()
+    assert not disabled.enabled
+    assert disabled.trace_configs() == []
+
+    disabled.add_sink(lambda *args: None)
+    assert disabled.enabled
+    assert len(disabled.trace_configs()) == 1
+
+
+async def test_provider_events(events):
+    async with ProviderServer() as server:
+        random_proxy = RandomProxy(use_defaults=False)
+        random_proxy.add_provider(Provider(server.url(25), parse_response))
+        await random_proxy.aextract_proxies()
+
+    names = {name for _, name, _, _ in events}
+    assert {"provider_fetch_seconds", "provider_parse_seconds", "provider_proxies", "proxies"} <= names
+    assert (GAUGE, "provider_proxies", 25, {"provider": server.url(25)}) in events
+
+
+async def test_check_events(events):
+    async with ProxyFarm(working=1, refused=1) as farm:
+        await ProxyQuery(list(farm.proxies)).acheck_health(TEST_URL, 2)
+
+    results = {labels["result"] for _, name, _, labels in events if name == "proxy_check_seconds"}
+    assert {"ok", "refused"} <= results
+
+
+def test_failing_sink_doesnt_stop_the_others(capsys):
+    received = []
+    sinks = Metrics()
+
+    def broken(*args):
+        raise RuntimeError("broken sink")
+
+    sinks.add_sink(broken)
+    sinks.add_sink(lambda *args: received.append(args))
+    sinks.count("requests_total", proxy="a")
+    assert received == [(COUNTER, "requests_total", 1, {"proxy": "a"})]
+    assert "broken sink" in capsys.readouterr().out
+
+
+def test_logging_sink(caplog):
+    sinks = Metrics()
+    sinks.add_sink(LoggingSink(level=logging.INFO))
+    with caplog.at_level(logging.INFO, logger="proxy_random.metrics"):
+        sinks.observe("provider_fetch_seconds", 0.5, provider="a")
+
+    assert caplog.messages == ["histogram provider_fetch_seconds 0.5 provider=a"]
+
+
+def test_prometheus_sink():
+    sink = PrometheusSink(buckets=(0.1, 1))
+    sinks = Metrics()
+    sinks.add_sink(sink)
+    sinks.count("errors_total", reason='a "quoted"\nreason')
+    sinks.count("errors_total", reason='a "quoted"\nreason')
+    sinks.gauge("proxies", 5)
+    sinks.gauge("proxies", 3)
+    sinks.observe("fetch_seconds", 0.05)
+    sinks.observe("fetch_seconds", 0.5)
+
+    assert sink.render().splitlines() == [
+        "# TYPE proxy_random_errors_total counter",
+        'proxy_random_errors_total{reason="a \\"quoted\\"\\nreason"} 2',
+        "# TYPE proxy_random_fetch_seconds histogram",
+        'proxy_random_fetch_seconds_bucket{le="0.1"} 1',
+        'proxy_random_fetch_seconds_bucket{le="1"} 2',
+        'proxy_random_fetch_seconds_bucket{le="+Inf"} 2',
+        "proxy_random_fetch_seconds_sum 0.55",
+        "proxy_random_fetch_seconds_count 2",
+        "# TYPE proxy_random_proxies gauge",
+        "proxy_random_proxies 3",
+    ]
+
+    sink.clear()
+    assert sink.render() == "\n"
+
+
+def test_failure_reason():
+    assert failure_reason(asyncio.TimeoutError()) == "timeout"
+    assert failure_reason(ConnectionRefusedError()) == "refused"
+    assert failure_reason(ValueError()) == "bad_body"
+    assert failure_reason(OSError()) == "connection"
+    assert failure_reason(RuntimeError()) == "error"
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from proxy_random import RandomProxy
+from proxy_random.extract import parse_response
+from proxy_random.health import Stage
+from proxy_random.provider import Provider
+from servers import ProviderServer
+
+
+def make_random_proxy(urls, concurrency=None, delay=0.0):
+    """a RandomProxy of the providers, every proxy passes the check, `checked` lists the checked addresses."""
+    checked = []
+
+    async def check(proxy, timeout, session):
+        checked.append((proxy.ip, proxy.port))
+        await asyncio.sleep(delay)
+        return True
+
+    random_proxy = RandomProxy(
+        use_defaults=False, stages=[Stage("fake", check)], concurrency=concurrency
+    )
+    for url in urls:
+        random_proxy.add_provider(Provider(url, parse_response))
+
+    return random_proxy, checked
+
+
+async def test_checks_start_before_the_slow_provider():
+    async with ProviderServer() as fast, ProviderServer(delay=1) as slow:
+        random_proxy, _ = make_random_proxy([fast.url(20, seed=1), slow.url(20, seed=2)])
+        started = time.perf_counter()
+        first = None
+        found = []
+        async for proxy in random_proxy.aiter_verified():
+            if first is None:
+                first = time.perf_counter() - started
+
+            found.append(proxy)
+
+        assert first < 0.5
+        assert len(found) == 40
+        assert len(random_proxy.proxy_query.filter(working=True)) == 40
+
+
+async def test_duplicates_are_checked_once():
+    async with ProviderServer() as server:
+        random_proxy, checked = make_random_proxy([server.url(10), server.url(10)])
+        found = [proxy async for proxy in random_proxy.aiter_verified()]
+
+        assert len(found) == 10
+        assert len(checked) == len(set(checked)) == 10
+        # the duplicates get the result of the first check.
+        assert len(random_proxy.proxy_query) == 20
+        assert all(proxy.working for proxy in random_proxy.proxy_query)
+
+
+async def test_limit_cancels_the_remaining_checks():
+    async with ProviderServer() as server:
+        random_proxy, checked = make_random_proxy([server.url(50)], concurrency=2, delay=0.01)
+        found = [proxy async for proxy in random_proxy.aiter_verified(limit=3)]
+
+        assert len(found) == 3
+        assert len(checked) < 10
+        await asyncio.sleep(0.05)
+        assert len(checked) < 10
@@ -0,0 +1,93 @@
+import time
+import types
+
+import pytest
+
+from proxy_random import Proxy, ProxyQuery, RandomProxy
+from proxy_random.columns import ProxyColumns
+from proxy_random.health import Stage
+from proxy_random.pool import ProxyPool
+
+
+def make_pool(ports, working, columnar=False, **kwargs):
+    """a pool of proxies on 10.0.0.1:<port>, the ones in `working` pass the check, `checked` counts the checks."""
+    checked = []
+
+    async def check(proxy, timeout, session):
+        checked.append(proxy.port)
+        return proxy.port in working
+
+    proxies = [Proxy(ip="10.0.0.1", port=port) for port in ports]
+    random_proxy = RandomProxy(use_defaults=False, stages=[Stage("fake", check)])
+    random_proxy.proxy_query = ProxyQuery(ProxyColumns(proxies) if columnar else proxies)
+    pool = ProxyPool(random_proxy, **kwargs)
+    pool._track(list(random_proxy.proxy_query))
+    return pool, checked
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+async def test_check_due_verifies_and_evicts(columnar):
+    pool, checked = make_pool([1, 2, 3], working={1, 2}, columnar=columnar, max_failures=1)
+    assert pool.get() is None
+
+    await pool.check_due()
+    assert sorted(checked) == [1, 2, 3]
+    assert len(pool) == 2
+    assert sorted(proxy.port for proxy in pool.random_proxy.proxy_query) == [1, 2]
+
+    # the results aren't old yet.
+    await pool.check_due()
+    assert len(checked) == 3
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+async def test_health_reaches_the_query_after_an_eviction(columnar):
+    pool, _ = make_pool([1, 2, 3], working={2, 3}, columnar=columnar, max_failures=1)
+    await pool.check_due()
+    query = pool.random_proxy.proxy_query
+
+    proxy = pool.get()
+    pool.report(proxy, False)
+    assert len(pool) == 1
+    reported = query.filter(port=proxy.port).first()
+    assert reported.failures == 1
+
+    await pool.check_due()
+    assert len(pool) == 2
+    assert len(query.filter(working=True)) == 2
+
+
+async def test_reported_proxy_keeps_one_pending_check(monkeypatch):
+    pool, checked = make_pool([1], working=set(), recheck_interval=10, max_failures=10)
+    await pool.check_due()
+    # reported again while its backoff check is pending.
+    pool.report(pool.random_proxy.proxy_query[0], False)
+    await pool.check_due()
+    assert checked == [1, 1]
+    assert len(pool._next_check) == 1
+
+    # the first backoff (10s) was replaced by the second one (20s).
+    now = time.time()
+    monkeypatch.setattr("proxy_random.pool.time", types.SimpleNamespace(time=lambda: now + 15))
+    await pool.check_due()
+    assert checked == [1, 1]
+
+    monkeypatch.setattr("proxy_random.pool.time", types.SimpleNamespace(time=lambda: now + 25))
+    await pool.check_due()
+    assert checked == [1, 1, 1]
+
+
+def test_start_thread():
+    pool, _ = make_pool([1, 2], working={1, 2})
+    pool.start_thread()
+    try:
+        deadline = time.time() + 5
+        while pool.get() is None and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert pool.get().port in (1, 2)
+
+    finally:
+        pool.stop_thread()
+
+    assert pool._thread is None
@@ -0,0 +1,236 @@
+import pytest
+from aiohttp_proxy import ProxyType
+
+from proxy_random import Proxy, ProxyQuery
+from proxy_random.columns import ProxyColumns
+from proxy_random.health import Stage
+
+
+def make_proxies(count=10):
+    return [
+        Proxy(ip=f"10.0.0.{i}", port=8000 + i, country_code="DE" if i % 2 else "US")
+        for i in range(count)
+    ]
+
+
+@pytest.fixture(params=[list, ProxyColumns], ids=["list", "columns"])
+def storage(request):
+    return request.param
+
+
+def test_filter_by_attributes(storage):
+    query = ProxyQuery(storage(make_proxies()))
+    assert len(query.filter(country_code="DE")) == 5
+    assert [proxy.port for proxy in query.filter(country_code="US", port=8002)] == [8002]
+    assert len(query.filter(country_code="FR")) == 0
+
+
+def test_index_follows_changed_attribute(storage):
+    query = ProxyQuery(storage(make_proxies()))
+    assert len(query.filter(country_code="DE")) == 5
+
+    query[1].country_code = "FR"
+    assert len(query.filter(country_code="FR")) == 1
+    assert len(query.filter(country_code="DE")) == 4
+
+
+def test_index_follows_health(storage):
+    query = ProxyQuery(storage(make_proxies()))
+    assert len(query.filter(working=True)) == 0
+
+    query[2].verified = True
+    query[2].working = True
+    assert list(query.filter(working=True)) == [query[2]]
+
+
+def test_only_the_changed_attribute_is_reindexed():
+    query = ProxyQuery(make_proxies())
+    query.filter(working=True)._proxy_list
+    query.filter(country_code="DE")._proxy_list
+    index = query._indexes["working"]
+
+    query[3].record(True, 0.1)
+    query[4].country_code = "FR"
+    query.filter(working=True)._proxy_list
+    assert query._indexes["working"] is index
+
+
+def test_sorted_index_follows_changes():
+    query = ProxyQuery(make_proxies())
+    query.order_by("last_checked")._proxy_list
+
+    query[4].last_checked = 5.0
+    assert [proxy.last_checked for proxy in query.order_by("last_checked").desc().limit(1)] == [5.0]
+    assert len(query.filter(last_checked=5.0)) == 1
+
+
+def test_plan_is_evaluated_before_add():
+    query = ProxyQuery(make_proxies())
+    german = query.filter(country_code="DE")
+    first = german.limit(3)
+    ordered = query.order_by("port").desc()
+
+    query += ProxyQuery([Proxy(ip="10.0.1.1", port=1, country_code="DE")])
+
+    assert len(german) == 5
+    assert len(first) == 3
+    assert len(ordered) == 10
+    assert len(query.filter(country_code="DE")) == 6
+
+
+def test_plan_is_evaluated_before_remove():
+    proxies = make_proxies()
+    query = ProxyQuery(proxies)
+    american = query.filter(country_code="US")
+
+    query._remove([proxies[0]])
+
+    assert len(american) == 5
+    assert len(query.filter(country_code="US")) == 4
+
+
+def test_add_own_plan():
+    query = ProxyQuery(make_proxies())
+    query += query.filter(country_code="US")
+    assert len(query) == 15
+
+
+def test_plan_is_evaluated_before_a_health_check():
+    async def check(proxy, timeout, session):
+        return True
+
+    query = ProxyQuery(make_proxies(4))
+    dead = query.filter(working=False)
+    checked = query.filter(country_code="DE")
+    dead_germans = checked.filter(working=False)
+
+    checked.check_health(stages=[Stage("fake", check)])
+    query.check_health(stages=[Stage("fake", check)])
+
+    assert len(dead) == 4
+    assert len(dead_germans) == 2
+    assert len(query.filter(working=False)) == 0
+
+
+def test_plan_sees_other_changes_until_it_runs():
+    query = ProxyQuery(make_proxies(4))
+    dead = query.filter(working=False)
+    for proxy in query:
+        proxy.working = True
+
+    assert len(dead) == 0
+
+
+def test_columns_keep_the_proxy_type():
+    proxies = make_proxies(4)
+    for proxy, proxy_type in zip(proxies, ProxyType):
+        proxy.type = proxy_type
+
+    columns = ProxyColumns(proxies)
+    assert [proxy.type for proxy in columns] == list(ProxyType)
+
+    columns[0].type = ProxyType.SOCKS5
+    assert columns[0].type is ProxyType.SOCKS5
+    assert columns[0].to_proxy().type is ProxyType.SOCKS5
+
+
+def test_columns_keep_the_fields():
+    proxies = make_proxies(3)
+    proxies[1].record(True, 0.25)
+    proxies[2].extra = {"source": "test"}
+    columns = ProxyColumns(proxies)
+    for proxy, stored in zip(proxies, columns):
+        copy = stored.to_proxy()
+        for name in ("ip", "port", "country_code", "https", "latency_ewma", "successes", "failures", "extra"):
+            assert getattr(copy, name) == getattr(proxy, name)
+
+
+def test_weighted_prefers_the_fast_proxies(storage):
+    query = ProxyQuery(storage(make_proxies(2)))
+    query[0].record(True, 0.1)
+    query[1].record(True, 0.9)
+    chosen = [query.random("weighted").port for _ in range(2000)]
+    # weights are 1 / score, 9 to 1.
+    assert 0.85 < chosen.count(query[0].port) / len(chosen) < 0.95
+
+
+def test_weighted_table_isnt_rebuilt_by_every_result():
+    query = ProxyQuery(make_proxies(1000))
+    for proxy in query:
+        proxy.record(True, 0.5)
+
+    query.random("weighted")
+    table = query._alias
+    for proxy in list(query)[:5]:
+        proxy.record(True, 0.5)
+
+    query.random("weighted")
+    assert query._alias is table
+
+
+def test_union_dedup_keeps_the_types():
+    def listing(https):
+        return [Proxy(ip="10.0.0.1", port=80, https=https), Proxy(ip="10.0.0.2", port=80, https=https)]
+
+    query = ProxyQuery(listing(True)[:1]).union(ProxyQuery(listing(True)), dedup=True)
+    assert len(query) == 2
+    # the merged duplicate and the proxy listed once have the same type.
+    assert [proxy.type for proxy in query] == [ProxyType.HTTPS, ProxyType.HTTPS]
+
+    # merging doesn't change the type of the first listing.
+    query = ProxyQuery(listing(False)).union(ProxyQuery(listing(True)), dedup=True)
+    assert all(proxy.https for proxy in query)
+    assert [proxy.type for proxy in query] == [ProxyType.HTTP, ProxyType.HTTP]
+
+
+def addresses_of(query, keys):
+    return {key: (query.for_key(key).ip, query.for_key(key).port) for key in keys}
+
+
+def test_for_key_is_stable(storage):
+    keys = [f"session-{i}" for i in range(200)]
+    proxies = make_proxies(20)
+    query = ProxyQuery(storage(proxies))
+    owners = addresses_of(query, keys)
+    assert owners == addresses_of(query, keys)
+    assert len(set(owners.values())) > 10
+    # the ring depends on the addresses, not on the order of the proxies.
+    assert owners == addresses_of(ProxyQuery(storage(proxies[::-1])), keys)
+
+
+def test_for_key_moves_only_the_keys_of_a_removed_proxy():
+    keys = [f"session-{i}" for i in range(200)]
+    query = ProxyQuery(make_proxies(20))
+    owners = addresses_of(query, keys)
+    removed = query[3]
+    query._remove([removed])
+
+    moved = [key for key, owner in addresses_of(query, keys).items() if owner != owners[key]]
+    assert moved
+    assert all(owners[key] == (removed.ip, removed.port) for key in moved)
+
+
+def test_for_key_skips_failing_proxies():
+    keys = [f"session-{i}" for i in range(200)]
+    query = ProxyQuery(make_proxies(20))
+    owners = addresses_of(query, keys)
+    failing = query[5]
+    failing.verified = True
+    failing.working = False
+
+    moved = [key for key, owner in addresses_of(query, keys).items() if owner != owners[key]]
+    assert moved
+    assert all(owners[key] == (failing.ip, failing.port) for key in moved)
+
+    # the keys come back when it works again.
+    failing.working = True
+    assert addresses_of(query, keys) == owners
+
+
+def test_for_key_without_usable_proxies():
+    assert ProxyQuery([]).for_key("a") is None
+    query = ProxyQuery(make_proxies(2))
+    for proxy in query:
+        proxy.verified = True
+
+    assert query.for_key("a") is None
@@ -0,0 +1,130 @@
+import pytest
+from aiohttp import web
+
+from pages import FOOTER, HEADER, ROW
+from proxy_random import RandomProxy
+from proxy_random.extract import parse_response
+from proxy_random.provider import Provider
+
+
+def page(ips):
+    rows = "".join(
+        ROW.format(
+            ip=ip,
+            port=8080,
+            code="DE",
+            country="Germany",
+            anonymity="elite proxy",
+            google="no",
+            https="no",
+            last_checked="1 min ago",
+        )
+        for ip in ips
+    )
+    return HEADER + rows + FOOTER
+
+
+class Pages:
+    """a local provider, the listed ips of each path can be changed between requests, the ETag follows them."""
+
+    def __init__(self):
+        self.lists = {}
+        self.requests = 0
+        self.port = 0
+        self._runner = None
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}/{path}"
+
+    async def _handle(self, request):
+        self.requests += 1
+        path = request.match_info["path"]
+        if path not in self.lists:
+            raise web.HTTPNotFound()
+
+        etag = f'"{hash(tuple(self.lists[path]))}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+
+        return web.Response(text=page(self.lists[path]), content_type="text/html", headers={"ETag": etag})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{path}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *args):
+        await self._runner.cleanup()
+
+
+def addresses(proxies):
+    return sorted(proxy.ip for proxy in proxies)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+async def test_refresh_applies_the_diff(columnar):
+    async with Pages() as pages:
+        pages.lists["a"] = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+        random_proxy = RandomProxy(use_defaults=False, columnar=columnar)
+        random_proxy.add_provider(Provider(pages.url("a"), parse_response))
+        await random_proxy.aextract_proxies()
+        random_proxy.proxy_query[0].verified = True
+        random_proxy.proxy_query[0].working = True
+
+        # not modified
+        assert await random_proxy.arefresh() == ([], [])
+
+        pages.lists["a"] = ["10.0.0.1", "10.0.0.3", "10.0.0.4"]
+        added, removed = await random_proxy.arefresh()
+        assert addresses(added) == ["10.0.0.4"]
+        assert addresses(removed) == ["10.0.0.2"]
+        assert addresses(random_proxy.proxy_query) == ["10.0.0.1", "10.0.0.3", "10.0.0.4"]
+        # the proxies which are still listed keep their health.
+        assert addresses(random_proxy.proxy_query.filter(working=True)) == ["10.0.0.1"]
+
+
+async def test_failing_provider_keeps_the_other_diffs():
+    async with Pages() as pages:
+        pages.lists["a"] = ["10.0.0.1", "10.0.0.2"]
+        pages.lists["b"] = ["10.0.1.1"]
+        random_proxy = RandomProxy(use_defaults=False)
+        random_proxy.add_provider(Provider(pages.url("a"), parse_response))
+        random_proxy.add_provider(Provider(pages.url("b"), parse_response))
+        await random_proxy.aextract_proxies()
+
+        pages.lists["a"] = ["10.0.0.2", "10.0.0.3"]
+        # nothing listens on port 1
+        random_proxy.proxy_providers[1].url = "http://127.0.0.1:1/b"
+        added, removed = await random_proxy.arefresh()
+        assert addresses(added) == ["10.0.0.3"]
+        assert addresses(removed) == ["10.0.0.1"]
+        assert addresses(random_proxy.proxy_query) == ["10.0.0.2", "10.0.0.3", "10.0.1.1"]
+
+        # the diff isn't applied twice
+        assert await random_proxy.arefresh() == ([], [])
+
+
+async def test_dedup_keeps_a_proxy_listed_by_another_provider():
+    async with Pages() as pages:
+        pages.lists["a"] = ["10.0.0.1", "10.0.0.2"]
+        pages.lists["b"] = ["10.0.0.2"]
+        random_proxy = RandomProxy(use_defaults=False, dedup=True)
+        random_proxy.add_provider(Provider(pages.url("a"), parse_response))
+        random_proxy.add_provider(Provider(pages.url("b"), parse_response))
+        await random_proxy.aextract_proxies()
+        assert addresses(random_proxy.proxy_query) == ["10.0.0.1", "10.0.0.2"]
+
+        pages.lists["a"] = ["10.0.0.1"]
+        added, removed = await random_proxy.arefresh()
+        assert added == [] and removed == []
+        assert addresses(random_proxy.proxy_query) == ["10.0.0.1", "10.0.0.2"]
+
+        pages.lists["b"] = []
+        added, removed = await random_proxy.arefresh()
+        assert addresses(removed) == ["10.0.0.2"]
+        assert addresses(random_proxy.proxy_query) == ["10.0.0.1"]
@@ -0,0 +1,83 @@
+import asyncio
+
+from aiohttp_proxy import ProxyType
+
+from proxy_random import Proxy
+from proxy_random.sessions import SessionCache
+
+
+def make_proxies(count):
+    return [Proxy(ip="10.0.0.1", port=port) for port in range(1, count + 1)]
+
+
+async def test_same_proxy_same_session():
+    cache = SessionCache()
+    first, second = make_proxies(2)
+    assert cache.get(first) is cache.get(Proxy(ip="10.0.0.1", port=1))
+    assert cache.get(first) is not cache.get(second)
+
+    socks = Proxy(ip="10.0.0.1", port=1)
+    socks.type = ProxyType.SOCKS5
+    assert cache.get(socks) is not cache.get(first)
+    assert len(cache) == 3
+
+    # a closed session is replaced.
+    session = cache.get(first)
+    await session.close()
+    assert cache.get(first) is not session
+    await cache.close()
+
+
+async def test_least_recently_used_is_evicted():
+    cache = SessionCache(max_size=2)
+    first, second, third = make_proxies(3)
+    sessions = [cache.get(first), cache.get(second)]
+    cache.get(first)
+    cache.get(third)
+    assert len(cache) == 2
+
+    await asyncio.sleep(0.01)
+    # the second one was used least recently.
+    assert sessions[1].closed
+    assert not sessions[0].closed
+    await cache.close()
+
+
+async def test_leased_sessions_arent_evicted():
+    cache = SessionCache(max_size=1)
+    leased, *others = make_proxies(4)
+    async with cache.lease(leased) as session:
+        for proxy in others:
+            cache.get(proxy)
+
+        await asyncio.sleep(0.01)
+        assert not session.closed
+        assert cache.get(leased) is session
+        assert len(cache) == 2
+
+    await cache.close()
+
+
+async def test_close():
+    cache = SessionCache()
+    sessions = [cache.get(proxy) for proxy in make_proxies(3)]
+    await cache.close()
+    assert len(cache) == 0
+    assert all(session.closed for session in sessions)
+
+
+async def test_sessions_belong_to_their_loop():
+    cache = SessionCache()
+    proxy = Proxy(ip="10.0.0.1", port=1)
+    session = cache.get(proxy)
+
+    async def other_loop():
+        other = cache.get(proxy)
+        await cache.close()
+        return other
+
+    # run in a new thread, so it's a new event loop.
+    other = await asyncio.get_running_loop().run_in_executor(None, asyncio.run, other_loop())
+    assert other is not session
+    assert other.closed and not session.closed
+    await cache.close()
@@ -0,0 +1,73 @@
+import json
+
+from proxy_random.health import HealthCache
+from proxy_random.shard import _load_checkpoint, iter_sharded
+from servers import ProxyFarm
+
+TEST_URL = "http://test.invalid/headers"
+
+
+async def check(proxies, **kwargs):
+    return [proxy async for proxy in iter_sharded(proxies, 2, TEST_URL, 2, shard_size=2, **kwargs)]
+
+
+async def test_results_are_copied_to_the_proxies():
+    async with ProxyFarm(working=3, refused=2) as farm:
+        checked = await check(farm.proxies)
+        assert sorted(map(id, checked)) == sorted(map(id, farm.proxies))
+        for proxy in farm.proxies:
+            assert proxy.verified
+            assert proxy.working == (proxy.kind == "working")
+
+
+async def test_copies_count_once_in_the_cache():
+    async with ProxyFarm(refused=2) as farm:
+        cache = HealthCache()
+        checked = await check(farm.proxies * 3, cache=cache)
+        assert len(checked) == 6
+        # one failure in a row each, not one per copy.
+        assert sorted(result[2] for result in cache._results.values()) == [1, 1]
+
+
+async def test_checkpoint_resume(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    async with ProxyFarm(working=4, refused=2) as farm:
+        proxies = list(farm.proxies)
+        interrupted = iter_sharded(proxies, 1, TEST_URL, 2, shard_size=2, checkpoint=checkpoint)
+        async for _ in interrupted:
+            break
+
+        await interrupted.aclose()
+        stored = _load_checkpoint(checkpoint)
+        assert len(stored) >= 2
+
+        # an interrupted write
+        with open(checkpoint, "a") as f:
+            f.write('[["10.0.0.1", 80')
+
+        for proxy in proxies:
+            proxy.verified = False
+
+        checked = await check(proxies, checkpoint=checkpoint)
+        assert len(checked) == len(proxies)
+        assert all(proxy.verified for proxy in proxies)
+        assert sorted(proxy.port for proxy in proxies if proxy.working) == sorted(
+            proxy.port for proxy in proxies if proxy.kind == "working"
+        )
+
+
+async def test_torn_line_doesnt_corrupt_the_next_result(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    checkpoint.write_text('[["10.0.0.1", 80')
+    async with ProxyFarm(working=2) as farm:
+        interrupted = iter_sharded(list(farm.proxies), 1, TEST_URL, 2, shard_size=1, checkpoint=str(checkpoint))
+        async for _ in interrupted:
+            break
+
+        await interrupted.aclose()
+
+    lines = checkpoint.read_text().splitlines()
+    assert lines[0] == '[["10.0.0.1", 80'
+    key, health = json.loads(lines[1])
+    assert key[0] == "127.0.0.1"
+    assert len(_load_checkpoint(str(checkpoint))) == len(lines) - 1
@@ -0,0 +1,109 @@
+import pytest
+
+from proxy_random import Proxy
+from proxy_random.shared import SharedProxyTable
+
+
+def make_proxies(count):
+    proxies = [Proxy(ip=f"10.0.0.{i}", port=8000 + i, https=bool(i % 2)) for i in range(1, count + 1)]
+    for proxy in proxies:
+        proxy.verified = True
+        proxy.working = True
+
+    return proxies
+
+
+@pytest.fixture
+def tables(tmp_path):
+    """the table of the publisher and the same table attached by a worker."""
+    path = str(tmp_path / "proxies")
+    publisher = SharedProxyTable(path, create=True, capacity=8)
+    worker = SharedProxyTable(path)
+    yield publisher, worker
+    worker.close()
+    publisher.close()
+
+
+def addresses(proxies):
+    return sorted((proxy.ip, proxy.port) for proxy in proxies)
+
+
+def test_published_proxies_are_read_by_the_workers(tables):
+    publisher, worker = tables
+    proxies = make_proxies(3)
+    proxies.append(Proxy(ip="2001:db8::1", port=3128))
+    assert publisher.publish(proxies) == 4
+    assert worker.capacity == 8
+    assert len(worker) == 4
+    assert addresses(worker.proxies()) == addresses(proxies)
+    assert worker.get(4) is None
+
+    first = worker.get(0)
+    assert (first.ip, first.port, first.https, first.type) == ("10.0.0.1", 8001, True, proxies[0].type)
+    assert first.working
+    chosen = worker.random()
+    assert (chosen.ip, chosen.port) in addresses(proxies[:3])
+
+
+def test_invalid_proxies_are_left_out(tables):
+    publisher, worker = tables
+    invalid = [Proxy(ip="example.com", port=80), Proxy(ip="10.0.0.9", port=None), Proxy(ip="10.0.0.9", port=70000)]
+    assert publisher.publish(invalid + make_proxies(10)) == 8
+    assert addresses(worker.proxies()) == addresses(make_proxies(8))
+
+
+def test_reports_are_seen_by_every_process(tables):
+    publisher, worker = tables
+    publisher.publish(make_proxies(2))
+    failing = Proxy(ip="10.0.0.1", port=8001)
+    worker.report(failing, False)
+    worker.report(Proxy(ip="10.0.0.2", port=8002), True, 0.5)
+
+    assert publisher.failing() == [("10.0.0.1", 8001)]
+    assert publisher.get(0).failures == 1
+    assert publisher.get(1).latency_ewma == 0.5
+    assert all(worker.random().port == 8002 for _ in range(20))
+
+    # published again, the failing proxy is working until it's reported again.
+    publisher.publish(make_proxies(2))
+    assert publisher.failing() == []
+
+
+def test_report_follows_a_publish_after_the_lookup(tables):
+    publisher, worker = tables
+    proxies = make_proxies(4)
+    publisher.publish(proxies)
+    # a copy, so the published proxies don't carry its recorded results.
+    reported = Proxy(ip=proxies[0].ip, port=proxies[0].port)
+
+    class Racing(SharedProxyTable):
+        raced = False
+
+        def _position(self, proxy):
+            position = super()._position(proxy)
+            if not self.raced:
+                # the publisher reorders the table right after the position is looked up.
+                self.raced = True
+                publisher.publish(proxies[::-1])
+
+            return position
+
+    racing = Racing(worker.path)
+    try:
+        racing.report(reported, False)
+
+    finally:
+        racing.close()
+
+    assert publisher.failing() == [(reported.ip, reported.port)]
+    assert sum(proxy.failures for proxy in publisher.proxies()) == 1
+
+
+def test_not_a_table(tmp_path):
+    path = tmp_path / "empty"
+    path.write_bytes(b"\0" * 4)
+    with pytest.raises(ValueError):
+        SharedProxyTable(str(path))
+
+    with pytest.raises(ValueError):
+        SharedProxyTable(str(tmp_path / "new"), create=True, capacity=0)